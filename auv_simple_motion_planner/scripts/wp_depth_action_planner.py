@@ -29,6 +29,34 @@ from std_msgs.msg import Float64, Header, Bool
 import math
 from visualization_msgs.msg import Marker
 from tf.transformations import quaternion_from_euler
+from smarc_bt.msg import CBFList
+from cola2_msgs.msg import DVL
+
+# the fields of the CBF items we can enforce, in the order of the bound arrays
+CBF_FIELDS = ['depth', 'altitude']
+CBF_DEPTH = 0
+CBF_ALTITUDE = 1
+
+def compile_cbf_list(cbf_items):
+    """
+    (lower, upper) bound arrays, one per CBF_FIELDS entry, that
+    satisfy all the given CBF items at once. Unbounded is -inf/inf.
+    """
+    lower = np.full(len(CBF_FIELDS), -np.inf)
+    upper = np.full(len(CBF_FIELDS), np.inf)
+    items = [item for item in cbf_items if item.checked_field_name in CBF_FIELDS]
+    if len(items) == 0:
+        return lower, upper
+
+    fields = np.array([CBF_FIELDS.index(item.checked_field_name) for item in items])
+    values = np.array([item.limit_value for item in items], dtype=float)
+    types = np.array([item.limit_type for item in items])
+    is_lower = (types == '>') | (types == '>=')
+    is_upper = (types == '<') | (types == '<=')
+    # the tightest of all the limits on the same field
+    np.maximum.at(lower, fields[is_lower], values[is_lower])
+    np.minimum.at(upper, fields[is_upper], values[is_upper])
+    return lower, upper
 
 class WPDepthPlanner(object):
 
@@ -66,6 +94,58 @@ class WPDepthPlanner(object):
     def yaw_feedback_cb(self,yaw_feedback):
         self.yaw_feedback= yaw_feedback.data
 
+    def cbf_list_cb(self, cbf_list):
+        """
+        The BT only lists the limits of conditions that succeeded, so a limit
+        drops out exactly when it is violated. A limit that is not in the list
+        any more is held at its last value, until either:
+            - it was not listed for cbf_hold_time seconds, the BT dropped it for good
+            - the seq goes back, the BT restarted and its old limits are all dropped
+        Keep-alives, same seq again, only refresh the limits they list.
+        """
+        now = rospy.get_time()
+        changed = cbf_list.seq != self.cbf_seq
+        if self.cbf_seq is not None and cbf_list.seq < self.cbf_seq:
+            self.cbf_items = {}
+        for item in cbf_list.cbf_items:
+            key = (item.checked_field_topic, item.checked_field_name, item.limit_type)
+            self.cbf_items[key] = (item, now)
+        for key, (item, listed_at) in list(self.cbf_items.items()):
+            if now - listed_at > self.cbf_hold_time:
+                del self.cbf_items[key]
+                changed = True
+        self.cbf_seq = cbf_list.seq
+        if not changed:
+            return
+        self.cbf_lower, self.cbf_upper = compile_cbf_list([item for item, listed_at in self.cbf_items.values()])
+        rospy.loginfo("CBF limits %d, lower:%s upper:%s", cbf_list.seq, self.cbf_lower, self.cbf_upper)
+
+    def depth_feedback_cb(self, depth):
+        self.depth_feedback = depth.data
+
+    def dvl_cb(self, dvl):
+        self.altitude_feedback = dvl.altitude
+
+    def clip_depth_setpoint(self, depth_setpoint):
+        """
+        The depth setpoint within all the active CBF limits.
+        Altitude limits are turned into depth limits with the
+        water depth, when we know both the depth and altitude.
+        """
+        water_depth = np.nan
+        if self.depth_feedback is not None and self.altitude_feedback is not None:
+            water_depth = self.depth_feedback + self.altitude_feedback
+
+        # depth = depth, depth = water_depth - altitude
+        lowers = np.array([self.cbf_lower[CBF_DEPTH], water_depth - self.cbf_upper[CBF_ALTITUDE]])
+        uppers = np.array([self.cbf_upper[CBF_DEPTH], water_depth - self.cbf_lower[CBF_ALTITUDE]])
+        # if these conflict the upper wins, the shallower one.
+        # not np.clip, what it gives for lower > upper depends on the numpy version
+        clipped = min(max(depth_setpoint, np.nanmax(lowers)), np.nanmin(uppers))
+        if clipped != depth_setpoint:
+            rospy.logwarn_throttle_identical(5, "Depth setpoint %.2f clipped to %.2f by the CBF limits" % (depth_setpoint, clipped))
+        return float(clipped)
+
     def angle_wrap(self,angle):
         if(abs(angle)>3.141516):
             angle= angle - (abs(angle)/angle)*2*3.141516; #Angle wrapping between -pi and pi
@@ -196,7 +276,9 @@ class WPDepthPlanner(object):
 
                 depth_setpoint = self.nav_goal.position.z
 
-            self.depth_pub.publish(depth_setpoint)
+            # enforce the limits of the BT here, at the control rate
+            depth_setpoint_cbf = self.clip_depth_setpoint(depth_setpoint)
+            self.depth_pub.publish(depth_setpoint_cbf)
 	    #self.vbs_pid_enable.publish(False)
             #self.vbs_pub.publish(depth_setpoint)
 
@@ -223,7 +305,7 @@ class WPDepthPlanner(object):
                         self.turbo_turn(yaw_error)
 			self.depth_pid_enable.publish(False)
 			self.vbs_pid_enable.publish(True)
-			self.vbs_pub.publish(depth_setpoint)
+			self.vbs_pub.publish(depth_setpoint_cbf)
                     else:
                         rospy.loginfo_throttle_identical(5,"Normal WP following")
                         #normal turning if the deviation is small
@@ -347,6 +429,19 @@ class WPDepthPlanner(object):
 	roll_setpoint_topic = rospy.get_param('~roll_setpoint_topic', '/sam/ctrl/dynamic_velocity/roll_setpoint')
 	vel_pid_enable_topic = rospy.get_param('~vel_pid_enable_topic', '/sam/ctrl/dynamic_velocity/pid_enable')
 
+        #related to the CBF limits of the BT
+        cbf_topic = rospy.get_param('~cbf_topic', '/sam/cbf_bt/active_limits')
+        depth_feedback_topic = rospy.get_param('~depth_feedback_topic', '/sam/ctrl/odom_listener/depth_feedback')
+        dvl_topic = rospy.get_param('~dvl_topic', '/sam/core/dvl')
+        # seconds a limit that dropped out of the list is still enforced
+        self.cbf_hold_time = rospy.get_param('~cbf_hold_time', 10.)
+        self.cbf_seq = None
+        # (topic, field, limit type) -> (the latest CBFItem for it, rospy.get_time() it was last listed)
+        self.cbf_items = {}
+        self.cbf_lower, self.cbf_upper = compile_cbf_list([])
+        self.depth_feedback = None
+        self.altitude_feedback = None
+
         self.nav_goal = None
 
         self.listener = tf.TransformListener()
@@ -354,6 +449,9 @@ class WPDepthPlanner(object):
 
 	self.yaw_feedback=0
 	rospy.Subscriber(yaw_feedback_topic, Float64, self.yaw_feedback_cb)
+        rospy.Subscriber(cbf_topic, CBFList, self.cbf_list_cb)
+        rospy.Subscriber(depth_feedback_topic, Float64, self.depth_feedback_cb)
+        rospy.Subscriber(dvl_topic, DVL, self.dvl_cb)
 
         self.rpm_pub = rospy.Publisher(rpm_cmd_topic, DualThrusterRPM, queue_size=10)
         self.yaw_pub = rospy.Publisher(heading_setpoint_topic, Float64, queue_size=10)
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+The CBF limits of wp_depth_action_planner, without a node or an action server.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import rospy
+from smarc_bt.msg import CBFItem, CBFList
+
+from wp_depth_action_planner import WPDepthPlanner, compile_cbf_list, CBF_DEPTH, CBF_ALTITUDE
+
+
+def item(field, limit_type, value, topic='/sam/dr/depth'):
+    i = CBFItem()
+    i.checked_field_topic = topic
+    i.checked_field_name = field
+    i.limit_type = limit_type
+    i.limit_value = value
+    return i
+
+def cbf_list(seq, items):
+    l = CBFList()
+    l.seq = seq
+    l.cbf_items = items
+    return l
+
+MAX_DEPTH = item('depth', '<', 10.)
+MIN_ALTITUDE = item('altitude', '>', 5., topic='/sam/core/dvl')
+
+def planner(depth=None, altitude=None):
+    # only what the CBF parts use, __init__ needs a running node
+    p = WPDepthPlanner.__new__(WPDepthPlanner)
+    p.cbf_hold_time = 10.
+    p.cbf_seq = None
+    p.cbf_items = {}
+    p.cbf_lower, p.cbf_upper = compile_cbf_list([])
+    p.depth_feedback = depth
+    p.altitude_feedback = altitude
+    return p
+
+def age(p, seconds):
+    for key, (i, listed_at) in list(p.cbf_items.items()):
+        p.cbf_items[key] = (i, listed_at - seconds)
+
+
+class TestCompileCBFList(unittest.TestCase):
+    def test_unbounded(self):
+        lower, upper = compile_cbf_list([item('roll', '<', 1.)])
+        self.assertTrue(np.all(np.isneginf(lower)))
+        self.assertTrue(np.all(np.isposinf(upper)))
+
+    def test_tightest_limit(self):
+        lower, upper = compile_cbf_list([MAX_DEPTH,
+                                         item('depth', '<=', 8.),
+                                         item('depth', '>', 1.),
+                                         item('depth', '>=', 2.),
+                                         MIN_ALTITUDE])
+        self.assertEqual(upper[CBF_DEPTH], 8.)
+        self.assertEqual(lower[CBF_DEPTH], 2.)
+        self.assertEqual(lower[CBF_ALTITUDE], 5.)
+        self.assertTrue(np.isposinf(upper[CBF_ALTITUDE]))
+
+    def test_conflicting_limits_are_kept(self):
+        lower, upper = compile_cbf_list([item('depth', '>', 9.), item('depth', '<', 3.)])
+        self.assertEqual(lower[CBF_DEPTH], 9.)
+        self.assertEqual(upper[CBF_DEPTH], 3.)
+
+
+class TestClipDepthSetpoint(unittest.TestCase):
+    def clip(self, p, items, setpoint):
+        p.cbf_lower, p.cbf_upper = compile_cbf_list(items)
+        return p.clip_depth_setpoint(setpoint)
+
+    def test_inside(self):
+        self.assertEqual(self.clip(planner(3., 20.), [MAX_DEPTH, MIN_ALTITUDE], 4.), 4.)
+
+    def test_altitude_limit(self):
+        # 23m of water, at least 5m above the bottom
+        self.assertEqual(self.clip(planner(3., 20.), [MAX_DEPTH, MIN_ALTITUDE], 9.), 9.)
+        self.assertEqual(self.clip(planner(3., 10.), [MAX_DEPTH, MIN_ALTITUDE], 9.), 8.)
+
+    def test_nan_water_depth(self):
+        # no altitude yet, only the depth limits apply
+        for p in [planner(), planner(depth=3.), planner(altitude=10.)]:
+            self.assertEqual(self.clip(p, [MAX_DEPTH, MIN_ALTITUDE], 15.), 10.)
+            self.assertEqual(self.clip(p, [MIN_ALTITUDE], 15.), 15.)
+        self.assertEqual(self.clip(planner(float('nan'), 10.), [MAX_DEPTH, MIN_ALTITUDE], 15.), 10.)
+
+    def test_conflicting_limits(self):
+        # at least 8m deep but at most 7m deep by the altitude, the shallower wins
+        items = [MAX_DEPTH, MIN_ALTITUDE, item('depth', '>', 8.)]
+        for setpoint in [0., 7.5, 12.]:
+            self.assertEqual(self.clip(planner(2., 10.), items, setpoint), 7.)
+
+
+class TestHeldLimits(unittest.TestCase):
+    def setUp(self):
+        # get_time without init_node
+        rospy.rostime.set_rostime_initialized(True)
+
+    def test_violated_limit_is_held(self):
+        p = planner()
+        p.cbf_list_cb(cbf_list(1, [MAX_DEPTH, MIN_ALTITUDE]))
+        # C_DepthOK failed, its limit is not listed
+        p.cbf_list_cb(cbf_list(2, [MIN_ALTITUDE]))
+        self.assertEqual(p.cbf_upper[CBF_DEPTH], 10.)
+        self.assertEqual(p.cbf_lower[CBF_ALTITUDE], 5.)
+
+    def test_changed_limit(self):
+        p = planner()
+        p.cbf_list_cb(cbf_list(1, [MAX_DEPTH]))
+        p.cbf_list_cb(cbf_list(2, [item('depth', '<', 20.)]))
+        self.assertEqual(p.cbf_upper[CBF_DEPTH], 20.)
+
+    def test_expired(self):
+        p = planner()
+        p.cbf_list_cb(cbf_list(1, [MAX_DEPTH, MIN_ALTITUDE]))
+        p.cbf_list_cb(cbf_list(2, [MIN_ALTITUDE]))
+        age(p, 5.)
+        # a keep-alive refreshes what it lists
+        p.cbf_list_cb(cbf_list(2, [MIN_ALTITUDE]))
+        self.assertEqual(p.cbf_upper[CBF_DEPTH], 10.)
+        age(p, 6.)
+        p.cbf_list_cb(cbf_list(2, [MIN_ALTITUDE]))
+        self.assertTrue(np.isposinf(p.cbf_upper[CBF_DEPTH]))
+        self.assertEqual(p.cbf_lower[CBF_ALTITUDE], 5.)
+
+    def test_bt_restart(self):
+        p = planner()
+        p.cbf_list_cb(cbf_list(1, [MAX_DEPTH]))
+        p.cbf_list_cb(cbf_list(2, [MAX_DEPTH, MIN_ALTITUDE]))
+        p.cbf_list_cb(cbf_list(1, [MIN_ALTITUDE]))
+        self.assertTrue(np.isposinf(p.cbf_upper[CBF_DEPTH]))
+        self.assertEqual(p.cbf_lower[CBF_ALTITUDE], 5.)
+        self.assertEqual(p.cbf_seq, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
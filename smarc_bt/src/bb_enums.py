@@ -35,8 +35,8 @@ LAST_PLAN_ACTION_FEEDBACK = 'last_plan_action_feedback'
 CURRENTLY_RUNNING_ACTION = 'currently_running_action'
 ENABLE_AUTONOMY = 'enable_autonomy'
 
-TREE_TIP_NAME = 'tree_tip_name'
-TREE_TIP_STATUS = 'tree_tip_status'
+# a bt_profiling.TickTrace, the tip of the last tick is in there
+TICK_TRACE = 'tick_trace'
 
 DVL_IS_RUNNING = 'dvl_is_running'
 
@@ -7,8 +7,8 @@ import py_trees as pt
 import py_trees_ros as ptr
 
 import time
+import threading
 import numpy as np
-from geodesy.utm import fromLatLong, UTMPoint
 
 import rospy
 import tf
@@ -30,8 +30,21 @@ from imc_ros_bridge.msg import EstimatedState, VehicleState, PlanDB, PlanDBInfor
 import bb_enums
 import imc_enums
 import common_globals
+import vehicle_state
 
 from mission_plan import MissionPlan
+from bt_common import bump_bb_version, shared_tf_listener
+from utm_projection import LocalLatLonProjector, UTMZoneResolver
+
+
+def last_tip(bb):
+    """
+    (name, py_trees status) of the tip of the tree after the last tick
+    """
+    tick_trace = bb.get(bb_enums.TICK_TRACE)
+    if tick_trace is None:
+        return '', None
+    return tick_trace.last_tip()
 
 
 class A_SetDVLRunning(pt.behaviour.Behaviour):
@@ -82,20 +95,24 @@ class A_SetDVLRunning(pt.behaviour.Behaviour):
 
 
 class A_SetUTMFromGPS(pt.behaviour.Behaviour):
-    def __init__(self):
+    def __init__(self, hysteresis=common_globals.UTM_ZONE_HYSTERESIS):
         """
         Read GPS fix and set our utm band and zone from it.
         Warn when there is a change in it.
+        The zone only changes once the fix is hysteresis meters into the next one,
+        see utm_projection.UTMZoneResolver
 
         Returns RUNNING until a GPS fix is read.
         Returns SUCCESS afterwards.
         """
 
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         super(A_SetUTMFromGPS, self).__init__("A_SetUTMFromGPS")
 
         self.gps_zone = None
         self.gps_band = None
+        self.zone_resolver = UTMZoneResolver(hysteresis)
 
         # how many seconds to wait before we complain about bad gps.
         # exponential backoff happens to this until max is reached.
@@ -111,27 +128,27 @@ class A_SetUTMFromGPS(pt.behaviour.Behaviour):
             self._spam_period = min(self._spam_period*2, self._max_spam_period)
             return pt.Status.SUCCESS
 
-        self.gps_zone, self.gps_band = fromLatLong(data.latitude, data.longitude).gridZone()
+        self.gps_zone, self.gps_band = self.zone_resolver.resolve(data.latitude, data.longitude)
 
         if self.gps_zone is None or self.gps_band is None:
-            rospy.logwarn_throttle_identical(10, "gps zone and band from fromLatLong was None")
+            rospy.logwarn_throttle_identical(10, "gps zone and band from the zone resolver was None")
             return pt.Status.SUCCESS
 
         # first read the UTMs given by ros params
-        prev_band = self.bb.get(bb_enums.UTM_BAND)
-        prev_zone = self.bb.get(bb_enums.UTM_ZONE)
+        prev_band = self.vs.utm_band
+        prev_zone = self.vs.utm_zone
 
         if prev_zone != self.gps_zone or prev_band != self.gps_band:
             rospy.logwarn_once("PREVIOUS UTM AND GPS_FIX UTM ARE DIFFERENT!\n Prev:"+str((prev_zone, prev_band))+" gps:"+str((self.gps_zone, self.gps_band)))
 
             if common_globals.TRUST_GPS:
                 rospy.logwarn_once("USING GPS UTM!")
-                self.bb.set(bb_enums.UTM_ZONE, self.gps_zone)
-                self.bb.set(bb_enums.UTM_BAND, self.gps_band)
+                self.vs.utm_zone = self.gps_zone
+                self.vs.utm_band = self.gps_band
             else:
                 rospy.logwarn_once("USING PREVIOUS UTM!")
-                self.bb.set(bb_enums.UTM_ZONE, prev_zone)
-                self.bb.set(bb_enums.UTM_BAND, prev_band)
+                self.vs.utm_zone = prev_zone
+                self.vs.utm_band = prev_band
 
         return pt.Status.SUCCESS
 
@@ -189,6 +206,13 @@ class A_EmergencySurfaceByForce(pt.behaviour.Behaviour):
 
     def update(self):
         rospy.logerr_throttle(5, "FORCING EMERGENCY SURFACING")
+        self.force_surface()
+        return pt.Status.RUNNING
+
+    def force_surface(self):
+        """
+        the publishing part of update, also used by bt_watchdog from outside the tree
+        """
         #Disable controllers
         self.lcg_pid_enable.publish(False)
         self.vbs_pid_enable.publish(False)
@@ -207,7 +231,6 @@ class A_EmergencySurfaceByForce(pt.behaviour.Behaviour):
         rpm.thruster_1_rpm = 0.0
         rpm.thruster_2_rpm = 0.0
         self.rpm_pub.publish(rpm)
-        return pt.Status.RUNNING
 
 
 
@@ -233,6 +256,13 @@ class A_EmergencySurface(ptr.actions.ActionClient):
 
         self.action_server_ok = False
 
+        # bt_watchdog sends the goal from its own thread too, this makes sure
+        # only one of us sends it. goal_out is true from sending it until this
+        # behaviour stops running. reentrant so that the watchdog can hold it
+        # around everything it does, including send_goal_once
+        self.goal_lock = threading.RLock()
+        self.goal_out = False
+
     def setup(self, timeout):
         """
         Overwriting the normal ptr action setup to stop it from failiing the setup step
@@ -251,13 +281,32 @@ class A_EmergencySurface(ptr.actions.ActionClient):
 
         return True
 
+    def send_goal_once(self):
+        """
+        send the emergency goal unless it is already out.
+        safe to call from outside the tick, returns True if this call sent it.
+        """
+        with self.goal_lock:
+            if self.goal_out or self.action_client is None:
+                return False
+            self.action_goal_handle = self.action_client.send_goal(MoveBaseGoal(), feedback_cb=self.feedback_cb)
+            self.goal_out = True
+            return True
+
     def initialise(self):
         if not self.action_server_ok:
             return
         rospy.logwarn("EMERGENCY SURFACING")
         # construct the message
         self.action_goal = MoveBaseGoal()
-        self.sent_goal = False
+        # bt_watchdog might have sent it already, then we just follow that one
+        with self.goal_lock:
+            self.sent_goal = self.goal_out
+
+    def terminate(self, new_status):
+        super(A_EmergencySurface, self).terminate(new_status)
+        with self.goal_lock:
+            self.goal_out = False
 
     def update(self):
         if not self.action_server_ok:
@@ -279,10 +328,12 @@ class A_EmergencySurface(ptr.actions.ActionClient):
 
         # if goal hasn't been sent yet
         if not self.sent_goal:
-            self.action_goal_handle = self.action_client.send_goal(self.action_goal, feedback_cb=self.feedback_cb)
+            if self.send_goal_once():
+                rospy.loginfo("Sent goal to action server:"+str(self.action_goal))
+                self.feedback_message = "Emergency goal sent"
+            else:
+                self.feedback_message = "Emergency goal was already sent"
             self.sent_goal = True
-            rospy.loginfo("Sent goal to action server:"+str(self.action_goal))
-            self.feedback_message = "Emergency goal sent"
             return pt.Status.RUNNING
 
 
@@ -350,11 +401,13 @@ class A_RefineMission(pt.behaviour.Behaviour):
         if self.no_service() or not self.service_ok:
             # there is no path planner, just copy the coarse points to the refined side
             mission_plan.set_refined_waypoints(mission_plan.waypoints)
+            bump_bb_version(bb_enums.MISSION_PLAN_OBJ)
             return pt.Status.SUCCESS
 
         if len(mission_plan.waypoints) <= 1:
             # there is literally just one point, cant plan for that apparently
             mission_plan.set_refined_waypoints(mission_plan.waypoints)
+            bump_bb_version(bb_enums.MISSION_PLAN_OBJ)
             return pt.Status.SUCCESS
 
 
@@ -366,6 +419,7 @@ class A_RefineMission(pt.behaviour.Behaviour):
         refined_path.header.frame_id = 'map'
         self.path_pub.publish(refined_path)
         mission_plan.set_refined_waypoints(mission_plan.path_to_list(refined_path))
+        bump_bb_version(bb_enums.MISSION_PLAN_OBJ)
         rospy.loginfo_throttle_identical(10, "Refined waypoints length:"+str(len(mission_plan.refined_waypoints)))
         return pt.Status.SUCCESS
 
@@ -530,19 +584,23 @@ class A_GotoWaypoint(ptr.actions.ActionClient):
 
 
 class A_UpdateTF(pt.behaviour.Behaviour):
-    def __init__(self, utm_link, base_link):
+    def __init__(self, utm_link, base_link, tf_listener=None):
         """
         reads the current translation and orientation from the TF tree
         and puts that into the BB
 
         utm_link and base_link are tf link names where utm_link is essentially the world coordinates.
         check the neptus-related actions too for more info on utm_link
+        tf_listener defaults to bt_common.shared_tf_listener()
         """
         super(A_UpdateTF, self).__init__("A_UpdateTF")
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.utm_link = utm_link
         self.base_link = base_link
-        self.listener = tf.TransformListener()
+        if tf_listener is None:
+            tf_listener = shared_tf_listener()
+        self.listener = tf_listener
         self.tf_ok = False
 
 
@@ -569,8 +627,8 @@ class A_UpdateTF(pt.behaviour.Behaviour):
             rospy.logerr_throttle_identical(5, "Could not do tf lookup for some other reason")
             return pt.Status.FAILURE
 
-        self.bb.set(bb_enums.WORLD_TRANS, world_trans)
-        self.bb.set(bb_enums.WORLD_ROT, world_rot)
+        self.vs.world_trans = world_trans
+        self.vs.world_rot = world_rot
         # also create this pointstamped object so that we can transform this
         # easily to w/e other frame is needed later
         ps = PointStamped()
@@ -590,16 +648,23 @@ class A_UpdateLatLon(pt.behaviour.Behaviour):
     we might not have GPS, but tf is updated by dead-reckoninig and does all
     kinds of filtering.
     """
-    def __init__(self):
+    def __init__(self,
+                 refresh_distance=common_globals.LATLON_REFRESH_DISTANCE,
+                 max_error=common_globals.LATLON_MAX_ERROR):
+        """
+        refresh_distance and max_error in meters, see utm_projection.LocalLatLonProjector
+        """
         super(A_UpdateLatLon, self).__init__("A_UpdateLatLon")
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
+        self.projector = LocalLatLonProjector(refresh_distance, max_error)
 
     def update(self):
-        world_trans = self.bb.get(bb_enums.WORLD_TRANS)
+        world_trans = self.vs.world_trans
 
         # get the utm zone of our current lat,lon
-        utmz = self.bb.get(bb_enums.UTM_ZONE)
-        band = self.bb.get(bb_enums.UTM_BAND)
+        utmz = self.vs.utm_zone
+        band = self.vs.utm_band
 
         if utmz is None or band is None or world_trans is None:
             reason = "Could not update current lat/lon!"
@@ -610,12 +675,8 @@ class A_UpdateLatLon(pt.behaviour.Behaviour):
 
         # get positional feedback of the p2p goal
         easting, northing = world_trans[0], world_trans[1]
-        # make utm point
-        pnt = UTMPoint(easting=easting, northing=northing, altitude=0, zone=utmz, band=band)
-        # get lat-lon
-        pnt = pnt.toMsg()
-        self.bb.set(bb_enums.CURRENT_LATITUDE, pnt.latitude)
-        self.bb.set(bb_enums.CURRENT_LONGITUDE, pnt.longitude)
+        # get lat-lon, the full inverse projection only every few hundred meters
+        self.vs.lat, self.vs.lon = self.projector.to_latlon(easting, northing, utmz, band)
         return pt.Status.SUCCESS
 
 
@@ -702,6 +763,7 @@ class A_UpdateNeptusEstimatedState(pt.behaviour.Behaviour):
     def __init__(self, estimated_state_topic):
         super(A_UpdateNeptusEstimatedState, self).__init__("A_UpdateNeptusEstimatedState")
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.estimated_state_pub = None
         self.estimated_state_topic = estimated_state_topic
 
@@ -711,10 +773,11 @@ class A_UpdateNeptusEstimatedState(pt.behaviour.Behaviour):
 
 
     def update(self):
-        lat = self.bb.get(bb_enums.CURRENT_LATITUDE)
-        lon = self.bb.get(bb_enums.CURRENT_LONGITUDE)
-        depth = self.bb.get(bb_enums.DEPTH)
-        world_rot = self.bb.get(bb_enums.WORLD_ROT)
+        vs = self.vs
+        lat = vs.lat
+        lon = vs.lon
+        depth = vs.depth
+        world_rot = vs.world_rot
 
         if depth is None:
             reason = "depth was None, using 0"
@@ -754,27 +817,25 @@ class A_UpdateNeptusPlanControlState(pt.behaviour.Behaviour):
     def update(self):
         # construct current progress message for neptus
         msg = PlanControlState()
-        tip_name = self.bb.get(bb_enums.TREE_TIP_NAME)
-        tip_status = self.bb.get(bb_enums.TREE_TIP_STATUS)
+        tip_name, tip_status = last_tip(self.bb)
 
-        # this tip_status looks like: "Status.FAILURE"
-        # I just wanna get the first letter after dot.
-        msg.man_id = tip_name+'('+tip_status[7]+')'
+        # just the first letter of the status, S,F,R,I or X if there is no tip
+        if tip_status is None:
+            msg.man_id = tip_name+'(X)'
+        else:
+            msg.man_id = tip_name+'('+tip_status.name[0]+')'
 
         mission_plan = self.bb.get(bb_enums.MISSION_PLAN_OBJ)
         if mission_plan is None or mission_plan.is_complete():
             msg.plan_id = 'No plan'
             msg.plan_progress = 100.0
         else:
-            current_wp_index = mission_plan.current_wp_index
-            current_man_id = mission_plan.waypoint_man_ids[current_wp_index]
-            total = len(mission_plan.waypoints)
+            current_man_id = mission_plan.waypoint_man_ids[mission_plan.current_wp_index]
             msg.plan_id = str(mission_plan.plan_id)
             if self.bb.get(bb_enums.PLAN_IS_GO):
                 msg.man_id = current_man_id
 
-            plan_progress = (current_wp_index * 100.0) / total # percent float
-            msg.plan_progress = plan_progress
+            msg.plan_progress = mission_plan.get_progress() # percent float
 
 
         if tip_name in imc_enums.EXECUTING_ACTION_NAMES:
@@ -813,7 +874,7 @@ class A_UpdateNeptusVehicleState(pt.behaviour.Behaviour):
         """
         vs = VehicleState()
 
-        tip_name = self.bb.get(bb_enums.TREE_TIP_NAME)
+        tip_name, tip_status = last_tip(self.bb)
 
         if tip_name in imc_enums.EXECUTING_ACTION_NAMES:
             vs.op_mode = imc_enums.OP_MODE_MANEUVER
@@ -845,10 +906,69 @@ class A_UpdateNeptusPlanDB(pt.behaviour.Behaviour):
         self.latest_plandb_msg = None
         self.plandb_topic = plandb_topic
 
+        # reading a plan can wait for tf for seconds, so it is done on
+        # a thread of its own while the tree keeps ticking.
+        # these are guarded by _plan_cond
+        self._plan_cond = threading.Condition()
+        self._unread_plandb = None
+        self._reading_plandb = False
+        self._read_plan = None
+        self._plan_reader = None
+        # the last SET message given to the reader, so it is read only once
+        self._last_set_msg = None
+
 
     def setup(self, timeout):
         self.plandb_pub = rospy.Publisher(self.plandb_topic, PlanDB, queue_size=1)
         self.plandb_sub = rospy.Subscriber(self.plandb_topic, PlanDB, callback=self.plandb_cb, queue_size=1)
+        if self._plan_reader is None:
+            self._plan_reader = threading.Thread(target=self._read_plans, name="plandb_reader")
+            self._plan_reader.daemon = True
+            self._plan_reader.start()
+        return True
+
+
+    def _read_plans(self):
+        while True:
+            with self._plan_cond:
+                while self._unread_plandb is None:
+                    self._plan_cond.wait()
+                plandb_msg = self._unread_plandb
+                self._unread_plandb = None
+                self._reading_plandb = True
+
+            mission_plan = None
+            try:
+                mission_plan = MissionPlan(plan_frame = self.utm_link,
+                                           local_frame = self.local_link,
+                                           plandb_msg = plandb_msg)
+            except Exception as e:
+                # a bad plan should not stop us from reading the next one
+                rospy.logerr("Could not read plan {}: {}".format(plandb_msg.plan_id, e))
+            finally:
+                with self._plan_cond:
+                    self._reading_plandb = False
+                    # a newer plan came while reading this one, that one wins
+                    if mission_plan is not None and self._unread_plandb is None:
+                        self._read_plan = mission_plan
+                    self._plan_cond.notify_all()
+
+
+    def wait_for_plan(self, timeout=None):
+        """
+        block until the plans given so far are read, not swapped in yet.
+        True if there is nothing left to read.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._plan_cond:
+            while self._unread_plandb is not None or self._reading_plandb:
+                if deadline is None:
+                    self._plan_cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._plan_cond.wait(remaining)
         return True
 
 
@@ -912,10 +1032,24 @@ class A_UpdateNeptusPlanDB(pt.behaviour.Behaviour):
 
     def handle_set_plan(self, plandb_msg):
         # there is a plan we can at least look at
-        mission_plan = MissionPlan(plan_frame = self.utm_link,
-                                   local_frame = self.local_link,
-                                   plandb_msg = plandb_msg)
-
+        # the reader thread makes the MissionPlan, swap_in_read_plan puts it in the bb
+        if plandb_msg is self._last_set_msg:
+            return
+        self._last_set_msg = plandb_msg
+        with self._plan_cond:
+            self._unread_plandb = plandb_msg
+            self._read_plan = None
+            self._plan_cond.notify_all()
+        rospy.loginfo_throttle_identical(5, "Reading new plan:"+str(plandb_msg.plan_id))
+
+
+    def swap_in_read_plan(self):
+        # in the tick, so the tree never sees the plan change half way through a tick
+        with self._plan_cond:
+            mission_plan = self._read_plan
+            self._read_plan = None
+        if mission_plan is None:
+            return
 
         self.bb.set(bb_enums.MISSION_PLAN_OBJ, mission_plan)
         self.bb.set(bb_enums.ENABLE_AUTONOMY, False)
@@ -967,6 +1101,7 @@ class A_UpdateNeptusPlanDB(pt.behaviour.Behaviour):
         rospy.loginfo_throttle_identical(30, "Answered set success for plan_id:"+str(plan_id))
 
     def update(self):
+        self.swap_in_read_plan()
         # we just want to tell neptus we got the plan all the time
         # this keeps the thingy green
         self.respond_set_success()
@@ -980,13 +1115,15 @@ class A_UpdateMissonForPOI(pt.behaviour.Behaviour):
     and sets that as the current mission plan.
     always returns SUCCESS
     """
-    def __init__(self, utm_link, local_link, poi_link):
+    def __init__(self, utm_link, local_link, poi_link, tf_listener=None):
         super(A_UpdateMissonForPOI, self).__init__(name="A_UpdateMissonForPOI")
         self.bb = pt.blackboard.Blackboard()
         self.utm_link = utm_link
         self.local_link = local_link
         self.poi_link = poi_link
-        self.tf_listener = tf.TransformListener()
+        if tf_listener is None:
+            tf_listener = shared_tf_listener()
+        self.tf_listener = tf_listener
 
         self.poi_link_available = False
 
@@ -1041,7 +1178,8 @@ class A_UpdateMissonForPOI(pt.behaviour.Behaviour):
                                    local_frame = self.local_link,
                                    plandb_msg = pdb,
                                    waypoints = waypoints,
-                                   waypoint_man_ids=waypoint_man_ids)
+                                   waypoint_man_ids=waypoint_man_ids,
+                                   tf_listener = self.tf_listener)
 
         self.bb.set(bb_enums.MISSION_PLAN_OBJ, mission_plan)
 
@@ -1050,28 +1188,47 @@ class A_UpdateMissonForPOI(pt.behaviour.Behaviour):
 
 class A_VizPublishPlan(pt.behaviour.Behaviour):
     """
-    Publishes the current plans waypoints as a PoseArray
+    Publishes the current plans waypoints as a PoseArray.
+    Latched, and only when the plan or its version changes, new subscribers get it from the latch.
+    If heartbeat_period is set, the same plan is also published again after that many seconds.
     """
-    def __init__(self, plan_viz_topic):
+    def __init__(self, plan_viz_topic, heartbeat_period=common_globals.PLAN_VIZ_HEARTBEAT_PERIOD):
         super(A_VizPublishPlan, self).__init__(name="A_VizPublishPlan")
         self.bb = pt.blackboard.Blackboard()
         self.pa_pub = None
         self.plan_viz_topic = plan_viz_topic
+        self.heartbeat_period = heartbeat_period
+
+        self.num_published = 0
+        # version of the plan that was published last, None for no plan
+        self._published_version = None
+        self._last_publish_time = None
 
     def setup(self, timeout):
-        self.pa_pub = rospy.Publisher(self.plan_viz_topic, PoseArray, queue_size=1)
+        self.pa_pub = rospy.Publisher(self.plan_viz_topic, PoseArray, queue_size=1, latch=True)
+        # a new publisher, it has not published anything yet
+        self._last_publish_time = None
         return True
 
 
     def update(self):
         mission = self.bb.get(bb_enums.MISSION_PLAN_OBJ)
+        version = None if mission is None else mission.version
+
+        now = time.time()
+        if self._last_publish_time is not None and version == self._published_version:
+            if self.heartbeat_period is None or now - self._last_publish_time < self.heartbeat_period:
+                return pt.Status.SUCCESS
+
         if mission is not None:
             pa = mission.get_pose_array(flip_z=True)
         else:
             pa = PoseArray()
 
         self.pa_pub.publish(pa)
-
+        self.num_published += 1
+        self._published_version = version
+        self._last_publish_time = now
 
         return pt.Status.SUCCESS
 
@@ -0,0 +1,924 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Headless tick-throughput benchmark for the full sam tree.
+Builds const_tree(AUVConfig()) against the stand-ins in bt_standins
+and ticks it with scripted sensor data, no ros master needed.
+
+    python bt_bench.py --ticks 2000 --waypoints 50
+    python bt_bench.py --check-compiled
+    python bt_bench.py --check-watchdog
+"""
+
+import argparse
+import gc
+import math
+import random
+import sys
+import threading
+import time
+
+import bt_standins
+# must happen before any behaviour is constructed
+WORLD = bt_standins.install()
+
+import py_trees as pt
+import rospy
+
+from std_msgs.msg import Float64, Empty
+from sam_msgs.msg import Leak
+from cola2_msgs.msg import DVL
+from sensor_msgs.msg import NavSatFix
+from geodesy.utm import fromLatLong, UTMPoint, gridZone
+from imc_ros_bridge.msg import PlanDB, PlanControl, PlanSpecification, Maneuver
+from geometry_msgs.msg import PoseStamped, PointStamped
+from actionlib_msgs.msg import GoalStatus
+from trajectories.srv import trajectoryResponse
+import roslib.message
+
+import bb_enums
+import vehicle_state
+import imc_enums
+import common_globals
+from auv_config import AUVConfig
+from bt_profiling import TickProfiler, TickTrace
+from bt_compiled import CompiledTree
+from bt_journal import TickJournal, read_journal, read_journal_nodes
+from bt_latency import LatencyMonitor
+from bt_watchdog import EmergencyWatchdog
+from bt_actions import A_EmergencySurface, A_EmergencySurfaceByForce, A_UpdateNeptusPlanDB, A_VizPublishPlan
+import bt_common
+from mission_plan import MissionPlan
+from utm_projection import latlon_to_utm, LocalLatLonProjector, UTMZoneResolver, grid_zone_cell
+
+
+# biograd, same place as the example plandb message
+ORIGIN_LAT = 43.93
+ORIGIN_LON = 15.44
+
+
+
+def make_plandb(plan_id, latlons_deg, depth=2.0):
+    """
+    a PlanDB SET request with one Goto per given (lat, lon)
+    """
+    # the element type of the maneuvers list is not imported anywhere else
+    maneuvers_type = PlanSpecification._slot_types[PlanSpecification.__slots__.index('maneuvers')]
+    PlanManeuver = roslib.message.get_message_class(maneuvers_type.rstrip('[]'))
+
+    plandb = PlanDB()
+    plandb.type = imc_enums.PLANDB_TYPE_REQUEST
+    plandb.op = imc_enums.PLANDB_OP_SET
+    plandb.request_id = 1
+    plandb.plan_id = plan_id
+    plandb.plan_spec.plan_id = plan_id
+    for i, (lat, lon) in enumerate(latlons_deg):
+        pm = PlanManeuver()
+        pm.maneuver_id = "Goto"+str(i+1)
+        pm.maneuver = Maneuver()
+        pm.maneuver.maneuver_name = 'goto'
+        pm.maneuver.maneuver_imc_id = imc_enums.MANEUVER_GOTO
+        pm.maneuver.lat = math.radians(lat)
+        pm.maneuver.lon = math.radians(lon)
+        pm.maneuver.z = depth
+        plandb.plan_spec.maneuvers.append(pm)
+    return plandb
+
+
+def lawnmower_latlons(num_waypoints, leg_length=100., spacing=10.):
+    """
+    a survey pattern around the origin, in degrees
+    """
+    latlons = []
+    m_per_deg_lat = 111320.
+    m_per_deg_lon = 111320. * math.cos(math.radians(ORIGIN_LAT))
+    for i in range(num_waypoints):
+        leg = i//2
+        x = leg_length if (i%4 in [1,2]) else 0.
+        y = leg*spacing
+        latlons.append((ORIGIN_LAT + y/m_per_deg_lat, ORIGIN_LON + x/m_per_deg_lon))
+    return latlons
+
+
+def interpolate_path(req, points_per_segment=3):
+    """
+    stand-in for the path planner service, a straight line
+    of points_per_segment points between every two coarse poses
+    """
+    res = trajectoryResponse()
+    poses = req.coarse.poses
+    for a, b in zip(poses[:-1], poses[1:]):
+        for k in range(points_per_segment):
+            t = float(k) / points_per_segment
+            ps = PoseStamped()
+            ps.pose.position.x = a.position.x + t*(b.position.x - a.position.x)
+            ps.pose.position.y = a.position.y + t*(b.position.y - a.position.y)
+            ps.pose.position.z = a.position.z + t*(b.position.z - a.position.z)
+            res.fine.poses.append(ps)
+    if len(poses) > 0:
+        ps = PoseStamped()
+        ps.pose = poses[-1]
+        res.fine.poses.append(ps)
+    return res
+
+
+
+class ScriptedMission(object):
+    """
+    Feeds the tree the same sensor data, tf and neptus messages every run.
+    """
+    def __init__(self, config, num_waypoints=20, goto_steps=3, start_tick=2, leak_tick=None):
+        self.config = config
+        self.num_waypoints = num_waypoints
+        self.start_tick = start_tick
+        # from this tick on, there is a leak
+        self.leak_tick = leak_tick
+
+        utm = fromLatLong(ORIGIN_LAT, ORIGIN_LON)
+        self.origin_e = utm.easting
+        self.origin_n = utm.northing
+
+        WORLD.action_durations[config.ACTION_NAMESPACE] = goto_steps
+        if config.PATH_PLANNER_NAME is not None:
+            WORLD.service_handlers[config.PATH_PLANNER_NAME] = interpolate_path
+        # map is at the origin, no rotation
+        WORLD.set_transform(config.LOCAL_LINK, config.UTM_LINK, (-self.origin_e, -self.origin_n, 0.))
+        WORLD.set_transform(config.UTM_LINK, config.LOCAL_LINK, (self.origin_e, self.origin_n, 0.))
+        self._move(0)
+
+        self.plandb = make_plandb('bench', lawnmower_latlons(num_waypoints))
+        self.start_msg = PlanControl()
+        self.start_msg.type = 0
+        self.start_msg.op = 0
+        self.start_msg.plan_id = 'bench'
+        self.start_msg.flags = 1
+
+    def _move(self, i):
+        depth = 2. + 0.5*math.sin(i*0.1)
+        trans = (self.origin_e + 0.5*i, self.origin_n + 0.1*i, -depth)
+        WORLD.set_transform(self.config.UTM_LINK, self.config.BASE_LINK, trans)
+        return depth
+
+    def feed(self, i):
+        c = self.config
+        depth = self._move(i)
+        WORLD.inject(c.DEPTH_TOPIC, Float64(depth))
+
+        dvl = DVL()
+        dvl.header.stamp = rospy.Time.now()
+        dvl.altitude = 10. + math.cos(i*0.05)
+        WORLD.inject(c.ALTITUDE_TOPIC, dvl)
+
+        leak = Leak()
+        leak.value = self.leak_tick is not None and i >= self.leak_tick
+        WORLD.inject(c.LEAK_TOPIC, leak)
+
+        fix = NavSatFix()
+        fix.latitude = ORIGIN_LAT
+        fix.longitude = ORIGIN_LON
+        WORLD.inject(c.GPS_FIX_TOPIC, fix)
+
+        if i == 0:
+            WORLD.inject(c.PLANDB_TOPIC, self.plandb)
+        if i == self.start_tick:
+            WORLD.inject(c.PLAN_CONTROL_TOPIC, self.start_msg)
+
+
+
+def build_tree(config):
+    """
+    the full sam tree, set up against the stand-ins.
+    ticked through a plain py_trees tree so that the ros snapshot
+    publishing of py_trees_ros is not part of the measurement.
+    """
+    import sam_bt
+    vehicle_state.install_blackboard_shim()
+    bb = pt.blackboard.Blackboard()
+    bb.set(bb_enums.UTM_ZONE, common_globals.DEFAULT_UTM_ZONE)
+    bb.set(bb_enums.UTM_BAND, common_globals.DEFAULT_UTM_BAND)
+    ros_tree = sam_bt.const_tree(config)
+    tree = pt.trees.BehaviourTree(ros_tree.root)
+    tree.setup(timeout=0.)
+    bt_common.CBF_ACCUMULATOR.attach(tree)
+    bt_common.shared_tf_listener().attach(tree)
+    return tree
+
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 0:
+        return 0.
+    i = int(round((len(sorted_values)-1) * p / 100.))
+    return sorted_values[i]
+
+
+def forget_previous_run():
+    """
+    so that a tree built earlier in this process does not see the next run
+    """
+    WORLD.reset()
+    pt.blackboard.Blackboard().__dict__.clear()
+    vehicle_state.VEHICLE_STATE.reset()
+
+
+def bench_config():
+    return AUVConfig()
+
+
+def fresh_mission(**kwargs):
+    """
+    what every run and check starts with, a clean world and a scripted mission on it.
+    kwargs go to ScriptedMission. returns (config, mission)
+    """
+    forget_previous_run()
+    config = bench_config()
+    return config, ScriptedMission(config, **kwargs)
+
+
+def run(num_ticks, num_waypoints=20, warmup=10, profile=False, trace_malloc=False, skip_unchanged=False, compiled=False, journal_path=None, latency=False):
+    if skip_unchanged:
+        bt_common.install_blackboard_versions()
+    config, mission = fresh_mission(num_waypoints=num_waypoints)
+    tree = build_tree(config)
+    bb = pt.blackboard.Blackboard()
+    tick_trace = TickTrace(tree.root)
+    bb.set(bb_enums.TICK_TRACE, tick_trace)
+    ticker = tree
+    if compiled:
+        ticker = CompiledTree(tree)
+    latency_monitor = None
+    if latency:
+        import sam_bt
+        latency_monitor = LatencyMonitor()
+        latency_monitor.instrument(tree.root, sam_bt.SENSOR_CONSUMERS)
+    journal = None
+    if journal_path is not None:
+        journal = TickJournal(journal_path, common_globals.JOURNAL_MAX_BYTES, tick_trace,
+                              keep_previous=common_globals.JOURNAL_KEEP_PREVIOUS)
+
+    profiler = None
+    if profile:
+        profiler = TickProfiler(tree.root, common_globals.PROFILED_SUBTREES)
+
+    tracemalloc = None
+    if trace_malloc:
+        # python3 only
+        import tracemalloc
+        tracemalloc.start()
+
+    durations = []
+    # net gc-tracked objects created per tick. works on python 2 and 3
+    # but temporaries that die within the tick cancel out.
+    net_objs = []
+    # bytes allocated at the peak of the tick, only with tracemalloc
+    peak_bytes = []
+    for i in range(warmup + num_ticks):
+        mission.feed(i)
+        if tracemalloc is not None:
+            tracemalloc.clear_traces()
+        gc.disable()
+        c0 = gc.get_count()[0]
+        t0 = time.time()
+        if profiler is not None:
+            profiler.start_tick()
+        ticker.tick()
+        tick_trace.record(tree.tip(), time.time() - t0)
+        if journal is not None:
+            journal.record(vehicle_state.VEHICLE_STATE, bb)
+        if profiler is not None:
+            profiler.end_tick()
+        t1 = time.time()
+        c1 = gc.get_count()[0]
+        gc.enable()
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+        WORLD.step()
+        if i >= warmup:
+            durations.append(t1-t0)
+            net_objs.append(c1-c0)
+            if tracemalloc is not None:
+                peak_bytes.append(peak)
+
+    if tracemalloc is not None:
+        tracemalloc.stop()
+    if journal is not None:
+        journal.close()
+
+    durations.sort()
+    total = sum(durations)
+    results = {
+        'ticks': num_ticks,
+        'ticks_per_sec': num_ticks/total if total > 0 else float('inf'),
+        'p50_ms': percentile(durations, 50)*1000,
+        'p99_ms': percentile(durations, 99)*1000,
+        'max_ms': durations[-1]*1000 if durations else 0.,
+        'net_objs_per_tick': float(sum(net_objs))/max(1, len(net_objs)),
+        'tip': tree.root.tip().name if tree.root.tip() is not None else None,
+    }
+    if tracemalloc is not None:
+        results['peak_kb_per_tick'] = sum(peak_bytes)/1024./max(1, len(peak_bytes))
+    if profiler is not None:
+        results['profile'] = profiler.report() + bt_common.shared_tf_listener().stats()
+    if latency_monitor is not None:
+        results['latency'] = latency_monitor.report()
+    return results
+
+
+
+def trace_mission(num_ticks, num_waypoints, compiled, leak_tick=None):
+    """
+    the status of every node after every tick of the scripted mission
+    """
+    config, mission = fresh_mission(num_waypoints=num_waypoints, leak_tick=leak_tick)
+    tree = build_tree(config)
+    bb = pt.blackboard.Blackboard()
+    tick_trace = TickTrace(tree.root)
+    bb.set(bb_enums.TICK_TRACE, tick_trace)
+    ticker = CompiledTree(tree) if compiled else tree
+    nodes = list(tree.root.iterate())
+    # plans are read on another thread, wait for them so that
+    # they are swapped in on the same tick every time
+    plan_readers = [n for n in nodes if isinstance(n, A_UpdateNeptusPlanDB)]
+    trace = []
+    for i in range(num_ticks):
+        mission.feed(i)
+        ticker.tick()
+        for reader in plan_readers:
+            reader.wait_for_plan()
+        tick_trace.record(tree.tip(), 0.)
+        WORLD.step()
+        tip = tree.root.tip()
+        trace.append((tip.name if tip is not None else None,
+                      tuple(n.status for n in nodes)))
+    return [n.name for n in nodes], trace
+
+
+def check_compiled(num_ticks, num_waypoints=20, leak_tick=None):
+    """
+    tick the same mission with tree.tick() and with a CompiledTree,
+    returns a list of the differences, empty if they agree on every node on every tick
+    """
+    names, expected = trace_mission(num_ticks, num_waypoints, compiled=False, leak_tick=leak_tick)
+    _, got = trace_mission(num_ticks, num_waypoints, compiled=True, leak_tick=leak_tick)
+    diffs = []
+    for i, ((e_tip, e_statuses), (g_tip, g_statuses)) in enumerate(zip(expected, got)):
+        if e_tip != g_tip:
+            diffs.append("tick {}: tip {} != {}".format(i, g_tip, e_tip))
+        for name, e, g in zip(names, e_statuses, g_statuses):
+            if e != g:
+                diffs.append("tick {}: {} is {}, should be {}".format(i, name, g, e))
+    return diffs
+
+
+def check_watchdog(num_trials, by_force=False, ticks_before=10, delay_tree_delivery=False):
+    """
+    stub publishers send a leak or an abort from their own thread while the tree
+    is ticking, the bt_watchdog.EmergencyWatchdog should start surfacing within
+    common_globals.EMERGENCY_DISPATCH_BOUND and the tree should follow its goal
+    on the next tick instead of sending another.
+    with delay_tree_delivery the message only reaches the watchdog, like when the
+    subscriber of the tree is late, the tree should still not send a new maneuver goal.
+    returns the dispatch latencies in seconds and a list of problems
+    """
+    latencies = []
+    problems = []
+    for trial in range(num_trials):
+        reason = 'leak' if trial % 2 == 0 else 'abort'
+        config, mission = fresh_mission()
+        # surfacing takes longer than this check
+        WORLD.action_durations[config.EMERGENCY_ACTION_NAMESPACE] = 1000
+        tree = build_tree(config)
+        for i in range(ticks_before):
+            mission.feed(i)
+            tree.tick()
+            WORLD.step()
+
+        emergency_action = [n for n in tree.root.iterate() if isinstance(n, A_EmergencySurface)][0]
+        maneuver_names = pt.blackboard.Blackboard().get(bb_enums.MANEUVER_ACTIONS)
+        maneuver_actions = [n for n in tree.root.iterate() if n.name in maneuver_names and hasattr(n, 'action_client')]
+        readers = dict((n.name, n) for n in tree.root.iterate() if n.name in ("A_ReadLeak", "A_ReadAbort"))
+        # maneuver goals sent when the watchdog is done, the tree may still be ticking
+        maneuver_goals = []
+        def count_maneuver_goals():
+            maneuver_goals[:] = [a.action_client.num_goals_sent for a in maneuver_actions if a.action_client is not None]
+        force = None
+        if by_force:
+            force = A_EmergencySurfaceByForce(config.EMERGENCY_TOPIC,
+                                              config.VBS_CMD_TOPIC,
+                                              config.RPM_CMD_TOPIC,
+                                              config.LCG_PID_ENABLE_TOPIC,
+                                              config.VBS_PID_ENABLE_TOPIC,
+                                              config.TCG_PID_ENABLE_TOPIC,
+                                              config.YAW_PID_ENABLE_TOPIC,
+                                              config.DEPTH_PID_ENABLE_TOPIC,
+                                              config.VEL_PID_ENABLE_TOPIC)
+            force.setup(0.)
+        watchdog = EmergencyWatchdog(config.LEAK_TOPIC,
+                                     config.ABORT_TOPIC,
+                                     emergency_action = emergency_action,
+                                     by_force = force,
+                                     max_dispatch_time = common_globals.EMERGENCY_DISPATCH_BOUND,
+                                     maneuver_actions = maneuver_actions,
+                                     on_emergency = count_maneuver_goals,
+                                     leak_reader = readers["A_ReadLeak"],
+                                     abort_reader = readers["A_ReadAbort"])
+        watchdog.setup()
+
+        if reason == 'leak':
+            pub = rospy.Publisher(config.LEAK_TOPIC, Leak, queue_size=1)
+            msg = Leak()
+            msg.value = True
+            deliver = watchdog._leak_cb
+        else:
+            pub = rospy.Publisher(config.ABORT_TOPIC, Empty, queue_size=1)
+            msg = Empty()
+            deliver = watchdog._abort_cb
+        if not delay_tree_delivery:
+            deliver = pub.publish
+        def publish():
+            time.sleep(random.uniform(0.001, 0.02))
+            deliver(msg)
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+
+        # keep the tree ticking while the message arrives
+        deadline = time.time() + 1.0
+        while watchdog.dispatched_reason is None and time.time() < deadline:
+            tree.tick()
+            WORLD.step()
+            time.sleep(0.01)
+        publisher.join()
+        watchdog.shutdown()
+
+        if watchdog.dispatched_reason is None:
+            problems.append("trial {}: {} was never dispatched".format(trial, reason))
+            continue
+        latencies.append(watchdog.dispatch_latency.max)
+        if delay_tree_delivery and sum(maneuver_goals) == 0:
+            problems.append("trial {}: no maneuver goal was sent before the {}".format(trial, reason))
+        for action in maneuver_actions:
+            if action.action_client is not None and action.action_client.get_state() in [GoalStatus.PENDING, GoalStatus.ACTIVE]:
+                problems.append("trial {}: the goal of {} is still active".format(trial, action.name))
+
+        # the next ticks should follow the goal that is out
+        client = emergency_action.action_client
+        num_goals = client.num_goals_sent
+        for i in range(2):
+            tree.tick()
+            WORLD.step()
+        if delay_tree_delivery:
+            for i in range(5):
+                tree.tick()
+                WORLD.step()
+            now_goals = [a.action_client.num_goals_sent for a in maneuver_actions if a.action_client is not None]
+            if now_goals != maneuver_goals:
+                problems.append("trial {}: the tree sent {} new maneuver goals after the {}".format(
+                    trial, sum(now_goals) - sum(maneuver_goals), reason))
+        if emergency_action.status != pt.Status.RUNNING:
+            problems.append("trial {}: A_EmergencySurface is {} after a {}".format(trial, emergency_action.status, reason))
+        if not by_force and num_goals == 0:
+            problems.append("trial {}: no emergency goal was sent".format(trial))
+        if client.num_goals_sent != num_goals:
+            problems.append("trial {}: the tree sent {} more emergency goals".format(trial, client.num_goals_sent - num_goals))
+        if client.num_goals_sent > 1:
+            problems.append("trial {}: {} emergency goals were sent, the tree and the watchdog both sent one".format(trial, client.num_goals_sent))
+        if by_force and WORLD.published(config.RPM_CMD_TOPIC) == 0:
+            problems.append("trial {}: nothing was published to stop the thrusters".format(trial))
+
+    return latencies, problems
+
+def read_plandb_per_point(plandb, plan_frame, local_frame, tf_listener):
+    """
+    how MissionPlan.read_plandb used to do it, one fromLatLong and transformPoint per waypoint
+    """
+    waypoints = []
+    for plan_man in plandb.plan_spec.maneuvers:
+        maneuver = plan_man.maneuver
+        utm_point = fromLatLong(math.degrees(maneuver.lat), math.degrees(maneuver.lon)).toPoint()
+        ps = PointStamped()
+        ps.header.frame_id = plan_frame
+        ps.header.stamp = rospy.Time(0)
+        ps.point.x = utm_point.x
+        ps.point.y = utm_point.y
+        ps.point.z = maneuver.z
+        local = tf_listener.transformPoint(local_frame, ps)
+        waypoints.append((local.point.x, local.point.y, maneuver.z))
+    return waypoints
+
+
+def check_utm(num_points, num_waypoints, repeats=3):
+    """
+    utm_projection.latlon_to_utm against geodesy.utm.fromLatLong on random points
+    all over the world, then the time to read a plan of num_waypoints with
+    MissionPlan.read_plandb and with the old per waypoint loop.
+    returns the max error in meters, the max difference of the two plans in meters and the two times in seconds
+    """
+    rng = random.Random(42)
+    lats = [rng.uniform(-80., 84.) for i in range(num_points)]
+    lons = [rng.uniform(-180., 180.) for i in range(num_points)]
+    eastings, northings, zones = latlon_to_utm(lats, lons)
+    max_error = 0.
+    for lat, lon, e, n, z in zip(lats, lons, eastings, northings, zones):
+        utm = fromLatLong(lat, lon)
+        if utm.zone != z:
+            raise ValueError("zone of {},{} is {}, should be {}".format(lat, lon, z, utm.zone))
+        max_error = max(max_error, abs(utm.easting - e), abs(utm.northing - n))
+
+    config, _ = fresh_mission()
+    tf_listener = bt_standins.StandinTransformListener()
+    plandb = make_plandb('utm', lawnmower_latlons(num_waypoints))
+
+    times = []
+    for read in [MissionPlan.read_plandb, read_plandb_per_point]:
+        best = None
+        for i in range(repeats):
+            t0 = time.time()
+            r = read(plandb, config.UTM_LINK, config.LOCAL_LINK, tf_listener)
+            t = time.time() - t0
+            best = t if best is None else min(best, t)
+        times.append(best)
+        if read is MissionPlan.read_plandb:
+            new_wps = r[0]
+        else:
+            old_wps = r
+
+    max_diff = max(max(abs(a-b) for a,b in zip(n, o)) for n, o in zip(new_wps, old_wps))
+    return max_error, max_diff, times[0], times[1]
+
+def check_latlon(num_points, area=5000., num_calls=10000):
+    """
+    a vehicle doing a lawnmower over an area x area square, at the origin and
+    further north, with utm_projection.LocalLatLonProjector and with geodesy's full inverse.
+    returns [(lat, max error in meters, max error bound, number of anchors)] and
+    the time per call of both in seconds
+    """
+    results = []
+    for lat0 in [ORIGIN_LAT, 70.]:
+        utm = fromLatLong(lat0, ORIGIN_LON)
+        projector = LocalLatLonProjector(common_globals.LATLON_REFRESH_DISTANCE, common_globals.LATLON_MAX_ERROR)
+        max_error = 0.
+        max_bound = 0.
+        legs = 10
+        for i in range(num_points):
+            # along a leg, then over to the next one
+            s = float(i)/num_points*legs
+            leg = int(s)
+            along = (s - leg)*area if leg % 2 == 0 else (1 - s + leg)*area
+            e = utm.easting + along
+            n = utm.northing + leg*area/legs
+            lat, lon = projector.to_latlon(e, n, utm.zone, utm.band)
+            # compare where both are on the ground
+            exact = UTMPoint(easting=e, northing=n, altitude=0, zone=utm.zone, band=utm.band).toMsg()
+            es, ns, _ = latlon_to_utm([lat, exact.latitude], [lon, exact.longitude], zones=utm.zone)
+            max_error = max(max_error, math.hypot(es[0]-es[1], ns[0]-ns[1]))
+            max_bound = max(max_bound, projector.error_bound)
+        results.append((lat0, max_error, max_bound, projector.num_anchors))
+
+    # per call, moving a bit every call like a ticking tree would
+    utm = fromLatLong(ORIGIN_LAT, ORIGIN_LON)
+    projector = LocalLatLonProjector(common_globals.LATLON_REFRESH_DISTANCE, common_globals.LATLON_MAX_ERROR)
+    t0 = time.time()
+    for i in range(num_calls):
+        projector.to_latlon(utm.easting + 0.5*i, utm.northing + 0.1*i, utm.zone, utm.band)
+    t_projector = (time.time() - t0)/num_calls
+    num_exact = num_calls//10
+    t0 = time.time()
+    for i in range(num_exact):
+        UTMPoint(easting=utm.easting + 0.5*i, northing=utm.northing + 0.1*i, altitude=0, zone=utm.zone, band=utm.band).toMsg()
+    t_exact = (time.time() - t0)/num_exact
+    return results, t_projector, t_exact
+
+def check_zones(num_points, num_calls=10000):
+    """
+    utm_projection.UTMZoneResolver against geodesy's gridZone:
+    random fixes all over the world that are not near a cell edge should agree,
+    and a noisy gps along a zone edge should not switch zones back and forth.
+    returns the disagreements, the zone switches of the resolver and of geodesy
+    along the edge, and the time per call of both in seconds
+    """
+    rng = random.Random(42)
+    hysteresis = common_globals.UTM_ZONE_HYSTERESIS
+    resolver = UTMZoneResolver(hysteresis)
+    # degrees, more than the hysteresis even where a degree of longitude is shortest
+    margin = 20*hysteresis/110000.
+    disagreements = []
+    for i in range(num_points):
+        lat = rng.uniform(-80., 84.)
+        lon = rng.uniform(-180., 180.)
+        lat_min, lat_max, lon_min, lon_max = grid_zone_cell(*gridZone(lat, lon))
+        if min(lat - lat_min, lat_max - lat, lon - lon_min, lon_max - lon) < margin:
+            continue
+        got = resolver.resolve(lat, lon)
+        expected = gridZone(lat, lon)
+        if got != expected:
+            disagreements.append("{},{}: {} should be {}".format(lat, lon, got, expected))
+
+    # 33/34 edge at 18E, gps noise of a few meters, drifting 100m east over the run
+    resolver = UTMZoneResolver(hysteresis)
+    m_per_deg_lon = 111320. * math.cos(math.radians(ORIGIN_LAT))
+    switches = [0, 0]
+    prev = [None, None]
+    for i in range(num_points):
+        east = -50. + 100.*i/num_points + rng.gauss(0, 3.)
+        lon = 18. + east/m_per_deg_lon
+        for j, zone in enumerate([resolver.resolve(ORIGIN_LAT, lon), gridZone(ORIGIN_LAT, lon)]):
+            if prev[j] is not None and zone != prev[j]:
+                switches[j] += 1
+            prev[j] = zone
+
+    resolver = UTMZoneResolver(hysteresis)
+    t0 = time.time()
+    for i in range(num_calls):
+        resolver.resolve(ORIGIN_LAT + 1e-6*i, ORIGIN_LON)
+    t_resolver = (time.time() - t0)/num_calls
+    t0 = time.time()
+    for i in range(num_calls):
+        fromLatLong(ORIGIN_LAT + 1e-6*i, ORIGIN_LON).gridZone()
+    t_geodesy = (time.time() - t0)/num_calls
+    return disagreements, switches[0], switches[1], t_resolver, t_geodesy
+
+def check_plan(num_waypoints, num_calls=1000):
+    """
+    a MissionPlan of num_waypoints: its pose arrays should match its waypoints,
+    following it to the end should visit every one of them once and
+    A_VizPublishPlan should only publish when the plan changes.
+    returns a list of problems, the time of the first and of the later get_pose_array calls
+    and the time of a visit_wp+get_current_wp, all in seconds
+    """
+    config, mission = fresh_mission()
+    tf_listener = bt_standins.StandinTransformListener()
+    rng = random.Random(42)
+    waypoints = [(rng.uniform(-500, 500), rng.uniform(-500, 500), rng.uniform(0, 20)) for i in range(num_waypoints)]
+    plan = MissionPlan(config.UTM_LINK, config.LOCAL_LINK, PlanDB(),
+                       waypoints=waypoints, tf_listener=tf_listener)
+
+    problems = []
+    t0 = time.time()
+    pa = plan.get_pose_array(flip_z=True)
+    t_first = time.time() - t0
+    t0 = time.time()
+    for i in range(num_calls):
+        pa = plan.get_pose_array(flip_z=True)
+    t_cached = (time.time() - t0)/num_calls
+
+    for flip_z, sign in [(True, -1), (False, 1)]:
+        poses = plan.get_pose_array(flip_z=flip_z).poses
+        got = [(p.position.x, p.position.y, sign*p.position.z) for p in poses]
+        if got != waypoints:
+            problems.append("pose array with flip_z={} does not match the waypoints".format(flip_z))
+
+    ps = PointStamped()
+    ps.header.frame_id = config.UTM_LINK
+    ps.point.x = mission.origin_e + 1.
+    ps.point.y = mission.origin_n + 2.
+    pa = plan.get_pose_array(ps)
+    if len(pa.poses) != num_waypoints+1 or (pa.poses[0].position.x, pa.poses[0].position.y) != (1., 2.):
+        problems.append("pose array with the vehicle is wrong")
+    if len(plan.get_pose_array().poses) != num_waypoints:
+        problems.append("adding the vehicle changed the cached pose array")
+
+    plan.set_refined_waypoints(plan.waypoints)
+    visited = []
+    t0 = time.time()
+    wp = plan.get_current_wp()
+    while wp is not None:
+        visited.append(wp[0])
+        plan.visit_wp()
+        wp = plan.get_current_wp()
+    t_visit = (time.time() - t0)/max(1, len(visited))
+    if visited != waypoints or plan.current_wp_index != num_waypoints or not plan.is_complete():
+        problems.append("following the plan visited {} of {} waypoints, current_wp_index:{}".format(
+            len(visited), num_waypoints, plan.current_wp_index))
+
+
+    # the viz should publish once per plan version, not once per tick
+    viz = A_VizPublishPlan(config.PLAN_VIZ_TOPIC)
+    viz.setup(0.)
+    bb = pt.blackboard.Blackboard()
+    expected = 0
+    for change in [lambda: bb.set(bb_enums.MISSION_PLAN_OBJ, plan),
+                   lambda: plan.set_refined_waypoints(plan.waypoints[:10]),
+                   lambda: bb.set(bb_enums.MISSION_PLAN_OBJ, None),
+                   lambda: bb.set(bb_enums.MISSION_PLAN_OBJ, MissionPlan(config.UTM_LINK, config.LOCAL_LINK, PlanDB(),
+                                                                         waypoints=waypoints, tf_listener=tf_listener))]:
+        change()
+        expected += 1
+        for i in range(num_calls//10):
+            viz.tick_once()
+    if WORLD.published(config.PLAN_VIZ_TOPIC) != expected:
+        problems.append("the plan viz published {} times for {} plan changes".format(
+            WORLD.published(config.PLAN_VIZ_TOPIC), expected))
+
+    return problems, t_first, t_cached, t_visit
+
+def check_progress(num_waypoints, points_per_segment=10, offset=0.5):
+    """
+    a lawnmower plan refined by points along each leg, offset sideways by offset meters,
+    the way a path planner that cuts corners might. Each refined point should map to
+    the leg it is on, following the plan should go through every coarse waypoint
+    in order and the progress should go up to 100 with it.
+    returns a list of problems, the time of set_refined_waypoints and of a get_progress in seconds
+    """
+    config, _ = fresh_mission()
+    tf_listener = bt_standins.StandinTransformListener()
+    leg_length = 100.
+    spacing = 10.
+    waypoints = []
+    for i in range(num_waypoints):
+        x = leg_length if (i%4 in [1,2]) else 0.
+        waypoints.append((x, (i//2)*spacing, 2.))
+    plan = MissionPlan(config.UTM_LINK, config.LOCAL_LINK, PlanDB(),
+                       waypoints=waypoints, tf_listener=tf_listener)
+
+    refined = []
+    expected = []
+    start = (-5., -5., 2.)
+    for k, end in enumerate(waypoints):
+        prev = start if k == 0 else waypoints[k-1]
+        dx, dy = end[0]-prev[0], end[1]-prev[1]
+        length = math.hypot(dx, dy)
+        # to the left of the segment, never quite on a coarse waypoint
+        nx, ny = -dy/length*offset, dx/length*offset
+        for j in range(1, points_per_segment+1):
+            t = 0.2 + 0.6*j/float(points_per_segment+1)
+            refined.append((prev[0]+t*dx+nx, prev[1]+t*dy+ny, 2.))
+            expected.append(k)
+
+    t0 = time.time()
+    plan.set_refined_waypoints(refined)
+    t_refine = time.time() - t0
+
+    problems = []
+    got = plan.refined_to_coarse.tolist()
+    wrong = [i for i, (g, e) in enumerate(zip(got, expected)) if g != e]
+    if len(wrong) > 0:
+        problems.append("{} of {} refined waypoints are on the wrong segment, first one:{} is on {} should be {}".format(
+            len(wrong), len(refined), wrong[0], got[wrong[0]], expected[wrong[0]]))
+
+    coarse_seen = []
+    progress = []
+    wp = plan.get_current_wp()
+    t_progress = 0.
+    while wp is not None:
+        if len(coarse_seen) == 0 or coarse_seen[-1] != plan.current_wp_index:
+            coarse_seen.append(plan.current_wp_index)
+        t0 = time.time()
+        progress.append(plan.get_progress())
+        t_progress += time.time() - t0
+        plan.visit_wp()
+        wp = plan.get_current_wp()
+    t_progress /= max(1, len(progress))
+
+    if coarse_seen != list(range(num_waypoints)):
+        problems.append("went through coarse waypoints {}... instead of all {} in order".format(coarse_seen[:10], num_waypoints))
+    if any(b < a for a, b in zip(progress, progress[1:])) or plan.get_progress() != 100.0:
+        problems.append("progress went down or did not end at 100")
+
+    return problems, t_refine, t_progress
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tick the sam tree without ros and report how fast it is")
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--waypoints', type=int, default=20)
+    parser.add_argument('--profile', action='store_true', help="also print a per-behaviour profile")
+    parser.add_argument('--trace-malloc', action='store_true', help="python3 only, measure the peak memory allocated per tick")
+    parser.add_argument('--skip-unchanged', action='store_true', help="do not re-tick conditions whose blackboard inputs did not change")
+    parser.add_argument('--compiled', action='store_true', help="tick with bt_compiled.CompiledTree")
+    parser.add_argument('--latency', action='store_true', help="also report the sensor latencies")
+    parser.add_argument('--journal', metavar='PATH', help="also write a tick journal to PATH and read it back")
+    parser.add_argument('--check-compiled', action='store_true', help="check that the compiled tree ticks the same as py_trees, then compare their speeds")
+    parser.add_argument('--check-watchdog', action='store_true', help="check how fast the emergency watchdog starts surfacing after a leak or abort")
+    parser.add_argument('--check-latlon', action='store_true', help="check the local lat/lon projector of A_UpdateLatLon against geodesy and time it")
+    parser.add_argument('--check-zones', action='store_true', help="check the utm zone resolver of A_SetUTMFromGPS against geodesy and time it")
+    parser.add_argument('--check-plan', action='store_true', help="check the pose arrays, progress and viz of a 5000 waypoint MissionPlan and time them")
+    parser.add_argument('--check-progress', action='store_true', help="check how refined waypoints are mapped to the coarse ones of a 5000 waypoint plan and time it")
+    parser.add_argument('--check-utm', action='store_true', help="check the vectorized lat/lon to utm against geodesy, then time reading a 10k waypoint plan")
+    args = parser.parse_args()
+
+    if args.skip_unchanged:
+        bt_common.install_blackboard_versions()
+
+    # the checks print OK/FAILED lines, any FAILED one makes the exit code 1
+    failed = []
+    def verdict(ok, ok_word="OK"):
+        if not ok:
+            failed.append(True)
+        return ok_word if ok else "FAILED"
+
+    if args.check_compiled:
+        # a mission that completes, and one that is interrupted by a leak half way
+        for skip in [False, True]:
+            if skip:
+                bt_common.install_blackboard_versions()
+            for leak_tick in [None, args.waypoints*2]:
+                diffs = check_compiled(args.ticks, args.waypoints, leak_tick)
+                print("compiled vs py_trees, skip unchanged:{}, leak at:{}, {} ticks: {}".format(
+                    skip, leak_tick, args.ticks,
+                    "SAME" if len(diffs) == 0 else "{} differences: {}".format(len(diffs), verdict(False))))
+                for d in diffs[:20]:
+                    print("  "+d)
+        # both with the same blackboard versions setting
+        plain = run(args.ticks, num_waypoints=args.waypoints, warmup=args.warmup)
+        comp = run(args.ticks, num_waypoints=args.waypoints, warmup=args.warmup, compiled=True)
+        print("py_trees ticks/s:{:.1f} p50:{:.3f}ms".format(plain['ticks_per_sec'], plain['p50_ms']))
+        print("compiled ticks/s:{:.1f} p50:{:.3f}ms".format(comp['ticks_per_sec'], comp['p50_ms']))
+        print("speedup: {:.2f}x".format(comp['ticks_per_sec']/plain['ticks_per_sec']))
+        return 1 if failed else 0
+
+    if args.check_watchdog:
+        bound_ms = common_globals.EMERGENCY_DISPATCH_BOUND*1000
+        for by_force, delayed in [(False, False), (True, False), (False, True)]:
+            latencies, problems = check_watchdog(20, by_force=by_force, delay_tree_delivery=delayed)
+            latencies.sort()
+            print("watchdog, by force:{}, tree delivery delayed:{}, {} dispatches p50:{:.3f}ms max:{:.3f}ms bound:{:.1f}ms: {}".format(
+                by_force, delayed, len(latencies), percentile(latencies, 50)*1000,
+                latencies[-1]*1000 if latencies else 0., bound_ms,
+                verdict(len(problems) == 0 and all(l*1000 <= bound_ms for l in latencies))))
+            for p in problems:
+                print("  "+p)
+        print("without it, the tree sends the goal on its next tick, up to {:.1f}ms later".format(
+            1000./common_globals.BT_TICK_RATE))
+        return 1 if failed else 0
+
+    if args.check_utm:
+        max_error, max_diff, t_new, t_old = check_utm(10000, 10000)
+        print("latlon_to_utm vs geodesy, 10000 points: max error {:.6f}mm: {}".format(
+            max_error*1000, verdict(max_error < 1e-3)))
+        print("read_plandb vs per point, 10000 waypoints: max difference {:.6f}mm: {}".format(
+            max_diff*1000, verdict(max_diff < 1e-3)))
+        print("read_plandb:{:.1f}ms per point:{:.1f}ms speedup: {:.1f}x".format(
+            t_new*1000, t_old*1000, t_old/t_new))
+        return 1 if failed else 0
+
+    if args.check_plan:
+        problems, t_first, t_cached, t_visit = check_plan(5000)
+        print("mission plan, 5000 waypoints: {}".format(verdict(len(problems) == 0)))
+        for p in problems:
+            print("  "+p)
+        print("get_pose_array first:{:.3f}ms after:{:.3f}us, visit_wp+get_current_wp:{:.2f}us".format(
+            t_first*1000, t_cached*1e6, t_visit*1e6))
+        return 1 if failed else 0
+
+    if args.check_progress:
+        problems, t_refine, t_progress = check_progress(5000)
+        print("refined to coarse, 5000 waypoints, 50000 refined: {}".format(verdict(len(problems) == 0)))
+        for p in problems:
+            print("  "+p)
+        print("set_refined_waypoints:{:.1f}ms get_progress:{:.2f}us".format(t_refine*1000, t_progress*1e6))
+        return 1 if failed else 0
+
+    if args.check_zones:
+        disagreements, switches, geodesy_switches, t_resolver, t_geodesy = check_zones(10000)
+        print("zone resolver vs geodesy, random fixes away from edges: {}".format(
+            "SAME" if len(disagreements) == 0 else "{} differences: {}".format(len(disagreements), verdict(False))))
+        for d in disagreements[:20]:
+            print("  "+d)
+        print("noisy gps over a zone edge: resolver switched {} times, geodesy {} times: {}".format(
+            switches, geodesy_switches, verdict(switches == 1)))
+        print("per call, resolver:{:.2f}us geodesy:{:.2f}us speedup: {:.1f}x".format(
+            t_resolver*1e6, t_geodesy*1e6, t_geodesy/t_resolver))
+        return 1 if failed else 0
+
+    if args.check_latlon:
+        results, t_projector, t_exact = check_latlon(20000)
+        for lat0, max_error, max_bound, num_anchors in results:
+            print("local projector vs geodesy, 5x5km at lat {:.1f}: max error {:.2f}mm bound {:.2f}mm max allowed {:.1f}mm, {} anchors: {}".format(
+                lat0, max_error*1000, max_bound*1000, common_globals.LATLON_MAX_ERROR*1000, num_anchors,
+                verdict(max_error <= max_bound <= common_globals.LATLON_MAX_ERROR)))
+        print("per call, local projector:{:.2f}us geodesy:{:.2f}us speedup: {:.1f}x".format(
+            t_projector*1e6, t_exact*1e6, t_exact/t_projector))
+        return 1 if failed else 0
+
+    r = run(args.ticks,
+            num_waypoints=args.waypoints,
+            warmup=args.warmup,
+            profile=args.profile,
+            trace_malloc=args.trace_malloc,
+            compiled=args.compiled,
+            journal_path=args.journal,
+            latency=args.latency)
+    print("ticks:{ticks} ticks/s:{ticks_per_sec:.1f} p50:{p50_ms:.3f}ms p99:{p99_ms:.3f}ms max:{max_ms:.3f}ms net objs/tick:{net_objs_per_tick:.1f} last tip:{tip}".format(**r))
+    if 'peak_kb_per_tick' in r:
+        print("peak allocated per tick:{:.1f}KB".format(r['peak_kb_per_tick']))
+    if 'profile' in r:
+        print(r['profile'])
+    if 'latency' in r:
+        print(r['latency'])
+    if args.journal is not None:
+        t0 = time.time()
+        records = read_journal(args.journal)
+        names = read_journal_nodes(args.journal)
+        print("read {} journaled ticks in {:.1f}ms, last tip:{} depth:{:.2f} wp:{}/{}".format(
+            len(records), (time.time()-t0)*1000,
+            names[records['tip_id'][-1]], records['depth'][-1],
+            records['wp_index'][-1], records['num_wps'][-1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
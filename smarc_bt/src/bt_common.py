@@ -8,12 +8,184 @@
 import py_trees as pt
 import py_trees_ros as ptr
 import rospy
+import tf
+import numpy as np
 
-import copy # used in ReadTopic
+import operator # used in ReadTopic
+import threading
+import time
 
+from geometry_msgs.msg import PointStamped
 from smarc_bt.msg import CBFList, CBFItem
 import common_globals
 
+###############################################################
+# BLACKBOARD VERSIONS
+###############################################################
+# every blackboard write, bb.set(), ptr's subscribers and plain attribute
+# assignment, goes through Blackboard.__setattr__. we replace it once with
+# _bb_setattr, which does the redirects first and then the versions.
+_setattr_original = pt.blackboard.Blackboard.__setattr__
+_bb_setattr_installed = False
+# key -> how many times a different object was written into it
+_bb_versions = {}
+_bb_versions_installed = False
+# key -> function that takes the value instead of the blackboard
+_bb_redirects = {}
+
+def _bb_setattr(bb, name, value):
+    redirect = _bb_redirects.get(name)
+    if redirect is not None:
+        # bumps its own versions
+        redirect(value)
+        return
+    # Blackboard.__init__ sets __dict__ through here too
+    if _bb_versions_installed and not name.startswith('_') and bb.__dict__.get(name, _bb_versions) is not value:
+        _bb_versions[name] = _bb_versions.get(name, 0) + 1
+    _setattr_original(bb, name, value)
+
+def _install_bb_setattr():
+    global _bb_setattr_installed
+    if not _bb_setattr_installed:
+        pt.blackboard.Blackboard.__setattr__ = _bb_setattr
+        _bb_setattr_installed = True
+
+def install_blackboard_versions():
+    """
+    Make the blackboard count writes per key.
+    The py_trees version we have does not do this.
+    Writing the very same object again does not count as a change, so
+    if you modify an object in place, call bump_bb_version yourself.
+    """
+    global _bb_versions_installed
+    _bb_versions_installed = True
+    _install_bb_setattr()
+
+def redirect_blackboard_keys(redirects):
+    """
+    writes to the keys of redirects, key -> function(value), call that function instead.
+    the function should keep bb.get() working and call bump_bb_version, see vehicle_state
+    """
+    _bb_redirects.update(redirects)
+    _install_bb_setattr()
+
+def bb_version(key):
+    return _bb_versions.get(key, 0)
+
+def bump_bb_version(key):
+    _bb_versions[key] = _bb_versions.get(key, 0) + 1
+
+def _bb_versions_of(node):
+    return tuple(_bb_versions.get(k, 0) for k in node.blackboard_keys)
+
+
+###############################################################
+# SHARED TF LISTENER
+###############################################################
+class TickTFCache(object):
+    """
+    Looks like a tf.TransformListener, remembers the latest transforms
+    (time/stamp 0) it looked up until the start of the next tick.
+    So every behaviour sees the same transform within a tick and
+    it is looked up only once.
+    Anything else, and lookups from other threads than the one
+    that ticks the tree, go straight to the listener.
+    Does not remember anything until attach()ed to a tree.
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self.enabled = False
+        # the thread that last started a tick
+        self._tick_thread = None
+        # (target, source) -> (trans, rot)
+        self._transforms = {}
+        # (target, source) -> 4x4 matrix
+        self._matrices = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, tree):
+        tree.add_pre_tick_handler(self.clear)
+        self.enabled = True
+
+    def clear(self, tree=None):
+        self._tick_thread = threading.current_thread()
+        self._transforms.clear()
+        self._matrices.clear()
+
+    def _in_tick(self):
+        return self.enabled and threading.current_thread() is self._tick_thread
+
+    def lookupTransform(self, target_frame, source_frame, time):
+        if not self._in_tick() or not time.is_zero():
+            return self.listener.lookupTransform(target_frame, source_frame, time)
+
+        key = (target_frame, source_frame)
+        transform = self._transforms.get(key)
+        if transform is None:
+            self.misses += 1
+            # failures raise and are not remembered
+            transform = self.listener.lookupTransform(target_frame, source_frame, time)
+            self._transforms[key] = transform
+        else:
+            self.hits += 1
+        return transform
+
+    def asMatrix(self, target_frame, hdr):
+        if not self._in_tick() or not hdr.stamp.is_zero():
+            return self.listener.asMatrix(target_frame, hdr)
+
+        key = (target_frame, hdr.frame_id)
+        mat44 = self._matrices.get(key)
+        if mat44 is None:
+            trans, rot = self.lookupTransform(target_frame, hdr.frame_id, hdr.stamp)
+            mat44 = self.listener.fromTranslationRotation(trans, rot)
+            self._matrices[key] = mat44
+        else:
+            self.hits += 1
+        return mat44
+
+    def transformPoint(self, target_frame, ps):
+        if not self._in_tick() or not ps.header.stamp.is_zero():
+            return self.listener.transformPoint(target_frame, ps)
+
+        mat44 = self.asMatrix(target_frame, ps.header)
+        # same as tf.TransformListener.transformPoint
+        xyz = tuple(np.dot(mat44, np.array([ps.point.x, ps.point.y, ps.point.z, 1.0])))[:3]
+        r = PointStamped()
+        r.header.stamp = ps.header.stamp
+        r.header.frame_id = target_frame
+        r.point.x, r.point.y, r.point.z = xyz
+        return r
+
+    def waitForTransform(self, *args, **kwargs):
+        return self.listener.waitForTransform(*args, **kwargs)
+
+    def canTransform(self, *args, **kwargs):
+        return self.listener.canTransform(*args, **kwargs)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return "tf lookups hits:{} misses:{} hit rate:{:.1f}%".format(
+            self.hits, self.misses, 100.0*self.hits/total if total > 0 else 0.)
+
+
+_tf_listener = None
+
+def shared_tf_listener():
+    """
+    The one tf.TransformListener of this process, behind a TickTFCache.
+    Every listener subscribes to /tf and keeps its own buffer, so
+    behaviours should be given this one instead of making their own.
+    Made on the first call, which has to be after rospy.init_node.
+    """
+    global _tf_listener
+    if _tf_listener is None:
+        _tf_listener = TickTFCache(tf.TransformListener())
+    return _tf_listener
+
+
 ###############################################################
 # GENERIC TREE NODES AND SUCH
 ###############################################################
@@ -33,30 +205,86 @@ class A_RunOnce(pt.behaviour.Behaviour):
             self.ran = True
             return pt.Status.RUNNING
 
+class CBFAccumulator(object):
+    """
+    The CBF items of the conditions that succeeded in the current tick, in tick order.
+    attach() it to the tree once, then it is emptied before every tick and
+    compared to what was last published after every tick.
+    An action can read cbf_list during the tick to get the items of all the
+    succeeded conditions that ran before it.
+
+    The list is published latched on common_globals.CBF_BT_TOPIC, only when it
+    changed, with the next seq. If keepalive_period is set, the last list
+    is also published again, with the same seq, when nothing was published for that long.
+    """
+    def __init__(self):
+        self.cbf_list = CBFList()
+        self.cbf_pub = None
+        self.keepalive_period = None
+
+        self.seq = 0
+        self.num_published = 0
+        self._published_list = None
+        self._last_publish_time = None
+
+    def attach(self, tree, keepalive_period=None):
+        """
+        works with tree.tick() and bt_compiled.CompiledTree.tick(), both run the handlers
+        """
+        self.cbf_pub = rospy.Publisher(common_globals.CBF_BT_TOPIC, CBFList, queue_size=1, latch=True)
+        self.keepalive_period = keepalive_period
+        # a new publisher, it has not published anything yet
+        self._published_list = None
+        tree.add_pre_tick_handler(self.reset)
+        tree.add_post_tick_handler(self.publish)
+
+    def reset(self, tree=None):
+        del self.cbf_list.cbf_items[:]
+
+    def add(self, cbf_item):
+        self.cbf_list.cbf_items.append(cbf_item)
+
+    def publish(self, tree=None):
+        if self.cbf_pub is None:
+            return
+
+        now = time.time()
+        published = self._published_list
+        if published is None or published.cbf_items != self.cbf_list.cbf_items:
+            self.seq += 1
+            published = CBFList()
+            published.seq = self.seq
+            published.cbf_items = list(self.cbf_list.cbf_items)
+            self._published_list = published
+        elif self.keepalive_period is None or now - self._last_publish_time < self.keepalive_period:
+            return
+
+        self.cbf_pub.publish(published)
+        self.num_published += 1
+        self._last_publish_time = now
+
+CBF_ACCUMULATOR = CBFAccumulator()
+
+
 class CBFCondition(object):
     """
     An object for creating conditions that are also control barrier
     functions. This allows us to send a set of CBFs to actions to use.
-    Instanciate this object in your normal ros-y condition nodes.
-    Use the A_ClearCBFs action above at the beginning of your tree if you use any of these.
-    Otherwise your actions might run the SAME cbfs with conflicting limits and just explode.
-
-    And then in the update() method of C_XY, if the update() is about to return success,
-    call the cbf_update method too.
+    Instanciate this object in your normal ros-y condition nodes
+    and use its update() as the update() of the condition.
 
     The system works like this:
-        At the beginning of the tree, a simple action calls cbf_update(reset=True).
-            This publishes an empty cbf_list message.
-        Afterwards, every condition that inherits this object, when they succeed,
-        calls cbf_update().
-            This reads reads the current cbf_bt/active_limits topics, appends
-            its own cbf_item to the list and publishes the new, longer cbf_list.
-        At any point, an action that reads the cbf_list object gets an ordered list
-        of all succeeded conditions that ran before it.
+        CBF_ACCUMULATOR is attached to the tree, it empties its list before every tick.
+        Every condition that has one of these, when they succeed,
+        appends its own cbf_item to that list.
+        After the tick, the list is published on cbf_bt/active_limits if it changed.
     """
-    def __init__(self, update_func, limit_type, limit_value, checked_field_topic='', checked_field_name=''):
+    def __init__(self, update_func, limit_type, limit_value, checked_field_topic='', checked_field_name='', accumulator=None):
 
         self.update_func = update_func
+        if accumulator is None:
+            accumulator = CBF_ACCUMULATOR
+        self.accumulator = accumulator
 
         # the ros message can not have Nones in it.
         if checked_field_name is None:
@@ -70,40 +298,13 @@ class CBFCondition(object):
         self.cbf_item.limit_type = limit_type
         self.cbf_item.limit_value = limit_value
 
-        self._latest_list = None
-        self._this_is_first_cond_in_tree = False
-
-        self.cbf_pub = rospy.Publisher(common_globals.CBF_BT_TOPIC, CBFList, queue_size=1)
-        self.cbf_sub = rospy.Subscriber(common_globals.CBF_BT_TOPIC, CBFList, callback=self.cbf_list_cb)
-
-    def cbf_list_cb(self, cbf_list):
-        self._latest_list = cbf_list
-
 
     def update(self):
         return_status = self.update_func()
 
-        if self._latest_list is None:
-            # the callback was never called, if it was, this would not be None
-            # it would have been at worst an empty message object.
-            # this means this condition is the first ever condition
-            # in the tree to be caled.
-            self._this_is_first_cond_in_tree = True
-
-        # create a new empty list
-        # for sure if we are the first condition
-        if self._this_is_first_cond_in_tree:
-            cbf_list = CBFList()
-        else:
-            cbf_list = self._latest_list
-
         # if the child condition udpate method is successful, add this cbf to the list
         if return_status == pt.Status.SUCCESS:
-            cbf_list.cbf_items.append(self.cbf_item)
-        # otherwise leave it as is
-        # this happens when the first condition of the list fails
-        # either way, publish this filled or empty list
-        self.cbf_pub.publish(cbf_list)
+            self.accumulator.add(self.cbf_item)
 
         # and return the original update's return
         return return_status
@@ -118,6 +319,11 @@ class ReadTopic(pt.behaviour.Behaviour):
     Same usage as ptr.subscribers.ToBlackboard, except it doesnt return RUNNING when
     there is no data.
 
+    blackboard_variables is {bb_key: 'field.path'}, None as the path puts the whole message in.
+    Messages are not copied, the callback only swaps in the new one with a
+    sequence number and update() does nothing until that number changes.
+    So do not modify what you get from the bb in place.
+
     mostly copied from the "ToBlackboard" behaviour of ptr
     """
     def __init__(self, name, topic_name, topic_type, blackboard_variables):
@@ -125,33 +331,59 @@ class ReadTopic(pt.behaviour.Behaviour):
         self.blackboard_variables = blackboard_variables
         self.last_read_value = None
 
+        # (bb key, getter), paths are resolved once here instead of every tick
+        self._getters = []
+        for k,v in blackboard_variables.items():
+            if v is None:
+                self._getters.append((k, None))
+            else:
+                self._getters.append((k, operator.attrgetter(v)))
+
         self.topic_name = topic_name
         self.topic_type = topic_type
         self.subs = None
-        self.msg = None
+        # (seq, msg), replaced as a whole by the callback so update() never
+        # sees a seq with the wrong msg
+        self._latest = (0, None)
+        self._read_seq = 0
+        # a bt_latency.TopicLatency, if someone wants to know
+        self.latency = None
 
         super(ReadTopic, self).__init__(name)
 
+    @property
+    def msg(self):
+        return self._latest[1]
+
     def setup(self, timeout):
-        self.subs = rospy.Subscriber(self.topic_name, self.topic_type, self._cb, queue_size=2)
+        self.subs = rospy.Subscriber(self.topic_name, self.topic_type, self.callback, queue_size=2)
         return True
 
-    def _cb(self, msg):
+    def callback(self, msg):
+        """
+        the subscriber callback, same name as in the ptr subscribers.
+        can also be called with a message that came some other way, see bt_watchdog
+        """
         #  rospy.loginfo("ReadTopic {}, {}".format(self.topic_name, msg))
-        self.msg = msg
+        self._latest = (self._latest[0]+1, msg)
+        if self.latency is not None:
+            self.latency.received(msg)
 
     def update(self):
-        if self.msg is not None:
-            self.last_read_value = copy.copy(self.msg)
-            for k,v in self.blackboard_variables.iteritems():
-                if v is None:
-                    self.bb.set(k, self.msg, overwrite=True)
-                else:
-                    fields = v.split(".")
-                    value = copy.copy(self.msg)
-                    for field in fields:
-                        value = getattr(value, field)
-                        self.bb.set(k, value, overwrite=True)
+        seq, msg = self._latest
+        if seq == self._read_seq:
+            # nothing new, the bb already has this
+            return pt.Status.SUCCESS
+
+        self._read_seq = seq
+        self.last_read_value = msg
+        for k, getter in self._getters:
+            if getter is None:
+                self.bb.set(k, msg, overwrite=True)
+            else:
+                self.bb.set(k, getter(msg), overwrite=True)
+        if self.latency is not None:
+            self.latency.written()
 
         #  self.feedback_message = "Last read:"+str(self.last_read_value)
         return pt.Status.SUCCESS
@@ -190,10 +422,28 @@ class Sequence(pt.composites.Selector):
 
     """
     Reactive sequence overidding sequence with memory, py_trees' only available sequence.
+
+    Children that have a blackboard_keys attribute are treated as pure functions
+    of those blackboard keys. If install_blackboard_versions() was called and none of those
+    keys were written since the child was last ticked, the child is not ticked again
+    and its last status is used.
     """
 
     def __init__(self, name="Sequence", children=None, blackbox_level=None):
         super(Sequence, self).__init__(name=name, children=children, blackbox_level=blackbox_level)
+        # child -> versions of its blackboard_keys when it was last ticked
+        self._seen_versions = {}
+
+    def _unchanged(self, child):
+        if not _bb_versions_installed or getattr(child, 'blackboard_keys', None) is None:
+            return False
+        if child.status not in [pt.common.Status.SUCCESS, pt.common.Status.FAILURE]:
+            return False
+        return self._seen_versions.get(child) == _bb_versions_of(child)
+
+    def _remember_versions(self, child):
+        if getattr(child, 'blackboard_keys', None) is not None:
+            self._seen_versions[child] = _bb_versions_of(child)
 
     def tick(self):
         """
@@ -215,7 +465,13 @@ class Sequence(pt.composites.Selector):
         self.update()
         previous = self.current_child
         for child in self.children:
-            for node in child.tick():
+            if self._unchanged(child):
+                # same inputs, same answer. dont tick it, use its last status
+                nodes = [child]
+            else:
+                self._remember_versions(child)
+                nodes = child.tick()
+            for node in nodes:
                 yield node
                 if node is child:
                     if node.status == pt.common.Status.RUNNING or node.status == pt.common.Status.FAILURE:
@@ -296,3 +552,54 @@ class Counter(pt.behaviour.Behaviour):
 
     def terminate(self, status):
         self.i = 0 if status == pt.common.Status.SUCCESS and self.reset else self.i
+
+
+
+class RateLimited(pt.composites.Composite):
+    """
+    Ticks its only child at most once every every_n_ticks ticks and/or
+    once every period seconds. In between, returns the status the child
+    had when it was last ticked.
+    Use this for things that do not need to run as fast as the safety checks.
+    The child is always ticked if it was never ticked or was invalidated.
+    """
+    def __init__(self, child, name="RateLimited", every_n_ticks=None, period=None):
+        super(RateLimited, self).__init__(name=name, children=[child])
+        self.every_n_ticks = every_n_ticks
+        self.period = period
+        self._ticks_since = 0
+        self._last_child_tick = None
+
+    def _child_is_due(self, child):
+        if child.status == pt.common.Status.INVALID or self._last_child_tick is None:
+            return True
+        if self.every_n_ticks is not None and self._ticks_since < self.every_n_ticks:
+            return False
+        if self.period is not None and time.time() - self._last_child_tick < self.period:
+            return False
+        return True
+
+    def _child_ticked(self):
+        self._ticks_since = 0
+        self._last_child_tick = time.time()
+
+    def tick(self):
+        if self.status != pt.common.Status.RUNNING:
+            self.initialise()
+        self.update()
+
+        child = self.children[0]
+        self._ticks_since += 1
+        if self._child_is_due(child):
+            for node in child.tick():
+                yield node
+            self._child_ticked()
+
+        self.current_child = child
+        self.status = child.status
+        yield self
+
+    def stop(self, new_status=pt.common.Status.INVALID):
+        if new_status == pt.common.Status.INVALID:
+            self.current_child = None
+        super(RateLimited, self).stop(new_status)
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Ticks a tree without going through the tick() generators of py_trees.
+
+The tree we build in const_tree never changes shape after it is built, so
+the walk over it can be decided once. CompiledTree turns every node into a
+plain function that ticks it and returns its new status, with the same
+semantics as the generators of:
+    py_trees.behaviour.Behaviour (leaves)
+    py_trees.composites.Selector
+    bt_common.Sequence (the reactive one)
+    bt_common.RateLimited
+Anything else is ticked through its own tick() generator.
+
+Differences to tree.tick():
+    - the debug logging of py_trees is not done
+    - leaves that do not override stop() are stopped without re-creating
+      their tick() generator, which is only used by tick_once()
+    - children added or removed after compiling are not seen, call compile() again
+"""
+
+import py_trees as pt
+
+from bt_common import Sequence, RateLimited
+
+
+RUNNING = pt.common.Status.RUNNING
+SUCCESS = pt.common.Status.SUCCESS
+FAILURE = pt.common.Status.FAILURE
+INVALID = pt.common.Status.INVALID
+STATUSES = tuple(pt.common.Status)
+
+
+class CompiledTree(object):
+    """
+    Use tick() instead of tree.tick(), the tree's handlers and visitors are still run.
+    The tree itself can still be used for everything else, like tip() and setup().
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        # visitors that want to see the ticked nodes, in the order the generators would yield them
+        self._visitors = []
+        self.num_nodes = 0
+        self._root_tick = None
+        self.compile()
+
+    def compile(self):
+        self.num_nodes = 0
+        self._root_tick = self._compile(self.tree.root)
+
+    def tick(self, pre_tick_handler=None, post_tick_handler=None):
+        """
+        same as py_trees.trees.BehaviourTree.tick
+        """
+        tree = self.tree
+        for handler in tree.pre_tick_handlers:
+            handler(tree)
+        if pre_tick_handler is not None:
+            pre_tick_handler(tree)
+
+        for visitor in tree.visitors:
+            visitor.initialise()
+        self._visitors[:] = [visitor for visitor in tree.visitors if not visitor.full]
+
+        self._root_tick()
+
+        full_visitors = [visitor for visitor in tree.visitors if visitor.full]
+        if len(full_visitors) > 0:
+            for node in tree.root.iterate():
+                for visitor in full_visitors:
+                    node.visit(visitor)
+
+        for handler in tree.post_tick_handlers:
+            handler(tree)
+        if post_tick_handler is not None:
+            post_tick_handler(tree)
+        tree.count += 1
+
+
+    def _compile(self, node):
+        self.num_nodes += 1
+        cls = type(node)
+        if len(node.children) == 0 and cls.tick is pt.behaviour.Behaviour.tick:
+            return self._compile_leaf(node)
+        if cls.tick is Sequence.tick:
+            return self._compile_selector(node, FAILURE, reactive_sequence=True)
+        if cls.tick is pt.composites.Selector.tick:
+            return self._compile_selector(node, SUCCESS, reactive_sequence=False)
+        if cls.tick is RateLimited.tick:
+            return self._compile_rate_limited(node)
+        return self._compile_generator(node)
+
+
+    def _compile_generator(self, node):
+        visitors = self._visitors
+        # the whole subtree is ticked by the generator
+        self.num_nodes += sum(1 for n in node.iterate()) - 1
+        def tick_generator():
+            for n in node.tick():
+                for visitor in visitors:
+                    n.visit(visitor)
+            return node.status
+        return tick_generator
+
+
+    def _compile_leaf(self, node):
+        visitors = self._visitors
+        plain_stop = type(node).stop is pt.behaviour.Behaviour.stop
+        def tick_leaf():
+            if node.status != RUNNING:
+                node.initialise()
+            new_status = node.update()
+            if new_status not in STATUSES:
+                node.logger.error("A behaviour returned an invalid status, setting to INVALID [%s][%s]" % (new_status, node.name))
+                new_status = INVALID
+            if new_status != RUNNING:
+                if plain_stop:
+                    node.terminate(new_status)
+                    node.status = new_status
+                else:
+                    node.stop(new_status)
+            node.status = new_status
+            for visitor in visitors:
+                node.visit(visitor)
+            return new_status
+        return tick_leaf
+
+
+    def _compile_selector(self, node, stops_on, reactive_sequence):
+        """
+        A Selector stops at the first child that is RUNNING or SUCCESS,
+        our reactive Sequence at the first that is RUNNING or FAILURE.
+        Otherwise they are the same.
+        """
+        visitors = self._visitors
+        children = list(node.children)
+        child_ticks = [self._compile(child) for child in children]
+        # the children that are to be invalidated if child i interrupts
+        lower_priority = [children[i+1:] for i in range(len(children))]
+        keyed = [getattr(child, 'blackboard_keys', None) is not None for child in children]
+        if len(children) > 0:
+            done_status = SUCCESS if stops_on == FAILURE else FAILURE
+            last_child = children[-1]
+        else:
+            # an empty Selector fails, an empty Sequence succeeds, same as the generators
+            done_status = SUCCESS if reactive_sequence else FAILURE
+            last_child = None
+
+        def tick_selector():
+            if node.status != RUNNING:
+                node.initialise()
+            node.update()
+            previous = node.current_child
+            for i in range(len(children)):
+                child = children[i]
+                if reactive_sequence and keyed[i] and node._unchanged(child):
+                    status = child.status
+                    for visitor in visitors:
+                        child.visit(visitor)
+                else:
+                    if reactive_sequence and keyed[i]:
+                        node._remember_versions(child)
+                    status = child_ticks[i]()
+
+                if status == RUNNING or status == stops_on:
+                    node.current_child = child
+                    node.status = status
+                    if previous is None or previous != child:
+                        # we interrupted, invalidate everything at a lower priority
+                        for lower in lower_priority[i]:
+                            if lower.status != INVALID:
+                                lower.stop(INVALID)
+                    for visitor in visitors:
+                        node.visit(visitor)
+                    return status
+
+            node.status = done_status
+            node.current_child = last_child
+            for visitor in visitors:
+                node.visit(visitor)
+            return done_status
+        return tick_selector
+
+
+    def _compile_rate_limited(self, node):
+        visitors = self._visitors
+        child = node.children[0]
+        child_tick = self._compile(child)
+        def tick_rate_limited():
+            if node.status != RUNNING:
+                node.initialise()
+            node.update()
+            node._ticks_since += 1
+            if node._child_is_due(child):
+                child_tick()
+                node._child_ticked()
+            node.current_child = child
+            node.status = child.status
+            for visitor in visitors:
+                node.visit(visitor)
+            return node.status
+        return tick_rate_limited
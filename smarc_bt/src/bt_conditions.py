@@ -7,26 +7,29 @@
 import math
 import rospy
 import py_trees as pt
-import tf
 import numpy as np
 
 import imc_enums
 import bb_enums
+import vehicle_state
 
-from bt_common import CBFCondition
+from bt_common import CBFCondition, shared_tf_listener
 
 
 class C_AtDVLDepth(pt.behaviour.Behaviour):
     """
     Returns SUCCESS if at some specified depth
     """
+    blackboard_keys = (bb_enums.DEPTH,)
+
     def __init__(self, dvl_depth):
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.dvl_depth = dvl_depth
         super(C_AtDVLDepth, self).__init__(name="C_AtDVLDepth")
 
     def update(self):
-        depth = self.bb.get(bb_enums.DEPTH)
+        depth = self.vs.depth
         if depth is None or depth < self.dvl_depth:
             msg = "Not deep enough for DVL: {}".format(depth)
             rospy.loginfo_throttle(10, msg)
@@ -42,13 +45,16 @@ class C_NoAbortReceived(pt.behaviour.Behaviour):
     This condition returns FAILURE forever after it returns it once.
     Used as a one-time lock
     """
+    blackboard_keys = (bb_enums.ABORT,)
+
     def __init__(self):
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.aborted = False
         super(C_NoAbortReceived, self).__init__(name="C_NoAbortReceived")
 
     def update(self):
-        if self.bb.get(bb_enums.ABORT) or self.aborted:
+        if self.vs.abort or self.aborted:
             self.aborted = True
             return pt.Status.FAILURE
         else:
@@ -57,6 +63,7 @@ class C_NoAbortReceived(pt.behaviour.Behaviour):
 class C_DepthOK(pt.behaviour.Behaviour):
     def __init__(self, max_depth):
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.max_depth = max_depth
         super(C_DepthOK, self).__init__(name="C_DepthOK")
 
@@ -68,7 +75,7 @@ class C_DepthOK(pt.behaviour.Behaviour):
         self.update = self.cbf_condition.update
 
     def update(self):
-        depth = self.bb.get(bb_enums.DEPTH)
+        depth = self.vs.depth
         self.feedback_message = "Last read:{}".format(depth)
 
         if depth is None:
@@ -83,12 +90,15 @@ class C_DepthOK(pt.behaviour.Behaviour):
 
 
 class C_LeakOK(pt.behaviour.Behaviour):
+    blackboard_keys = (bb_enums.LEAK,)
+
     def __init__(self):
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         super(C_LeakOK, self).__init__(name="C_LeakOK")
 
     def update(self):
-        if self.bb.get(bb_enums.LEAK) == True:
+        if self.vs.leak == True:
             return pt.Status.FAILURE
         else:
             return pt.Status.SUCCESS
@@ -98,6 +108,7 @@ class C_LeakOK(pt.behaviour.Behaviour):
 class C_AltOK(pt.behaviour.Behaviour):
     def __init__(self, min_alt, absolute_min_alt):
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         self.min_alt = min_alt
         self.absolute_min_alt = absolute_min_alt
         super(C_AltOK, self).__init__(name="C_AltOK")
@@ -112,7 +123,7 @@ class C_AltOK(pt.behaviour.Behaviour):
         self.first_alt = None
 
     def update(self):
-        alt = self.bb.get(bb_enums.ALTITUDE)
+        alt = self.vs.altitude
         self.feedback_message = "Last read:{}".format(alt)
         if alt is None:
             rospy.logwarn_throttle(10, "NO ALTITUDE READ! The tree will run anyways")
@@ -135,6 +146,8 @@ class C_AltOK(pt.behaviour.Behaviour):
 
 
 class C_StartPlanReceived(pt.behaviour.Behaviour):
+    blackboard_keys = (bb_enums.PLAN_IS_GO,)
+
     def __init__(self):
         """
         return SUCCESS if we the tree received a plan_control message that
@@ -143,10 +156,11 @@ class C_StartPlanReceived(pt.behaviour.Behaviour):
         FAILURE otherwise.
         """
         self.bb = pt.blackboard.Blackboard()
+        self.vs = vehicle_state.VEHICLE_STATE
         super(C_StartPlanReceived, self).__init__(name="C_StartPlanReceived")
 
     def update(self):
-        plan_is_go = self.bb.get(bb_enums.PLAN_IS_GO)
+        plan_is_go = self.vs.plan_is_go
         self.feedback_message = "Plan is go:{}".format(plan_is_go)
         if plan_is_go is None or plan_is_go == False:
             rospy.loginfo_throttle_identical(5, "Waiting for start plan")
@@ -175,6 +189,9 @@ class C_PlanCompleted(pt.behaviour.Behaviour):
         return pt.Status.SUCCESS
 
 class C_HaveRefinedMission(pt.behaviour.Behaviour):
+    # A_RefineMission bumps the version when it refines the plan in place
+    blackboard_keys = (bb_enums.MISSION_PLAN_OBJ,)
+
     def __init__(self):
         self.bb = pt.blackboard.Blackboard()
         super(C_HaveRefinedMission, self).__init__(name="C_HaveRefinedMission")
@@ -187,6 +204,8 @@ class C_HaveRefinedMission(pt.behaviour.Behaviour):
         return pt.Status.SUCCESS
 
 class C_HaveCoarseMission(pt.behaviour.Behaviour):
+    blackboard_keys = (bb_enums.MISSION_PLAN_OBJ,)
+
     def __init__(self):
         self.bb = pt.blackboard.Blackboard()
         super(C_HaveCoarseMission, self).__init__(name="C_HaveCoarseMission")
@@ -281,6 +300,8 @@ class C_NoNewPOIDetected(pt.behaviour.Behaviour):
 
 
 class C_AutonomyDisabled(pt.behaviour.Behaviour):
+    blackboard_keys = (bb_enums.ENABLE_AUTONOMY,)
+
     def __init__(self):
         super(C_AutonomyDisabled, self).__init__(name="C_AutonomyDisabled")
         self.bb = pt.blackboard.Blackboard()
@@ -294,6 +315,9 @@ class C_AutonomyDisabled(pt.behaviour.Behaviour):
 
 
 class C_LeaderFollowerEnabled(pt.behaviour.Behaviour):
+    # decided at construction, never changes
+    blackboard_keys = ()
+
     def __init__(self, enable_leader_follower):
         super(C_LeaderFollowerEnabled, self).__init__(name="C_LeaderFollowerEnabled")
         self.bb = pt.blackboard.Blackboard()
@@ -307,7 +331,10 @@ class C_LeaderFollowerEnabled(pt.behaviour.Behaviour):
 
 
 class C_LeaderExists(pt.behaviour.Behaviour):
-    def __init__(self, base_link, leader_link):
+    # decided in setup, never changes
+    blackboard_keys = ()
+
+    def __init__(self, base_link, leader_link, tf_listener=None):
         self.leader_link = leader_link
         self.base_link = base_link
         # strings might be ever so slightly different...
@@ -320,7 +347,9 @@ class C_LeaderExists(pt.behaviour.Behaviour):
         self.leader_exists = False
 
         self.bb = pt.blackboard.Blackboard()
-        self.listener = tf.TransformListener()
+        if tf_listener is None:
+            tf_listener = shared_tf_listener()
+        self.listener = tf_listener
 
         super(C_LeaderExists, self).__init__(name="C_LeaderExists")
 
@@ -352,12 +381,14 @@ class C_LeaderExists(pt.behaviour.Behaviour):
 
 
 class C_LeaderIsFarEnough(pt.behaviour.Behaviour):
-    def __init__(self, base_link, leader_link, min_distance_to_leader):
+    def __init__(self, base_link, leader_link, min_distance_to_leader, tf_listener=None):
         self.leader_link = leader_link
         self.base_link = base_link
         self.min_distance_to_leader = min_distance_to_leader
         self.bb = pt.blackboard.Blackboard()
-        self.listener = tf.TransformListener()
+        if tf_listener is None:
+            tf_listener = shared_tf_listener()
+        self.listener = tf_listener
         self.leader_exists = False
         super(C_LeaderIsFarEnough, self).__init__(name="C_LeaderIsFarEnough")
 
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+A per-tick journal of the vehicle state, the tree tip and the plan progress,
+for looking at a mission after it is done.
+
+Every tick is one fixed-size binary record in a memory-mapped file of a fixed size.
+When the file is full, the oldest records are overwritten.
+The records are packed and written on a background thread, the tick only
+puts a tuple into a queue.
+
+    journal = TickJournal(path, max_bytes, tick_trace)
+    ...
+    journal.record(vs, bb)  # after every tick
+    ...
+    journal.close()
+
+    records = read_journal(path)  # numpy structured array, oldest first
+    records['depth'], records['tip_id'], ...
+    names = read_journal_nodes(path)  # names[records['tip_id'][i]]
+
+A journal that is already at path is not overwritten, it is moved to path.1
+and the ones before it to path.2 and so on, up to keep_previous of them.
+read_journal(path+'.1') is the previous run.
+
+Things that are not numbers (plan id, running action name) are not recorded.
+None is recorded as NaN for floats and -1 for everything else.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import bb_enums
+
+
+MAGIC = b'SMBTJRNL'
+VERSION = 1
+# magic, version, record size, capacity, number of records written so far
+HEADER = struct.Struct('<8sIIQQ')
+# room to grow the header without moving the records
+HEADER_SIZE = 64
+
+# (name, struct code). numpy dtypes are made from the same codes
+FIELDS = [('tick', 'q'),
+          ('time', 'd'),
+          ('duration', 'f'),
+          ('tip_id', 'h'),
+          ('tip_status', 'b'),
+          ('depth', 'd'),
+          ('altitude', 'd'),
+          ('leak', 'b'),
+          ('abort', 'b'),
+          ('plan_is_go', 'b'),
+          ('enable_autonomy', 'b'),
+          ('dvl_is_running', 'b'),
+          ('x', 'd'),
+          ('y', 'd'),
+          ('z', 'd'),
+          ('qx', 'd'),
+          ('qy', 'd'),
+          ('qz', 'd'),
+          ('qw', 'd'),
+          ('lat', 'd'),
+          ('lon', 'd'),
+          ('utm_zone', 'h'),
+          ('utm_band', 'c'),
+          ('wp_index', 'i'),
+          ('num_wps', 'i'),
+          ('num_refined_wps', 'i')]
+
+RECORD = struct.Struct('<'+''.join(code for name, code in FIELDS))
+
+_NUMPY_CODES = {'q':'<i8', 'd':'<f8', 'f':'<f4', 'i':'<i4', 'h':'<i2', 'b':'i1', 'c':'S1'}
+_NAN = float('nan')
+_STOP = object()
+
+
+def _f(value):
+    return _NAN if value is None else value
+
+def _i(value):
+    return -1 if value is None else int(value)
+
+
+def rotate_journals(path, keep_previous):
+    """
+    path -> path.1 -> path.2 ... with their .nodes files, the oldest past keep_previous is removed
+    """
+    def names(i):
+        base = path if i == 0 else '{}.{}'.format(path, i)
+        return [base, base+'.nodes']
+
+    for name in names(keep_previous):
+        if os.path.exists(name):
+            os.remove(name)
+    for i in range(keep_previous-1, -1, -1):
+        for old, new in zip(names(i), names(i+1)):
+            if os.path.exists(old):
+                os.rename(old, new)
+
+
+class TickJournal(object):
+    def __init__(self, path, max_bytes, tick_trace, queue_size=1000, keep_previous=3):
+        self.path = path
+        self.tick_trace = tick_trace
+        self.capacity = (max_bytes - HEADER_SIZE) // RECORD.size
+        if self.capacity <= 0:
+            raise ValueError("max_bytes={} can not fit a single record".format(max_bytes))
+
+        # ticks that could not be journaled because the writer fell behind
+        self.num_dropped = 0
+        self.num_written = 0
+
+        rotate_journals(path, keep_previous)
+        with open(path+'.nodes', 'w+') as f:
+            for node in tick_trace.nodes:
+                f.write(node.name+'\n')
+
+        size = HEADER_SIZE + self.capacity*RECORD.size
+        self._file = open(path, 'w+b')
+        self._file.truncate(size)
+        self._mm = mmap.mmap(self._file.fileno(), size)
+        self._write_header()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name="tick_journal")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write_header(self):
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.num_written)
+
+    def record(self, vs, bb):
+        """
+        call once after every tick, with the vehicle_state.VEHICLE_STATE and the blackboard.
+        Only reads things, the rest happens on the writer thread.
+        """
+        mission_plan = vs.mission_plan
+        if mission_plan is None:
+            progress = (None, None, None)
+        else:
+            refined = mission_plan.refined_waypoints
+            progress = (mission_plan.current_wp_index,
+                        len(mission_plan.waypoints),
+                        None if refined is None else len(refined))
+
+        entry = (time.time(),
+                 self.tick_trace.last_record(),
+                 vs.depth, vs.altitude, vs.leak, vs.abort, vs.plan_is_go,
+                 bb.get(bb_enums.ENABLE_AUTONOMY), bb.get(bb_enums.DVL_IS_RUNNING),
+                 vs.world_trans, vs.world_rot, vs.lat, vs.lon, vs.utm_zone, vs.utm_band,
+                 progress)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.num_dropped += 1
+
+    def _pack(self, offset, entry):
+        (t, (tick, tip_id, tip_status, duration),
+         depth, altitude, leak, abort, plan_is_go, enable_autonomy, dvl_is_running,
+         trans, rot, lat, lon, utm_zone, utm_band, (wp_index, num_wps, num_refined_wps)) = entry
+
+        if trans is None:
+            trans = (_NAN, _NAN, _NAN)
+        if rot is None:
+            rot = (_NAN, _NAN, _NAN, _NAN)
+        if utm_band is None:
+            utm_band = b'-'
+        else:
+            utm_band = str(utm_band)[:1].encode('ascii')
+
+        RECORD.pack_into(self._mm, offset,
+                         tick, t, duration, tip_id, tip_status,
+                         _f(depth), _f(altitude),
+                         _i(leak), _i(abort), _i(plan_is_go), _i(enable_autonomy), _i(dvl_is_running),
+                         trans[0], trans[1], trans[2],
+                         rot[0], rot[1], rot[2], rot[3],
+                         _f(lat), _f(lon),
+                         _i(utm_zone), utm_band,
+                         _i(wp_index), _i(num_wps), _i(num_refined_wps))
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                return
+            i = self.num_written % self.capacity
+            self._pack(HEADER_SIZE + i*RECORD.size, entry)
+            self.num_written += 1
+            self._write_header()
+
+    def close(self):
+        """
+        write what is left in the queue and close the file
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+
+
+
+def read_journal(path):
+    """
+    all the records in the journal at path as one numpy structured array, oldest first
+    """
+    dtype = np.dtype([(name, _NUMPY_CODES[code]) for name, code in FIELDS])
+
+    with open(path, 'rb') as f:
+        magic, version, record_size, capacity, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != dtype.itemsize:
+            raise ValueError("{} is not a version {} tick journal".format(path, VERSION))
+        f.seek(HEADER_SIZE)
+        # only what was written, the rest of the file is empty
+        records = np.fromfile(f, dtype=dtype, count=min(count, capacity))
+
+    if count <= capacity:
+        return records
+    # wrapped around, the oldest is right after the newest
+    oldest = count % capacity
+    return np.concatenate((records[oldest:], records[:oldest]))
+
+
+def read_journal_nodes(path):
+    """
+    names of the nodes, tip_id in the records indexes this
+    """
+    with open(path+'.nodes', 'r') as f:
+        return [line.rstrip('\n') for line in f]
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+How long it takes for a sensor reading to reach a decision in the tree.
+
+For every input topic of the tree, these are kept as histograms:
+    stamp_to_receipt: header stamp to our callback, only for messages with a header
+    receipt_to_write: our callback to the blackboard write in a tick
+    write_to_consume: blackboard write to a condition reading it
+    receipt_to_consume: our callback to a condition reading it, the whole thing
+    inter_arrival: between two callbacks
+Only the first consumption of each written value counts.
+"""
+
+import time
+
+import rospy
+import py_trees as pt
+import py_trees_ros as ptr
+
+from std_msgs.msg import Empty
+
+from bt_common import ReadTopic
+from bt_profiling import Histogram
+
+
+STAGES = ['stamp_to_receipt',
+          'receipt_to_write',
+          'write_to_consume',
+          'receipt_to_consume',
+          'inter_arrival']
+
+
+class TopicLatency(object):
+    def __init__(self, topic_name):
+        self.topic_name = topic_name
+        self.histograms = dict((stage, Histogram()) for stage in STAGES)
+
+        self.num_received = 0
+        self.num_written = 0
+        self.num_consumed = 0
+
+        self._last_receipt = None
+        # receipt time and number of the message that was last written to the bb
+        self._written_receipt = None
+        self._written_num = 0
+        self._write_time = None
+        self._consumed = True
+
+    def received(self, msg):
+        now = time.time()
+        if self._last_receipt is not None:
+            self.histograms['inter_arrival'].add(now - self._last_receipt)
+        self._last_receipt = now
+        self.num_received += 1
+
+        header = getattr(msg, 'header', None)
+        if header is not None and not header.stamp.is_zero():
+            self.histograms['stamp_to_receipt'].add(rospy.get_time() - header.stamp.to_sec())
+
+    def written(self):
+        if self.num_received == self._written_num:
+            # nothing new was received
+            return
+        now = time.time()
+        self._written_receipt = self._last_receipt
+        self._written_num = self.num_received
+        self._write_time = now
+        self._consumed = False
+        self.num_written += 1
+        self.histograms['receipt_to_write'].add(now - self._written_receipt)
+
+    def consumed(self):
+        if self._consumed:
+            return
+        now = time.time()
+        self._consumed = True
+        self.num_consumed += 1
+        self.histograms['write_to_consume'].add(now - self._write_time)
+        self.histograms['receipt_to_consume'].add(now - self._written_receipt)
+
+    def reset(self):
+        for hist in self.histograms.values():
+            hist.reset()
+        self.num_received = 0
+        self.num_written = 0
+        self.num_consumed = 0
+        self._written_num = 0
+
+
+
+class LatencyMonitor(object):
+    """
+    instrument() the tree before or after setup, but before ticking.
+    consumers is {behaviour name: [blackboard keys it reads]}
+    """
+    def __init__(self):
+        # topic name -> TopicLatency
+        self.topics = {}
+        # bb key -> TopicLatency that writes it
+        self._by_key = {}
+        self._subs = []
+
+    def instrument(self, root, consumers):
+        for node in root.iterate():
+            if isinstance(node, ReadTopic):
+                latency = self._add(node.topic_name, node.blackboard_variables.keys())
+                node.latency = latency
+
+            elif isinstance(node, ptr.subscribers.EventToBlackboard):
+                latency = self._add(node.topic_name, [node.variable_name])
+                # we can not get into its callback, so we listen to the same topic.
+                # this one is subscribed later, so rospy calls it after the tree's
+                self._subs.append(rospy.Subscriber(node.topic_name,
+                                                   getattr(node, 'topic_type', Empty),
+                                                   latency.received))
+                node.update = self._wrap_event_update(node, latency)
+
+        for node in root.iterate():
+            if node.name in consumers:
+                latencies = [self._by_key[k] for k in consumers[node.name] if k in self._by_key]
+                node.update = self._wrap_consumer_update(node.update, latencies)
+
+    def _add(self, topic_name, keys):
+        latency = self.topics.get(topic_name)
+        if latency is None:
+            latency = TopicLatency(topic_name)
+            self.topics[topic_name] = latency
+        for key in keys:
+            self._by_key[key] = latency
+        return latency
+
+    def _wrap_event_update(self, node, latency):
+        update = node.update
+        bb = pt.blackboard.Blackboard()
+        def event_update():
+            status = update()
+            # the event is in the bb only for the tick right after it arrived
+            if bb.get(node.variable_name):
+                latency.written()
+            return status
+        return event_update
+
+    def _wrap_consumer_update(self, update, latencies):
+        def consumer_update():
+            status = update()
+            for latency in latencies:
+                latency.consumed()
+            return status
+        return consumer_update
+
+
+    def histogram(self, topic_name, stage):
+        return self.topics[topic_name].histograms[stage]
+
+    def percentile(self, topic_name, stage, p):
+        """
+        seconds, see Histogram.percentile
+        """
+        return self.histogram(topic_name, stage).percentile(p)
+
+    def report(self):
+        s = "Sensor latencies\n"
+        for topic_name in sorted(self.topics.keys()):
+            latency = self.topics[topic_name]
+            s += "{} received:{} written:{} consumed:{}\n".format(
+                topic_name, latency.num_received, latency.num_written, latency.num_consumed)
+            for stage in STAGES:
+                hist = latency.histograms[stage]
+                if hist.count > 0:
+                    s += "  {:<22}{}\n".format(stage, hist.summary())
+        return s
+
+    def reset(self):
+        for latency in self.topics.values():
+            latency.reset()
+
+    def shutdown(self):
+        for sub in self._subs:
+            sub.unregister()
+        self._subs = []
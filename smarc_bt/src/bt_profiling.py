@@ -0,0 +1,307 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Tools to see where the time of a tick goes.
+None of these need ROS, so they can be used from benchmarks too.
+"""
+
+import array
+import math
+import time
+
+import py_trees as pt
+
+
+class Histogram(object):
+    """
+    A fixed-size histogram of durations, in seconds.
+    Bins are log-spaced so that 10us and 1s are recorded with the same
+    relative precision. Adding a value never allocates.
+    """
+    def __init__(self, min_value=1e-5, max_value=10.0, num_bins=120):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.num_bins = num_bins
+        self._log_min = math.log(min_value)
+        self._bins_per_log = num_bins / (math.log(max_value) - self._log_min)
+
+        self.counts = [0]*num_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = int((math.log(value) - self._log_min) * self._bins_per_log)
+            if i >= self.num_bins:
+                i = self.num_bins - 1
+
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def bin_upper_edge(self, i):
+        return math.exp(self._log_min + (i+1) / self._bins_per_log)
+
+    def percentile(self, p):
+        """
+        upper edge of the bin that contains the p'th percentile, p in [0,100].
+        the real value is at most one bin width smaller than this.
+        """
+        if self.count == 0:
+            return 0.0
+
+        target = self.count * p / 100.0
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c > 0:
+                return min(self.bin_upper_edge(i), self.max)
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def reset(self):
+        for i in range(self.num_bins):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def summary(self):
+        return "n:{:<6} mean:{:8.3f}ms p50:{:8.3f}ms p99:{:8.3f}ms max:{:8.3f}ms".format(
+            self.count,
+            self.mean()*1000,
+            self.percentile(50)*1000,
+            self.percentile(99)*1000,
+            self.max*1000)
+
+
+
+class TickProfiler(object):
+    """
+    Wraps the update() of every leaf behaviour in a tree to time it.
+    Per tick, the time of each leaf is summed up and put into a histogram
+    at the end of the tick. Composites do nothing in their own update(),
+    so a subtree costs the sum of its leaves.
+
+    Use start_tick/end_tick as pre/post tick handlers of the tree
+    or call them around tree.tick() yourself.
+    """
+    def __init__(self, root, subtree_names=None):
+        self.root = root
+
+        # names are not unique in the tree, so we index things by node
+        self.leaves = []
+        self.leaf_labels = []
+        self.leaf_hists = []
+        # time spent in each leaf this tick, None if it was not ticked
+        self._tick_times = []
+
+        for node in root.iterate():
+            if len(node.children) > 0:
+                continue
+            i = len(self.leaves)
+            self.leaves.append(node)
+            label = node.name
+            if label in self.leaf_labels:
+                label += "#{}".format(i)
+            self.leaf_labels.append(label)
+            self.leaf_hists.append(Histogram())
+            self._tick_times.append(None)
+            node.update = self._wrap_update(i, node.update)
+
+        # subtree name -> indices of leaves under it
+        self.subtrees = []
+        if subtree_names is None:
+            subtree_names = []
+        for name in subtree_names:
+            subtree = None
+            for node in root.iterate():
+                if node.name == name:
+                    subtree = node
+                    break
+            if subtree is None:
+                continue
+            under = set(id(n) for n in subtree.iterate())
+            indices = [i for i,leaf in enumerate(self.leaves) if id(leaf) in under]
+            self.subtrees.append((name, indices, Histogram()))
+
+        self.tick_hist = Histogram()
+        self.num_ticks = 0
+        self._tick_start = None
+        self.last_tick_duration = 0.0
+
+
+    def _wrap_update(self, i, update):
+        tick_times = self._tick_times
+        def timed_update():
+            t = time.time()
+            status = update()
+            tick_times[i] = (tick_times[i] or 0.0) + time.time() - t
+            return status
+        return timed_update
+
+    def start_tick(self, tree=None):
+        for i in range(len(self._tick_times)):
+            self._tick_times[i] = None
+        self._tick_start = time.time()
+
+    def end_tick(self, tree=None):
+        if self._tick_start is None:
+            return
+        self.last_tick_duration = time.time() - self._tick_start
+        self._tick_start = None
+        self.tick_hist.add(self.last_tick_duration)
+        self.num_ticks += 1
+
+        for i, t in enumerate(self._tick_times):
+            if t is not None:
+                self.leaf_hists[i].add(t)
+
+        for name, indices, hist in self.subtrees:
+            total = 0.0
+            ticked = False
+            for i in indices:
+                t = self._tick_times[i]
+                if t is not None:
+                    total += t
+                    ticked = True
+            if ticked:
+                hist.add(total)
+
+    def slowest_in_last_tick(self):
+        """
+        (label, seconds) of the leaf that took the longest in the last tick
+        """
+        slowest = (None, 0.0)
+        for label, t in zip(self.leaf_labels, self._tick_times):
+            if t is not None and t > slowest[1]:
+                slowest = (label, t)
+        return slowest
+
+    def report(self, top=10):
+        s = "Tick profile over {} ticks\n".format(self.num_ticks)
+        s += "{:<40}{}\n".format("TICK", self.tick_hist.summary())
+        s += "-- subtrees --\n"
+        for name, indices, hist in self.subtrees:
+            s += "{:<40}{}\n".format(name, hist.summary())
+        s += "-- top {} leaves by p99 --\n".format(top)
+        order = sorted(range(len(self.leaves)),
+                       key = lambda i: self.leaf_hists[i].percentile(99),
+                       reverse = True)
+        for i in order[:top]:
+            s += "{:<40}{}\n".format(self.leaf_labels[i], self.leaf_hists[i].summary())
+        return s
+
+    def reset(self):
+        self.tick_hist.reset()
+        for hist in self.leaf_hists:
+            hist.reset()
+        for name, indices, hist in self.subtrees:
+            hist.reset()
+        self.num_ticks = 0
+
+
+
+class TickTrace(object):
+    """
+    What the tip of the tree was and how long the tick took, for the last
+    capacity ticks. Everything is kept in preallocated arrays as numbers, so
+    record() does not allocate or format anything. Strings are only made
+    when dumping.
+
+    Nodes are numbered in the order root.iterate() gives them.
+    """
+    STATUSES = list(pt.common.Status)
+
+    def __init__(self, root, capacity=10000):
+        self.capacity = capacity
+        self.nodes = list(root.iterate())
+        self._node_ids = dict((id(node), i) for i,node in enumerate(self.nodes))
+        self._status_codes = dict((status, i) for i,status in enumerate(TickTrace.STATUSES))
+
+        self.ticks = array.array('l', [0]*capacity)
+        # -1 if there was no tip
+        self.tip_ids = array.array('h', [-1]*capacity)
+        self.tip_statuses = array.array('b', [-1]*capacity)
+        self.durations = array.array('d', [0.0]*capacity)
+        # total number of records, the next one goes to count % capacity
+        self.count = 0
+
+    def record(self, tip, duration):
+        i = self.count % self.capacity
+        self.ticks[i] = self.count
+        if tip is None:
+            self.tip_ids[i] = -1
+            self.tip_statuses[i] = -1
+        else:
+            self.tip_ids[i] = self._node_ids.get(id(tip), -1)
+            self.tip_statuses[i] = self._status_codes[tip.status]
+        self.durations[i] = duration
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def get(self, age=0):
+        """
+        (tick index, tip node or None, tip status or None, duration) of the
+        tick that was age ticks ago, 0 is the last one.
+        """
+        if age >= len(self):
+            return None
+        i = (self.count - 1 - age) % self.capacity
+        tip_id = self.tip_ids[i]
+        if tip_id < 0:
+            return self.ticks[i], None, None, self.durations[i]
+        return (self.ticks[i],
+                self.nodes[tip_id],
+                TickTrace.STATUSES[self.tip_statuses[i]],
+                self.durations[i])
+
+    def last_record(self):
+        """
+        (tick index, tip node index, tip status index, duration) of the last tick,
+        as the numbers they are stored as. (-1, -1, -1, 0.0) if nothing was recorded.
+        """
+        if self.count == 0:
+            return -1, -1, -1, 0.0
+        i = (self.count - 1) % self.capacity
+        return self.ticks[i], self.tip_ids[i], self.tip_statuses[i], self.durations[i]
+
+    def last_tip(self):
+        """
+        (name, status) of the tip after the last tick, ('', None) if there was none
+        """
+        if self.count == 0:
+            return '', None
+        i = (self.count - 1) % self.capacity
+        tip_id = self.tip_ids[i]
+        if tip_id < 0:
+            return '', None
+        return self.nodes[tip_id].name, TickTrace.STATUSES[self.tip_statuses[i]]
+
+    def dump(self, path):
+        """
+        write what we have, oldest first, one tick per line
+        """
+        with open(path, 'w+') as f:
+            f.write("# tick tip status duration_ms\n")
+            for age in range(len(self)-1, -1, -1):
+                tick, tip, status, duration = self.get(age)
+                f.write("{} {} {} {:.3f}\n".format(
+                    tick,
+                    tip.name if tip is not None else '-',
+                    status.name if status is not None else '-',
+                    duration*1000))
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Things that decide WHEN the tree is ticked.
+"""
+
+import threading
+import time
+
+import rospy
+import py_trees as pt
+
+
+class TickTrigger(object):
+    """
+    Lets topic callbacks ask for a tick right now instead of waiting for
+    the next periodic one.
+
+    Any number of requests that arrive before a tick starts are served by
+    that one tick. Requests that arrive during a tick cause another one after it,
+    because the behaviour that reads that topic might have already run.
+    Event ticks are never closer than 1/max_rate apart.
+
+    Uses wall time, so with sim time the periodic ticks follow the wall clock.
+    """
+    def __init__(self, max_rate):
+        self.min_interval = 1.0/max_rate
+        self._cond = threading.Condition()
+        self._requested = False
+        self._last_tick = 0.0
+        self._subs = []
+
+        self.num_requests = 0
+        self.num_event_ticks = 0
+
+    def watch(self, topic_name, topic_type):
+        """
+        request a tick whenever something arrives on this topic.
+        create these AFTER the tree is set up, rospy calls the callbacks of a topic
+        in the order they were subscribed, so the tree's own subscribers
+        will have stored the message by the time we request the tick.
+        """
+        self._subs.append(rospy.Subscriber(topic_name, topic_type, self.request, queue_size=1))
+
+    def request(self, *args):
+        with self._cond:
+            self._requested = True
+            self.num_requests += 1
+            self._cond.notify()
+
+    def wait(self, deadline):
+        """
+        block until the wall time deadline or until an event tick is due.
+        returns True if woken up by an event.
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._requested:
+                    earliest = self._last_tick + self.min_interval
+                    if now >= earliest:
+                        self.num_event_ticks += 1
+                        return True
+                    wake_at = min(deadline, earliest)
+                else:
+                    wake_at = deadline
+
+                if now >= deadline:
+                    return False
+
+                self._cond.wait(wake_at - now)
+
+    def tick_started(self):
+        """
+        call right before ticking, everything requested until now is served by this tick
+        """
+        with self._cond:
+            self._requested = False
+            self._last_tick = time.time()
+
+    def shutdown(self):
+        for sub in self._subs:
+            sub.unregister()
+        self._subs = []
+
+
+
+class TickRateScheduler(object):
+    """
+    Picks a tick rate depending on what the tree is doing.
+
+    'active' if any of the active_actions are RUNNING.
+    'idle' if any of the idle_conditions have their given status. 'default' otherwise.
+    Speeding up happens right away, slowing down only after the slower mode
+    has been wanted for hysteresis seconds.
+
+    The safety_subtrees are never ticked slower than safety_rate. When the mode
+    is slower than that, the loop still runs at safety_rate and tick_safety()
+    ticks only those subtrees in between the full ticks. The pre and post tick
+    handlers of the tree run around those too, so the tf cache and the cbf
+    list are as fresh as in a full tick.
+    """
+    def __init__(self, tree, rates, active_actions, idle_conditions, hysteresis,
+                 safety_subtrees=(), safety_rate=None):
+        self.tree = tree
+        self.rates = rates
+        self.active_actions = active_actions
+        self.hysteresis = hysteresis
+        self.safety_rate = safety_rate
+
+        self._active_nodes = []
+        self._idle_nodes = []
+        # iterate() is in tree order, so data ingestion comes before the checks that use it
+        self._safety_nodes = []
+        for node in tree.root.iterate():
+            if node.name in active_actions:
+                self._active_nodes.append(node)
+            if node.name in idle_conditions:
+                self._idle_nodes.append((node, pt.common.Status[idle_conditions[node.name]]))
+            if node.name in safety_subtrees:
+                self._safety_nodes.append(node)
+
+        self.mode = 'default'
+        self._wanted_mode = None
+        self._wanted_since = None
+        self._safety_ticks_left = 0
+
+        self.num_safety_ticks = 0
+
+    @property
+    def rate(self):
+        return self.rates[self.mode]
+
+    @property
+    def loop_rate(self):
+        """
+        how often the tick loop should run, full ticks or safety ticks
+        """
+        if self.safety_rate is None or len(self._safety_nodes) == 0:
+            return self.rate
+        return max(self.rate, self.safety_rate)
+
+    def wanted_mode(self):
+        for node in self._active_nodes:
+            if node.status == pt.common.Status.RUNNING:
+                return 'active'
+        for node, status in self._idle_nodes:
+            if node.status == status:
+                return 'idle'
+        return 'default'
+
+    def _update_mode(self, now):
+        mode = self.wanted_mode()
+        if mode == self.mode:
+            self._wanted_mode = None
+            return
+
+        if self.rates[mode] > self.rate:
+            self.mode = mode
+            self._wanted_mode = None
+            return
+
+        if mode != self._wanted_mode:
+            self._wanted_mode = mode
+            self._wanted_since = now
+        elif now - self._wanted_since >= self.hysteresis:
+            self.mode = mode
+            self._wanted_mode = None
+
+    def update(self, now=None):
+        """
+        call after every full tick, returns the rate to run the tick loop at
+        """
+        if now is None:
+            now = time.time()
+        self._update_mode(now)
+        self._safety_ticks_left = int(round(self.loop_rate/float(self.rate))) - 1
+        return self.loop_rate
+
+    def tick_safety(self):
+        """
+        call instead of a full tick. if it is time for a safety-only tick, ticks
+        the safety subtrees and returns True, the full tick should be skipped then.
+        these ticks are not seen by the tick trace, journal or profiler, or by the visitors.
+        """
+        if self._safety_ticks_left <= 0:
+            return False
+        self._safety_ticks_left -= 1
+        tree = self.tree
+        for handler in tree.pre_tick_handlers:
+            handler(tree)
+        for node in self._safety_nodes:
+            node.tick_once()
+        for handler in tree.post_tick_handlers:
+            handler(tree)
+        self.num_safety_ticks += 1
+        # something in there started running, speed up and make the next tick a full one
+        if self.rates[self.wanted_mode()] > self.rate:
+            self._update_mode(time.time())
+            self._safety_ticks_left = 0
+        return True
@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+In-process stand-ins for the parts of rospy, tf and actionlib that the
+tree uses, so that the whole tree can be built and ticked without a ros master.
+Messages are the real generated ones.
+
+Call install() BEFORE constructing any behaviours.
+Everything here is synchronous: publishing on a topic calls the callbacks of
+all the stand-in subscribers of that topic right away.
+"""
+
+import collections
+
+import numpy as np
+import rospy
+import rospy.rostime
+import tf
+import actionlib
+import actionlib_msgs.msg as actionlib_msgs
+
+
+class World(object):
+    """
+    Shared state of all the stand-ins.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        forget everything, the stand-ins made before this are disconnected
+        """
+        # topic name -> list of StandinSubscriber
+        self.subscribers = collections.defaultdict(list)
+        # topic name -> list of StandinPublisher
+        self.publishers = collections.defaultdict(list)
+        # service name -> handler(request) -> response
+        self.service_handlers = {}
+        # (target, source) -> (trans, rot)
+        self.transforms = {}
+        # action namespace -> how many steps until a sent goal succeeds
+        self.action_durations = {}
+        # incremented by the harness once per tick, actions use it as their clock
+        self.step_count = 0
+
+    def step(self):
+        self.step_count += 1
+
+    def inject(self, topic, msg):
+        """
+        deliver msg to all subscribers of topic, as if someone published it
+        """
+        for sub in self.subscribers[topic]:
+            sub.deliver(msg)
+
+    def set_transform(self, target, source, trans, rot=(0.,0.,0.,1.)):
+        self.transforms[(target, source)] = (list(trans), list(rot))
+
+    def published(self, topic):
+        """
+        total number of messages published on topic
+        """
+        return sum(p.num_published for p in self.publishers[topic])
+
+    def last_published(self, topic):
+        last = None
+        for p in self.publishers[topic]:
+            if p.last_msg is not None:
+                last = p.last_msg
+        return last
+
+
+WORLD = World()
+
+
+
+class StandinPublisher(object):
+    def __init__(self, name, data_class, *args, **kwargs):
+        self.name = name
+        self.resolved_name = name
+        self.data_class = data_class
+        self.num_published = 0
+        self.last_msg = None
+        WORLD.publishers[name].append(self)
+
+    def publish(self, *args, **kwargs):
+        if len(args) == 1 and isinstance(args[0], self.data_class):
+            msg = args[0]
+        else:
+            # rospy lets you do pub.publish(False) for a Bool
+            msg = self.data_class(*args, **kwargs)
+        self.num_published += 1
+        self.last_msg = msg
+        WORLD.inject(self.name, msg)
+
+    def get_num_connections(self):
+        return len(WORLD.subscribers[self.name])
+
+    def unregister(self):
+        if self in WORLD.publishers[self.name]:
+            WORLD.publishers[self.name].remove(self)
+
+
+class StandinSubscriber(object):
+    def __init__(self, name, data_class, callback=None, callback_args=None, queue_size=None, *args, **kwargs):
+        self.name = name
+        self.resolved_name = name
+        self.data_class = data_class
+        self.callback = callback
+        self.callback_args = callback_args
+        WORLD.subscribers[name].append(self)
+
+    def deliver(self, msg):
+        if self.callback is None:
+            return
+        if self.callback_args is None:
+            self.callback(msg)
+        else:
+            self.callback(msg, self.callback_args)
+
+    def unregister(self):
+        if self in WORLD.subscribers[self.name]:
+            WORLD.subscribers[self.name].remove(self)
+
+
+class StandinServiceProxy(object):
+    def __init__(self, name, service_class, *args, **kwargs):
+        self.name = name
+        self.service_class = service_class
+
+    def __call__(self, *args, **kwargs):
+        handler = WORLD.service_handlers.get(self.name)
+        if len(args) == 1 and isinstance(args[0], self.service_class._request_class):
+            req = args[0]
+        else:
+            req = self.service_class._request_class(*args, **kwargs)
+        if handler is None:
+            return self.service_class._response_class()
+        return handler(req)
+
+    call = __call__
+
+    def wait_for_service(self, timeout=None):
+        return
+
+
+class StandinService(object):
+    def __init__(self, name, service_class, handler, *args, **kwargs):
+        self.name = name
+        self.service_class = service_class
+        WORLD.service_handlers[name] = handler
+
+    def shutdown(self, reason=''):
+        WORLD.service_handlers.pop(self.name, None)
+
+
+def standin_wait_for_service(service, timeout=None):
+    return
+
+
+
+class StandinTransformListener(object):
+    """
+    Only knows the transforms put into WORLD.transforms, does not chain them.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _get(self, target, source):
+        if target == source:
+            return [0.,0.,0.], [0.,0.,0.,1.]
+        try:
+            return WORLD.transforms[(target, source)]
+        except KeyError:
+            raise tf.LookupException("No stand-in transform from {} to {}".format(source, target))
+
+    def waitForTransform(self, target, source, time, timeout, polling_sleep_duration=None):
+        self._get(target, source)
+
+    def canTransform(self, target, source, time):
+        return target == source or (target, source) in WORLD.transforms
+
+    def lookupTransform(self, target, source, time):
+        trans, rot = self._get(target, source)
+        return list(trans), list(rot)
+
+    def asMatrix(self, target, hdr):
+        trans, rot = self._get(target, hdr.frame_id)
+        return self.fromTranslationRotation(trans, rot)
+
+    def fromTranslationRotation(self, translation, rotation):
+        return np.dot(tf.transformations.translation_matrix(translation),
+                      tf.transformations.quaternion_matrix(rotation))
+
+    def transformPoint(self, target, ps):
+        mat44 = self.asMatrix(target, ps.header)
+        xyz = tuple(np.dot(mat44, np.array([ps.point.x, ps.point.y, ps.point.z, 1.0])))[:3]
+        r = type(ps)()
+        r.header.stamp = ps.header.stamp
+        r.header.frame_id = target
+        r.point.x, r.point.y, r.point.z = xyz
+        return r
+
+
+class StandinSimpleActionClient(object):
+    """
+    Goals succeed after WORLD.action_durations[ns] steps, 1 by default.
+    """
+    def __init__(self, ns, action_spec):
+        self.ns = ns
+        self.action_spec = action_spec
+        self.goal = None
+        self.num_goals_sent = 0
+        self._sent_at = None
+        self._state = actionlib_msgs.GoalStatus.LOST
+
+    def wait_for_server(self, timeout=None):
+        return True
+
+    def send_goal(self, goal, done_cb=None, active_cb=None, feedback_cb=None):
+        self.goal = goal
+        self.num_goals_sent += 1
+        self._sent_at = WORLD.step_count
+        self._state = actionlib_msgs.GoalStatus.ACTIVE
+
+    def get_state(self):
+        if self._state == actionlib_msgs.GoalStatus.ACTIVE:
+            duration = WORLD.action_durations.get(self.ns, 1)
+            if WORLD.step_count - self._sent_at >= duration:
+                self._state = actionlib_msgs.GoalStatus.SUCCEEDED
+        return self._state
+
+    def get_result(self):
+        if self.get_state() == actionlib_msgs.GoalStatus.SUCCEEDED:
+            return self.action_spec().action_result.result
+        return None
+
+    def cancel_goal(self):
+        if self._state == actionlib_msgs.GoalStatus.ACTIVE:
+            self._state = actionlib_msgs.GoalStatus.PREEMPTED
+
+    def cancel_all_goals(self):
+        self.cancel_goal()
+
+
+
+def install():
+    """
+    Replace the ros-talking parts of rospy, tf and actionlib with the stand-ins.
+    Returns the shared WORLD object.
+    """
+    rospy.Publisher = StandinPublisher
+    rospy.Subscriber = StandinSubscriber
+    rospy.ServiceProxy = StandinServiceProxy
+    rospy.Service = StandinService
+    rospy.wait_for_service = standin_wait_for_service
+    # time and the throttled loggers work without a master once this is set
+    rospy.rostime.set_rostime_initialized(True)
+    tf.TransformListener = StandinTransformListener
+    actionlib.SimpleActionClient = StandinSimpleActionClient
+    return WORLD
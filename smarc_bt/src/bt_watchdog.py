@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Starts the emergency surfacing as soon as a leak or an abort arrives,
+without waiting for the tree to tick.
+
+The callbacks only note what happened and wake up the watchdog thread, which
+then, holding the goal_lock of the tree's A_EmergencySurface:
+    - marks the leak/abort in the vehicle state and hands the message to the
+      tree's own reader of that topic, so the next tick sees the emergency even
+      if the tree's subscriber did not get the message yet
+    - cancels the goals of the maneuver actions that are out, the tree can not
+      go back into one of them since its safety checks now fail
+    - sends the goal of A_EmergencySurface with its send_goal_once
+      and/or does what A_EmergencySurfaceByForce does
+On its next tick, A_EmergencySurface follows the goal that is already out
+instead of sending another. The watchdog surfaces once.
+
+    watchdog = EmergencyWatchdog(leak_topic, abort_topic, emergency_action=node, maneuver_actions=[goto, ...],
+                                 leak_reader=read_leak, abort_reader=read_abort)
+    watchdog.setup()  # after tree.setup
+"""
+
+import threading
+import time
+
+import rospy
+import actionlib_msgs.msg as actionlib_msgs
+
+from sam_msgs.msg import Leak
+from std_msgs.msg import Empty
+
+import vehicle_state
+from bt_profiling import Histogram
+
+
+class EmergencyWatchdog(object):
+    def __init__(self,
+                 leak_topic,
+                 abort_topic,
+                 emergency_action=None,
+                 by_force=None,
+                 max_dispatch_time=0.05,
+                 on_emergency=None,
+                 maneuver_actions=None,
+                 leak_reader=None,
+                 abort_reader=None):
+        """
+        emergency_action: the A_EmergencySurface of the tree, set up
+        maneuver_actions: py_trees_ros ActionClients of the tree whose goals are cancelled first
+        leak_reader, abort_reader: the behaviours of the tree that read those topics,
+            anything with a callback(msg) like ReadTopic and the ptr subscribers
+        by_force: a set up A_EmergencySurfaceByForce, does not need to be in the tree
+        max_dispatch_time: seconds, slower dispatches are logged as errors
+        on_emergency: called with no arguments after dispatching, like TickTrigger.request
+        """
+        if emergency_action is None and by_force is None:
+            raise ValueError("The watchdog needs an emergency_action or by_force to surface with")
+
+        self.leak_topic = leak_topic
+        self.abort_topic = abort_topic
+        self.emergency_action = emergency_action
+        self.by_force = by_force
+        self.max_dispatch_time = max_dispatch_time
+        self.on_emergency = on_emergency
+        self.maneuver_actions = list(maneuver_actions or [])
+        self.readers = {'leak': leak_reader, 'abort': abort_reader}
+        # the one of emergency_action, shared with the tree
+        if emergency_action is not None:
+            self.goal_lock = emergency_action.goal_lock
+        else:
+            self.goal_lock = threading.RLock()
+
+        # callback to dispatch, seconds
+        self.dispatch_latency = Histogram()
+        # 'leak' or 'abort', None until it surfaced
+        self.dispatched_reason = None
+        self.num_late = 0
+
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        # (reason, message, time.time() of the callback) of the first emergency
+        self._pending = None
+        self._subs = []
+        self._thread = None
+        self._shutdown = False
+
+    def setup(self):
+        self._thread = threading.Thread(target=self._run, name="emergency_watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+        self._subs.append(rospy.Subscriber(self.leak_topic, Leak, self._leak_cb, queue_size=1))
+        self._subs.append(rospy.Subscriber(self.abort_topic, Empty, self._abort_cb, queue_size=1))
+        return True
+
+    def _leak_cb(self, msg):
+        if msg.value:
+            self._raise('leak', msg)
+
+    def _abort_cb(self, msg):
+        self._raise('abort', msg)
+
+    def _raise(self, reason, msg):
+        with self._lock:
+            if self._pending is not None or self.dispatched_reason is not None:
+                return
+            self._pending = (reason, msg, time.time())
+        self._wake.set()
+
+    def _run(self):
+        while not self._shutdown:
+            # with a timeout so that py2 does not block signals here
+            if not self._wake.wait(1.0):
+                continue
+            self._wake.clear()
+            with self._lock:
+                pending = self._pending
+            if pending is not None:
+                self._dispatch(*pending)
+
+    def _mark(self, reason, msg):
+        vs = vehicle_state.VEHICLE_STATE
+        if reason == 'leak':
+            vs.leak = True
+        else:
+            vs.abort = True
+        reader = self.readers[reason]
+        if reader is not None:
+            reader.callback(msg)
+
+    def _dispatch(self, reason, msg, received_at):
+        with self.goal_lock:
+            # first so that the tree can not go back into a maneuver we cancel
+            self._mark(reason, msg)
+            # stop driving towards a waypoint before surfacing
+            self._cancel_maneuvers()
+            if self.emergency_action is not None:
+                if self.emergency_action.action_client is None:
+                    rospy.logerr("Watchdog can not use the emergency action server!")
+                else:
+                    self.emergency_action.send_goal_once()
+            if self.by_force is not None:
+                self.by_force.force_surface()
+
+        latency = time.time() - received_at
+        self.dispatch_latency.add(latency)
+        if latency > self.max_dispatch_time:
+            self.num_late += 1
+            rospy.logerr("Emergency surfacing for {} was dispatched {:.1f}ms after the message, more than {:.1f}ms".format(
+                reason, latency*1000, self.max_dispatch_time*1000))
+        else:
+            rospy.logwarn("EMERGENCY SURFACING for {}, dispatched in {:.1f}ms".format(reason, latency*1000))
+
+        with self._lock:
+            self.dispatched_reason = reason
+            self._pending = None
+
+        if self.on_emergency is not None:
+            self.on_emergency()
+
+    def _cancel_maneuvers(self):
+        for action in self.maneuver_actions:
+            client = action.action_client
+            if client is None:
+                continue
+            if client.get_state() in [actionlib_msgs.GoalStatus.PENDING,
+                                      actionlib_msgs.GoalStatus.ACTIVE]:
+                client.cancel_goal()
+
+    def shutdown(self):
+        for sub in self._subs:
+            sub.unregister()
+        self._subs = []
+        self._shutdown = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
@@ -9,6 +9,43 @@
 ########################
 # Hz.
 BT_TICK_RATE = 3
+# if set to true, messages on the abort, leak and depth topics
+# cause an extra tick right away, in addition to the BT_TICK_RATE ticks.
+# can be overridden with the ~event_driven_ticks rosparam
+EVENT_DRIVEN_TICKS = False
+# Hz. cap on how often those extra ticks can happen
+EVENT_TICK_MAX_RATE = 10
+# if set to true, the tick rate is picked from TICK_RATES depending on
+# what the tree is doing, see bt_scheduling.TickRateScheduler
+# can be overridden with the ~adaptive_tick_rate rosparam
+ADAPTIVE_TICK_RATE = False
+# Hz.
+TICK_RATES = {'idle': 1,
+              'default': BT_TICK_RATE,
+              'active': 5}
+# if any of these are RUNNING, the tree is 'active'
+TICK_RATE_ACTIVE_ACTIONS = ['A_GotoWaypoint',
+                            'A_FollowLeader',
+                            'A_EmergencySurface',
+                            'A_EmergencySurfaceByForce']
+# otherwise, if any of these have the given status, the tree is 'idle'
+TICK_RATE_IDLE_CONDITIONS = {'C_StartPlanReceived': 'FAILURE',
+                             'C_PlanCompleted?': 'SUCCESS'}
+# seconds. a slower rate must be wanted for this long before we switch to it.
+# faster rates are switched to right away.
+TICK_RATE_HYSTERESIS = 3.0
+# these subtrees are ticked at least at SAFETY_MIN_TICK_RATE Hz, on their own
+# in between the full ticks if the tree is ticked slower than that
+SAFETY_SUBTREES = ['SQ-DataIngestion', 'FB_SafetyOK']
+SAFETY_MIN_TICK_RATE = BT_TICK_RATE
+# if set to true, conditions that declare the blackboard keys they read
+# are not ticked again until one of those keys is written to.
+# can be overridden with the ~skip_unchanged_conditions rosparam
+SKIP_UNCHANGED_CONDITIONS = False
+# if set to true, the tree is ticked through bt_compiled.CompiledTree
+# instead of the py_trees tick generators. same results, less overhead.
+# can be overridden with the ~compiled_ticks rosparam
+COMPILED_TICKS = False
 
 # these are from croatia, biograd coast
 DEFAULT_UTM_ZONE = 33
@@ -16,13 +53,25 @@ DEFAULT_UTM_BAND = 'T'
 # if set to true, utm zone and band will be set from
 # the gps fix we read instead of rosparams
 TRUST_GPS = True
+# meters. the utm zone/band from the gps only changes once the fix is this far
+# into the next one, so that we do not flip between two along a zone edge
+UTM_ZONE_HYSTERESIS = 50
+# meters. our lat/lon is computed from a local model of the utm projection
+# that is re-anchored when we move this far away from where it was made,
+# and its error is never more than LATLON_MAX_ERROR, see utm_projection.LocalLatLonProjector
+LATLON_REFRESH_DISTANCE = 500
+LATLON_MAX_ERROR = 0.05
 
 CBF_BT_TOPIC = 'cbf_bt/active_limits'
-# to ensure that the condition list is reset properly, set to True.
-CHECK_CBF_LIST = True
+# seconds. the cbf list is published only when it changes, and also after
+# this long without a change. None to never publish an unchanged list again.
+# can be overridden with the ~cbf_keepalive_period rosparam
+CBF_KEEPALIVE_PERIOD = None
 
 # how close do we expect the path planned waypoints to be to the coarse
-# plans a user creates
+# plans a user creates, a warning is logged for the ones the refined path misses.
+# also how far the refined path can be ahead of or behind the coarse one
+# when following it, see mission_plan.refined_to_coarse_indices
 COARSE_PLAN_REFINED_PLAN_THRESHOLD = 1
 
 # if a poi is Xm away from the latest, its a new one
@@ -30,5 +79,41 @@ POI_DIST = 10
 
 SETUP_TIMEOUT = 1.0
 
+# seconds. the neptus telemetry publishers are not ticked more often than this
+NEPTUS_TELEMETRY_PERIOD = 1.0
+# seconds. the plan viz is published latched when the plan changes, and also after
+# this long without a change. None to never publish an unchanged plan again.
+# can be overridden with the ~plan_viz_heartbeat_period rosparam
+PLAN_VIZ_HEARTBEAT_PERIOD = None
+
+# time every behaviour's update() while ticking, see bt_profiling.TickProfiler
+# can be overridden with the ~profile_ticks rosparam
+PROFILE_TICKS = False
+# these subtrees get their own lines in the profile report
+PROFILED_SUBTREES = ['SQ-DataIngestion', 'FB_SafetyOK', 'FB-Run']
+# how many ticks the tick trace remembers, ~55 minutes at 3Hz
+# call ~dump_tick_trace to write it to a file, it is also written at shutdown
+TICK_TRACE_LENGTH = 10000
+# if set to true, every tick is written into tick_journal.bin, see bt_journal
+# can be overridden with the ~journal_ticks rosparam
+JOURNAL_TICKS = False
+# the journal file never grows beyond this, old ticks are overwritten.
+# a tick is ~150 bytes, so this is ~100 hours at 3Hz
+JOURNAL_MAX_BYTES = 200*1024*1024
+# the journals of this many earlier runs are kept next to it as tick_journal.bin.1, .2...
+JOURNAL_KEEP_PREVIOUS = 3
+# if set to true, the time from a sensor message arriving to the tree using it is measured
+# see bt_latency, call ~dump_sensor_latency to get a report
+# can be overridden with the ~measure_sensor_latency rosparam
+MEASURE_SENSOR_LATENCY = False
+# if set to true, leak and abort messages start the emergency surfacing right away
+# from a separate thread instead of on the next tick, see bt_watchdog
+# can be overridden with the ~emergency_watchdog rosparam
+EMERGENCY_WATCHDOG = False
+# the watchdog also does what A_EmergencySurfaceByForce does
+EMERGENCY_WATCHDOG_BY_FORCE = False
+# seconds. the watchdog logs an error if it took longer than this to start surfacing
+EMERGENCY_DISPATCH_BOUND = 0.05
+
 
 
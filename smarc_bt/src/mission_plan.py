@@ -3,52 +3,141 @@
 # vim:fenc=utf-8
 # Ozer Ozkahraman (ozero@kth.se)
 
-from geodesy.utm import fromLatLong
 import rospy
-import tf
 import time
+import itertools
+import bisect
 import math
 import numpy as np
 
 import common_globals
 import imc_enums
 import bb_enums
-
-from geometry_msgs.msg import PointStamped, Pose, PoseArray
-
-class MissionPlan:
+from bt_common import shared_tf_listener
+from utm_projection import latlon_to_utm
+
+from geometry_msgs.msg import Pose, PoseArray
+from std_msgs.msg import Header
+
+# every plan and every change to one gets the next of these as its version,
+# so the same version is never seen for two different plans
+_PLAN_VERSIONS = itertools.count(1)
+
+
+def as_waypoint_array(waypoints):
+    """
+    (N,3) float64 array of the given waypoints, a list of (x,y,z) or an array
+    """
+    return np.array(waypoints, dtype=np.float64).reshape(-1, 3)
+
+
+def refined_to_coarse_indices(refined_waypoints, waypoints, threshold=None):
+    """
+    for every refined waypoint, the index of the coarse waypoint it leads to.
+    Segment k is from coarse waypoint k-1 to k, segment 0 from the start of the refined path to coarse 0.
+
+    Goes along the refined path, each point goes to the nearest segment in x,y that is
+    not before the previous point's, a point on a coarse waypoint to the segment that ends there.
+    A step of the refined path can only get as far along the coarse path as it is long,
+    plus threshold on either end, so a point that overshoots a turn towards a later leg
+    can not skip the waypoints before it. This is about refined + coarse for any size of plan.
+    threshold defaults to COARSE_PLAN_REFINED_PLAN_THRESHOLD
+    """
+    num_refined = len(refined_waypoints)
+    num_coarse = len(waypoints)
+    indices = np.zeros(num_refined, dtype=np.intp)
+    if num_refined == 0 or num_coarse == 0:
+        return indices
+    if threshold is None:
+        threshold = common_globals.COARSE_PLAN_REFINED_PLAN_THRESHOLD
+
+    # plain floats, numpy is slower than this for a few segments at a time
+    xs = refined_waypoints[:,0].tolist()
+    ys = refined_waypoints[:,1].tolist()
+    ends_x = waypoints[:,0].tolist()
+    ends_y = waypoints[:,1].tolist()
+    starts_x = [xs[0]] + ends_x[:-1]
+    starts_y = [ys[0]] + ends_y[:-1]
+    seg_x = [e - s for e, s in zip(ends_x, starts_x)]
+    seg_y = [e - s for e, s in zip(ends_y, starts_y)]
+    seg_len2 = [dx*dx + dy*dy for dx, dy in zip(seg_x, seg_y)]
+    # length of the coarse path up to each coarse waypoint, from coarse 0
+    arc = np.concatenate(([0.], np.cumsum(np.sqrt(seg_len2[1:])))).tolist()
+
+    last = num_coarse - 1
+    k = 0
+    px, py = xs[0], ys[0]
+    for i in range(num_refined):
+        x, y = xs[i], ys[i]
+        # passing coarse waypoints k..m-1 to get to segment m
+        reach = arc[k] + math.hypot(x-px, y-py) + 2*threshold
+        m_max = min(bisect.bisect_right(arc, reach, lo=k), last)
+        best = None
+        for m in range(k, m_max+1):
+            dx = seg_x[m]
+            dy = seg_y[m]
+            t = 0.
+            if seg_len2[m] > 0:
+                t = min(max(((x-starts_x[m])*dx + (y-starts_y[m])*dy)/seg_len2[m], 0.), 1.)
+            ex = x - starts_x[m] - t*dx
+            ey = y - starts_y[m] - t*dy
+            d2 = ex*ex + ey*ey
+            # the first of equals, the segment that ends at a waypoint
+            if best is None or d2 < best:
+                best = d2
+                k_new = m
+        k = k_new
+        indices[i] = k
+        px, py = x, y
+
+    return indices
+
+
+class MissionPlan(object):
     def __init__(self,
                  plan_frame,
                  local_frame,
                  plandb_msg,
                  waypoints=None,
-                 waypoint_man_ids=None):
+                 waypoint_man_ids=None,
+                 tf_listener=None):
         """
         A container object to keep things related to the mission plan.
+        tf_listener defaults to bt_common.shared_tf_listener()
+
+        waypoints and refined_waypoints are (N,3) float64 arrays of x,y,depth in local_frame
+        and waypoint_man_ids is an array of the same length.
+        Do not change them in place, assign new ones.
+        version changes when either of them is set, progress through the plan does not change it.
         """
         self.plandb_msg = plandb_msg
         self.local_frame = local_frame
+        if tf_listener is None:
+            tf_listener = shared_tf_listener()
+        self.tf_listener = tf_listener
         self.plan_id = plandb_msg.plan_id
 
         self.aborted = False
 
-        # a list of names for each maneuver
-        # good for feedback
-        self.waypoint_man_ids = []
+        # pose arrays of the waypoints, flip_z -> PoseArray
+        # made when first asked for, forgotten when the waypoints are set
+        self._pose_arrays = {}
 
         # if waypoints are given directly, then skip reading the plandb message
         if waypoints is None:
-            self.waypoints, self.waypoint_man_ids = self.read_plandb(plandb_msg, plan_frame, local_frame)
-        else:
-            self.waypoints = waypoints
-            self.waypoint_man_ids = waypoint_man_ids
-            if self.waypoint_man_ids is None:
-                self.waypoint_man_ids = []
-                for i,wp in enumerate(self.waypoints):
-                    self.waypoint_man_ids.append("Goto"+str(i+1))
+            waypoints, waypoint_man_ids = self.read_plandb(plandb_msg, plan_frame, local_frame, self.tf_listener)
+        elif waypoint_man_ids is None:
+            waypoint_man_ids = ["Goto"+str(i+1) for i in range(len(waypoints))]
 
+        self.waypoints = waypoints
+        # a name for each maneuver
+        # good for feedback
+        self.waypoint_man_ids = np.array(waypoint_man_ids, dtype=object)
 
         self.refined_waypoints = None
+        # set with the refined waypoints, see set_refined_waypoints
+        self.refined_to_coarse = None
+        self.refined_arc_length = None
 
         # keep track of which waypoint we are going to
         self.current_wp_index = 0
@@ -59,20 +148,21 @@ class MissionPlan:
 
 
     @staticmethod
-    def read_plandb(plandb, plan_frame, local_frame):
+    def read_plandb(plandb, plan_frame, local_frame, tf_listener):
         """
         planddb message is a bunch of nested objects,
-        we want a list of waypoints in the local frame,
+        we want an array of waypoints in the local frame,
         """
 
-        tf_listener = tf.TransformListener()
         try:
             tf_listener.waitForTransform(plan_frame, local_frame, rospy.Time(), rospy.Duration(4.0))
         except:
             rospy.logerr_throttle(5, "Could not find tf from:"+plan_frame+" to:"+local_frame)
 
-        waypoints = []
         waypoint_man_ids = []
+        lats = []
+        lons = []
+        depths = []
         request_id = plandb.request_id
         plan_id = plandb.plan_id
         plan_spec = plandb.plan_spec
@@ -84,61 +174,89 @@ class MissionPlan:
             maneuver = plan_man.maneuver
             # probably every maneuver has lat lon z in them, but just in case...
             if man_imc_id == imc_enums.MANEUVER_GOTO:
-                lat = maneuver.lat
-                lon = maneuver.lon
-                depth = maneuver.z
-                utm_point = fromLatLong(np.degrees(lat), np.degrees(lon)).toPoint()
-                stamped_utm_point = PointStamped()
-                stamped_utm_point.header.frame_id = plan_frame
-                stamped_utm_point.header.stamp = rospy.Time(0)
-                stamped_utm_point.point.x = utm_point.x
-                stamped_utm_point.point.y = utm_point.y
-                stamped_utm_point.point.z = depth
-                try:
-                    waypoint_local = tf_listener.transformPoint(local_frame, stamped_utm_point)
-                    # because the frame changes changes depth, we really want the original depth
-                    waypoint = (waypoint_local.point.x, waypoint_local.point.y, depth)
-                    waypoints.append(waypoint)
-                    waypoint_man_ids.append(man_id)
-                except:
-                    rospy.logwarn_throttle_identical(10, "Can not transform plan point to local point!")
+                lats.append(maneuver.lat)
+                lons.append(maneuver.lon)
+                depths.append(maneuver.z)
+                waypoint_man_ids.append(man_id)
             else:
                 rospy.logwarn("SKIPPING UNIMPLEMENTED MANEUVER:", man_imc_id, man_name)
 
+        if len(waypoint_man_ids) == 0:
+            return [], []
+
+        # all the points at once, then one matrix for the utm->local tf
+        eastings, northings, zones = latlon_to_utm(np.degrees(lats), np.degrees(lons))
+        try:
+            utm_to_local = tf_listener.asMatrix(local_frame, Header(frame_id=plan_frame, stamp=rospy.Time(0)))
+        except:
+            rospy.logwarn_throttle_identical(10, "Can not transform plan point to local point!")
+            return [], []
+
+        depths = np.array(depths, dtype=float)
+        utm_points = np.column_stack((eastings, northings, depths, np.ones(len(depths))))
+        local_points = utm_points.dot(utm_to_local.T)
+        # because the frame changes changes depth, we really want the original depth
+        local_points[:,2] = depths
+        waypoints = local_points[:,:3]
+
         return waypoints, waypoint_man_ids
 
 
+    @property
+    def waypoints(self):
+        return self._waypoints
 
-    def get_pose_array(self, vehicle_point_stamped=None, flip_z=False):
-        pa = PoseArray()
-        pa.header.frame_id = self.local_frame
+    @waypoints.setter
+    def waypoints(self, waypoints):
+        self._waypoints = as_waypoint_array(waypoints)
+        self._pose_arrays = {}
+        self.version = next(_PLAN_VERSIONS)
 
-        # add the vehicles location as the first waypoint
-        if vehicle_point_stamped is not None:
-            local_vehicle = self.tf_listener.transformPoint(self.local_frame, vehicle_point_stamped)
-            vp = Pose()
-            vp.position.x = local_vehicle.point.x
-            vp.position.y = local_vehicle.point.y
-            if flip_z:
-                vp.position.z = -local_vehicle.point.z
-            else:
-                vp.position.z = local_vehicle.point.z
-            pa.poses.append(vp)
 
-        # add the rest of the waypoints
-        for wp in self.waypoints:
+    def _waypoints_pose_array(self, flip_z):
+        pa = self._pose_arrays.get(flip_z)
+        if pa is not None:
+            return pa
+
+        pa = PoseArray()
+        pa.header.frame_id = self.local_frame
+        zs = -self.waypoints[:,2] if flip_z else self.waypoints[:,2]
+        for x, y, z in zip(self.waypoints[:,0].tolist(), self.waypoints[:,1].tolist(), zs.tolist()):
             p = Pose()
-            p.position.x = wp[0]
-            p.position.y = wp[1]
-            if flip_z:
-                p.position.z = -wp[2]
-            else:
-                p.position.z = wp[2]
+            p.position.x = x
+            p.position.y = y
+            p.position.z = z
             pa.poses.append(p)
-
+        self._pose_arrays[flip_z] = pa
         return pa
 
 
+    def get_pose_array(self, vehicle_point_stamped=None, flip_z=False):
+        """
+        the waypoints as a PoseArray. Without a vehicle point, this is the same
+        object every time until the waypoints change, do not modify it.
+        """
+        pa = self._waypoints_pose_array(flip_z)
+        if vehicle_point_stamped is None:
+            return pa
+
+        # add the vehicles location as the first waypoint
+        local_vehicle = self.tf_listener.transformPoint(self.local_frame, vehicle_point_stamped)
+        vp = Pose()
+        vp.position.x = local_vehicle.point.x
+        vp.position.y = local_vehicle.point.y
+        if flip_z:
+            vp.position.z = -local_vehicle.point.z
+        else:
+            vp.position.z = local_vehicle.point.z
+
+        with_vehicle = PoseArray()
+        with_vehicle.header.frame_id = self.local_frame
+        # the rest of the waypoints, the same Pose objects as the cached one
+        with_vehicle.poses = [vp] + pa.poses
+        return with_vehicle
+
+
     def path_to_list(self, path_msg):
         frame = path_msg.header.frame_id
         if frame != '' and frame != self.local_frame:
@@ -158,8 +276,8 @@ class MissionPlan:
 
     def __str__(self):
         s = ''
-        for wp in self.waypoints:
-            s += str(wp)+'\n'
+        for wp in self.waypoints.tolist():
+            s += str(tuple(wp))+'\n'
         if self.refined_waypoints is not None:
             s += "with "+str(len(self.refined_waypoints))+" refined waypoints"
         return s
@@ -170,8 +288,28 @@ class MissionPlan:
         given the waypoints in the plan, a path planner
         should create a more detailed and kinematically possible path
         to follow, we will keep that in this object too
+
+        refined_to_coarse[i] is the coarse waypoint the refined waypoint i leads to
+        and refined_arc_length[i] is the length of the refined path up to it
         """
-        self.refined_waypoints = refined_waypoints
+        refined = as_waypoint_array(refined_waypoints)
+        self.refined_to_coarse = refined_to_coarse_indices(refined, self.waypoints)
+        steps = np.sqrt(np.sum(np.diff(refined, axis=0)**2, axis=1))
+        self.refined_arc_length = np.concatenate(([0.], np.cumsum(steps)))[:len(refined)]
+        self.refined_waypoints = refined
+        self.version = next(_PLAN_VERSIONS)
+
+        # a planner that does not go near a coarse waypoint is worth knowing about
+        if len(refined) > 0 and len(self.waypoints) > 0:
+            coarse = self.waypoints[self.refined_to_coarse]
+            dists = np.hypot(refined[:,0]-coarse[:,0], refined[:,1]-coarse[:,1])
+            closest = np.full(len(self.waypoints), np.inf)
+            np.minimum.at(closest, self.refined_to_coarse, dists)
+            missed = np.nonzero(closest >= common_globals.COARSE_PLAN_REFINED_PLAN_THRESHOLD)[0]
+            if len(missed) > 0:
+                rospy.logwarn("The refined path does not pass within {}m of {} of the {} waypoints, first one:{}".format(
+                    common_globals.COARSE_PLAN_REFINED_PLAN_THRESHOLD, len(missed), len(self.waypoints),
+                    self.waypoint_man_ids[missed[0]]))
 
 
     def is_complete(self):
@@ -193,14 +331,31 @@ class MissionPlan:
         if self.is_complete() or self.refined_waypoints is None:
             return
 
-        ref_wp = self.refined_waypoints[self.current_refined_wp_index]
-        coarse_wp = self.waypoints[self.current_wp_index]
         self.current_refined_wp_index += 1
-        # check if the refined waypoint is close to a 'real' waypoint
-        # if it is, we can count the 'real' wp as reached too
-        diff = math.sqrt((ref_wp[0]-coarse_wp[0])**2 + (ref_wp[1]-coarse_wp[1])**2)
-        if diff < common_globals.COARSE_PLAN_REFINED_PLAN_THRESHOLD:
-            self.current_wp_index += 1
+        # the 'real' wp we are going to is the one the next refined wp leads to,
+        # once a refined wp that ends a segment is visited, we are on the next one
+        if self.current_refined_wp_index < len(self.refined_waypoints):
+            self.current_wp_index = int(self.refined_to_coarse[self.current_refined_wp_index])
+        else:
+            self.current_wp_index = len(self.waypoints)
+
+
+    def get_progress(self):
+        """
+        percent of the refined path that is done, by length.
+        the percent of coarse waypoints that are done before there is a refined path.
+        """
+        if self.is_complete():
+            return 100.0
+        if self.refined_waypoints is None:
+            return (self.current_wp_index * 100.0) / len(self.waypoints)
+
+        total = self.refined_arc_length[-1]
+        if total == 0:
+            return 0.0
+        # up to the last refined wp we visited
+        done = self.refined_arc_length[max(self.current_refined_wp_index-1, 0)]
+        return float(done * 100.0 / total)
 
 
     def get_current_wp(self):
@@ -209,7 +364,8 @@ class MissionPlan:
         """
         if self.is_complete() or self.refined_waypoints is None:
             return None
-        ref_wp = self.refined_waypoints[self.current_refined_wp_index]
+        # plain floats for the action goal
+        ref_wp = tuple(self.refined_waypoints[self.current_refined_wp_index].tolist())
         return ref_wp, self.local_frame
 
 
@@ -3,6 +3,7 @@
 # vim:fenc=utf-8
 # Ozer Ozkahraman (ozero@kth.se)
 
+import time
 import rospy
 import py_trees as pt
 import py_trees_ros as ptr
@@ -11,11 +12,12 @@ import py_trees_ros as ptr
 from py_trees.composites import Selector as Fallback
 
 # messages
-from std_msgs.msg import Float64
+from std_msgs.msg import Float64, Empty
 from sam_msgs.msg import Leak
 from cola2_msgs.msg import DVL
 from geometry_msgs.msg import PointStamped
 from sensor_msgs.msg import NavSatFix
+from std_srvs.srv import Trigger, TriggerResponse
 
 from auv_config import AUVConfig
 
@@ -59,13 +61,25 @@ from bt_common import Sequence, \
                       CheckBlackboardVariableValue, \
                       ReadTopic, \
                       A_RunOnce, \
-                      Counter
+                      Counter, \
+                      RateLimited, \
+                      install_blackboard_versions, \
+                      shared_tf_listener, \
+                      CBF_ACCUMULATOR
+
+from bt_profiling import TickProfiler, TickTrace
+from bt_compiled import CompiledTree
+from bt_journal import TickJournal
+from bt_latency import LatencyMonitor
+from bt_watchdog import EmergencyWatchdog
+from bt_scheduling import TickTrigger, TickRateScheduler
 
 
 # globally defined values
 import bb_enums
 import imc_enums
 import common_globals
+import vehicle_state
 
 def const_tree(auv_config):
     """
@@ -81,6 +95,8 @@ def const_tree(auv_config):
     # just for Neptus vehicle state for now
     bb = pt.blackboard.Blackboard()
     bb.set(bb_enums.MANEUVER_ACTIONS, [])
+    # every behaviour that looks up transforms uses this one
+    tf_listener = shared_tf_listener()
 
     def const_data_ingestion_tree():
         read_abort = ptr.subscribers.EventToBlackboard(
@@ -125,21 +141,31 @@ def const_tree(auv_config):
         )
 
         def const_neptus_tree():
-            update_neptus = Sequence(name="SQ-UpdateNeptus",
-                                     children=[
+            # these only publish, no need to do that as fast as the safety checks
+            telemetry = Sequence(name="SQ-NeptusTelemetry",
+                                 children=[
                 A_UpdateNeptusEstimatedState(auv_config.ESTIMATED_STATE_TOPIC),
                 A_UpdateNeptusPlanControlState(auv_config.PLAN_CONTROL_STATE_TOPIC),
                 A_UpdateNeptusVehicleState(auv_config.VEHICLE_STATE_TOPIC),
+                A_VizPublishPlan(auv_config.PLAN_VIZ_TOPIC,
+                                 rospy.get_param("~plan_viz_heartbeat_period", common_globals.PLAN_VIZ_HEARTBEAT_PERIOD))
+                                 ])
+
+            # these read plans and start/stop commands, they run every tick
+            update_neptus = Sequence(name="SQ-UpdateNeptus",
+                                     children=[
+                RateLimited(name="RL-NeptusTelemetry",
+                            child=telemetry,
+                            period=common_globals.NEPTUS_TELEMETRY_PERIOD),
                 A_UpdateNeptusPlanDB(auv_config.PLANDB_TOPIC,
                                      auv_config.UTM_LINK,
                                      auv_config.LOCAL_LINK),
-                A_UpdateNeptusPlanControl(auv_config.PLAN_CONTROL_TOPIC),
-                A_VizPublishPlan(auv_config.PLAN_VIZ_TOPIC)
+                A_UpdateNeptusPlanControl(auv_config.PLAN_CONTROL_TOPIC)
                                      ])
             return update_neptus
 
 
-        update_tf = A_UpdateTF(auv_config.UTM_LINK, auv_config.BASE_LINK)
+        update_tf = A_UpdateTF(auv_config.UTM_LINK, auv_config.BASE_LINK, tf_listener)
         update_latlon = A_UpdateLatLon()
         set_utm_from_gps = A_SetUTMFromGPS()
         neptus_tree = const_neptus_tree()
@@ -234,14 +260,16 @@ def const_tree(auv_config):
     def const_leader_follower():
         return Sequence(name="SQ_LeaderFollower",
                         children=[
-                            C_LeaderFollowerEnabled(config.ENABLE_LEADER_FOLLOWER),
-                            C_LeaderExists(config.BASE_LINK,
-                                           config.LEADER_LINK),
-                            C_LeaderIsFarEnough(config.BASE_LINK,
-                                                config.LEADER_LINK,
-                                                config.MIN_DISTANCE_TO_LEADER),
-                            A_FollowLeader(config.FOLLOW_ACTION_NAMESPACE,
-                                           config.LEADER_LINK)
+                            C_LeaderFollowerEnabled(auv_config.ENABLE_LEADER_FOLLOWER),
+                            C_LeaderExists(auv_config.BASE_LINK,
+                                           auv_config.LEADER_LINK,
+                                           tf_listener),
+                            C_LeaderIsFarEnough(auv_config.BASE_LINK,
+                                                auv_config.LEADER_LINK,
+                                                auv_config.MIN_DISTANCE_TO_LEADER,
+                                                tf_listener),
+                            A_FollowLeader(auv_config.FOLLOW_ACTION_NAMESPACE,
+                                           auv_config.LEADER_LINK)
                         ])
 
 
@@ -252,7 +280,8 @@ def const_tree(auv_config):
                                 C_NoNewPOIDetected(common_globals.POI_DIST),
                                 A_UpdateMissonForPOI(auv_config.UTM_LINK,
                                                      auv_config.LOCAL_LINK,
-                                                     auv_config.POI_DETECTOR_LINK)
+                                                     auv_config.POI_DETECTOR_LINK,
+                                                     tf_listener)
                             ])
 
         return Fallback(name="FB_AutonomousUpdates",
@@ -265,8 +294,8 @@ def const_tree(auv_config):
     def const_synch_tree():
         have_refined_mission = C_HaveRefinedMission()
         have_coarse_mission = C_HaveCoarseMission()
-        refine_mission = A_RefineMission(config.PATH_PLANNER_NAME,
-                                         config.PATH_TOPIC)
+        refine_mission = A_RefineMission(auv_config.PATH_PLANNER_NAME,
+                                         auv_config.PATH_TOPIC)
         # we need one here too, to initialize the mission in the first place
         # set dont_visit to True so we dont skip the first wp of the plan
         set_next_plan_action = A_SetNextPlanAction(do_not_visit=True)
@@ -342,10 +371,31 @@ def const_tree(auv_config):
 
 
 
+# the conditions that make decisions on sensor data, for bt_latency
+SENSOR_CONSUMERS = {'C_DepthOK': [bb_enums.DEPTH],
+                    'C_AltOK': [bb_enums.ALTITUDE],
+                    'C_LeakOK': [bb_enums.LEAK],
+                    'C_NoAbortReceived': [bb_enums.ABORT]}
+
+
 def main(config, catkin_ws_path):
 
     utm_zone = rospy.get_param("~utm_zone", common_globals.DEFAULT_UTM_ZONE)
     utm_band = rospy.get_param("~utm_band", common_globals.DEFAULT_UTM_BAND)
+    profile_ticks = rospy.get_param("~profile_ticks", common_globals.PROFILE_TICKS)
+    event_driven_ticks = rospy.get_param("~event_driven_ticks", common_globals.EVENT_DRIVEN_TICKS)
+    adaptive_tick_rate = rospy.get_param("~adaptive_tick_rate", common_globals.ADAPTIVE_TICK_RATE)
+    skip_unchanged_conditions = rospy.get_param("~skip_unchanged_conditions", common_globals.SKIP_UNCHANGED_CONDITIONS)
+    compiled_ticks = rospy.get_param("~compiled_ticks", common_globals.COMPILED_TICKS)
+    journal_ticks = rospy.get_param("~journal_ticks", common_globals.JOURNAL_TICKS)
+    measure_sensor_latency = rospy.get_param("~measure_sensor_latency", common_globals.MEASURE_SENSOR_LATENCY)
+    emergency_watchdog = rospy.get_param("~emergency_watchdog", common_globals.EMERGENCY_WATCHDOG)
+
+    # before anything is written to the blackboard
+    vehicle_state.install_blackboard_shim()
+    if skip_unchanged_conditions:
+        install_blackboard_versions()
+        rospy.loginfo("Conditions with unchanged blackboard inputs will not be re-evaluated")
 
     bb = pt.blackboard.Blackboard()
     bb.set(bb_enums.UTM_ZONE, utm_zone)
@@ -358,6 +408,11 @@ def main(config, catkin_ws_path):
         tree = const_tree(config)
         rospy.loginfo("Setting up tree")
         setup_ok = tree.setup(timeout=common_globals.SETUP_TIMEOUT)
+        # the cbf conditions fill this during a tick, it is published after
+        CBF_ACCUMULATOR.attach(tree, rospy.get_param("~cbf_keepalive_period", common_globals.CBF_KEEPALIVE_PERIOD))
+        # transforms are looked up once per tick
+        tf_cache = shared_tf_listener()
+        tf_cache.attach(tree)
         viz = pt.display.ascii_tree(tree.root)
         rospy.loginfo(viz)
         path = catkin_ws_path+'catkin_ws/src/smarc_missions/smarc_bt/last_ran_tree.txt'
@@ -365,23 +420,165 @@ def main(config, catkin_ws_path):
             f.write(viz)
             rospy.loginfo("Wrote the tree to {}".format(path))
 
+        profiler = None
+        if profile_ticks:
+            profiler = TickProfiler(tree.root, common_globals.PROFILED_SUBTREES)
+            profile_path = catkin_ws_path+'catkin_ws/src/smarc_missions/smarc_bt/tick_profile.txt'
+
+            def dump_profile(req):
+                report = profiler.report() + tf_cache.stats() + "\n"
+                rospy.loginfo(report)
+                with open(profile_path, 'w+') as f:
+                    f.write(report)
+                return TriggerResponse(success=True, message=report)
+
+            rospy.Service('~dump_tick_profile', Trigger, dump_profile)
+            rospy.loginfo("Profiling ticks, call ~dump_tick_profile to get a report")
+
+        if measure_sensor_latency:
+            latency_monitor = LatencyMonitor()
+            latency_monitor.instrument(tree.root, SENSOR_CONSUMERS)
+            latency_path = catkin_ws_path+'catkin_ws/src/smarc_missions/smarc_bt/sensor_latency.txt'
+
+            def dump_latency(req):
+                report = latency_monitor.report()
+                rospy.loginfo(report)
+                with open(latency_path, 'w+') as f:
+                    f.write(report)
+                return TriggerResponse(success=True, message=report)
+
+            rospy.Service('~dump_sensor_latency', Trigger, dump_latency)
+            rospy.loginfo("Measuring sensor latencies, call ~dump_sensor_latency to get a report")
+
+        # the neptus feedback reads the tip of the last tick from here
+        tick_trace = TickTrace(tree.root, common_globals.TICK_TRACE_LENGTH)
+        bb.set(bb_enums.TICK_TRACE, tick_trace)
+        trace_path = catkin_ws_path+'catkin_ws/src/smarc_missions/smarc_bt/tick_trace.txt'
+
+        def dump_trace(req=None):
+            tick_trace.dump(trace_path)
+            rospy.loginfo("Wrote the last {} ticks to {}".format(len(tick_trace), trace_path))
+            return TriggerResponse(success=True, message=trace_path)
+
+        rospy.Service('~dump_tick_trace', Trigger, dump_trace)
+        rospy.on_shutdown(dump_trace)
+
+        journal = None
+        if journal_ticks:
+            journal_path = catkin_ws_path+'catkin_ws/src/smarc_missions/smarc_bt/tick_journal.bin'
+            journal = TickJournal(journal_path, common_globals.JOURNAL_MAX_BYTES, tick_trace,
+                                  keep_previous=common_globals.JOURNAL_KEEP_PREVIOUS)
+            rospy.on_shutdown(journal.close)
+            rospy.loginfo("Journaling the last {} ticks into {}".format(journal.capacity, journal_path))
+
+        # ticks the same tree, just without the py_trees generators
+        ticker = tree
+        if compiled_ticks:
+            ticker = CompiledTree(tree)
+            rospy.loginfo("Ticking a compiled tree of {} nodes".format(ticker.num_nodes))
+
         if setup_ok:
             rospy.loginfo("Ticktocking....")
-            rate = rospy.Rate(common_globals.BT_TICK_RATE)
+            tick_rate = common_globals.BT_TICK_RATE
+            tick_period = 1.0/tick_rate
+            rate = rospy.Rate(tick_rate)
+
+            rate_scheduler = None
+            if adaptive_tick_rate:
+                rate_scheduler = TickRateScheduler(tree,
+                                                   common_globals.TICK_RATES,
+                                                   common_globals.TICK_RATE_ACTIVE_ACTIONS,
+                                                   common_globals.TICK_RATE_IDLE_CONDITIONS,
+                                                   common_globals.TICK_RATE_HYSTERESIS,
+                                                   safety_subtrees = common_globals.SAFETY_SUBTREES,
+                                                   safety_rate = common_globals.SAFETY_MIN_TICK_RATE)
+
+            tick_trigger = None
+            if event_driven_ticks:
+                # after tree setup, so that the tree reads these messages before we tick
+                tick_trigger = TickTrigger(common_globals.EVENT_TICK_MAX_RATE)
+                tick_trigger.watch(config.ABORT_TOPIC, Empty)
+                tick_trigger.watch(config.LEAK_TOPIC, Leak)
+                tick_trigger.watch(config.DEPTH_TOPIC, Float64)
+                rospy.loginfo("Abort, leak and depth messages will trigger extra ticks")
+
+            if emergency_watchdog:
+                emergency_action = None
+                maneuver_actions = []
+                readers = {}
+                maneuver_names = bb.get(bb_enums.MANEUVER_ACTIONS)
+                for node in tree.root.iterate():
+                    if isinstance(node, A_EmergencySurface):
+                        emergency_action = node
+                    elif node.name in ("A_ReadLeak", "A_ReadAbort"):
+                        readers[node.name] = node
+                    elif node.name in maneuver_names and hasattr(node, 'action_client'):
+                        maneuver_actions.append(node)
+                by_force = None
+                if common_globals.EMERGENCY_WATCHDOG_BY_FORCE:
+                    by_force = A_EmergencySurfaceByForce(config.EMERGENCY_TOPIC,
+                                                         config.VBS_CMD_TOPIC,
+                                                         config.RPM_CMD_TOPIC,
+                                                         config.LCG_PID_ENABLE_TOPIC,
+                                                         config.VBS_PID_ENABLE_TOPIC,
+                                                         config.TCG_PID_ENABLE_TOPIC,
+                                                         config.YAW_PID_ENABLE_TOPIC,
+                                                         config.DEPTH_PID_ENABLE_TOPIC,
+                                                         config.VEL_PID_ENABLE_TOPIC)
+                    by_force.setup(common_globals.SETUP_TIMEOUT)
+
+                watchdog = EmergencyWatchdog(config.LEAK_TOPIC,
+                                             config.ABORT_TOPIC,
+                                             emergency_action = emergency_action,
+                                             by_force = by_force,
+                                             max_dispatch_time = common_globals.EMERGENCY_DISPATCH_BOUND,
+                                             on_emergency = None if tick_trigger is None else tick_trigger.request,
+                                             maneuver_actions = maneuver_actions,
+                                             leak_reader = readers.get("A_ReadLeak"),
+                                             abort_reader = readers.get("A_ReadAbort"))
+                watchdog.setup()
+                rospy.on_shutdown(watchdog.shutdown)
+                rospy.loginfo("Leak and abort messages will start surfacing without waiting for a tick")
+            next_periodic_tick = time.time() + tick_period
 
             while not rospy.is_shutdown():
-                tip = tree.tip()
-                if tip is None:
-                    bb.set(bb_enums.TREE_TIP_NAME, '')
-                    bb.set(bb_enums.TREE_TIP_STATUS, 'Status.X')
-                else:
-                    bb.set(bb_enums.TREE_TIP_NAME, tip.name)
-                    bb.set(bb_enums.TREE_TIP_STATUS, str(tip.status))
-
-                tree.tick()
+                if tick_trigger is not None:
+                    tick_trigger.tick_started()
+
+                # a slow tree still checks for leaks and aborts often enough,
+                # in between its full ticks only the safety subtrees are ticked
+                if rate_scheduler is None or not rate_scheduler.tick_safety():
+                    if profiler is not None:
+                        profiler.start_tick()
+                    tick_start = time.time()
+                    ticker.tick()
+                    tick_trace.record(tree.tip(), time.time() - tick_start)
+                    if journal is not None:
+                        journal.record(vehicle_state.VEHICLE_STATE, bb)
+                    if profiler is not None:
+                        profiler.end_tick()
+                        if profiler.last_tick_duration > tick_period:
+                            slowest, slowest_t = profiler.slowest_in_last_tick()
+                            rospy.logwarn_throttle(5, "Tick took {:.1f}ms, slowest was {} with {:.1f}ms".format(
+                                profiler.last_tick_duration*1000, slowest, slowest_t*1000))
+
+                    if rate_scheduler is not None:
+                        new_rate = rate_scheduler.update()
+                        if new_rate != tick_rate:
+                            rospy.loginfo("Tree is {}, ticking at {}Hz, safety at {}Hz".format(
+                                rate_scheduler.mode, rate_scheduler.rate, new_rate))
+                            tick_rate = new_rate
+                            tick_period = 1.0/tick_rate
+                            rate = rospy.Rate(tick_rate)
 
                 #  pt.display.print_ascii_tree(tree.root, show_status=True)
-                rate.sleep()
+                if tick_trigger is None:
+                    rate.sleep()
+                elif not tick_trigger.wait(next_periodic_tick):
+                    # a periodic tick is due, extra ticks do not shift these
+                    next_periodic_tick += tick_period
+                    if next_periodic_tick < time.time():
+                        next_periodic_tick = time.time() + tick_period
 
         else:
             rospy.logerr("Tree could not be setup! Exiting!")
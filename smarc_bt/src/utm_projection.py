@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+Lat/lon to UTM for whole arrays of points at once, with numpy.
+
+Gives the same eastings/northings as geodesy.utm.fromLatLong, which is
+what the utm frame of our tf tree uses. That includes geodesy's conventions:
+    - every point is projected in its own zone, no Norway/Svalbard exceptions
+    - there is no false northing in the southern hemisphere, northings are negative there
+
+Uses the Krüger series to the 6th order of n, as in
+C. Karney, Transverse Mercator with an accuracy of a few nanometers, 2011.
+Within a zone it agrees with geodesy to well under a millimeter.
+
+    eastings, northings, zones = latlon_to_utm(lats_deg, lons_deg)
+
+The other way around for a single moving point, LocalLatLonProjector is a
+first order model that is re-anchored as the point moves, with an error bound
+from the second order term of the projection.
+"""
+
+import math
+import numpy as np
+
+# WGS84
+A = 6378137.0
+F = 1/298.257223563
+K0 = 0.9996
+FALSE_EASTING = 500000.0
+
+_BAND_LETTERS = "CDEFGHJKLMNPQRSTUVWXX"
+
+_E = np.sqrt(F*(2-F))
+_N = F/(2-F)
+# rectifying radius
+_A_RECT = A/(1+_N) * (1 + _N**2/4. + _N**4/64. + _N**6/256.)
+
+# alpha_1..6 of the forward series
+_ALPHA = np.array([
+    _N/2. - 2*_N**2/3. + 5*_N**3/16. + 41*_N**4/180. - 127*_N**5/288. + 7891*_N**6/37800.,
+    13*_N**2/48. - 3*_N**3/5. + 557*_N**4/1440. + 281*_N**5/630. - 1983433*_N**6/1935360.,
+    61*_N**3/240. - 103*_N**4/140. + 15061*_N**5/26880. + 167603*_N**6/181440.,
+    49561*_N**4/161280. - 179*_N**5/168. + 6601661*_N**6/7257600.,
+    34729*_N**5/80640. - 3418889*_N**6/1995840.,
+    212378941*_N**6/319334400.])
+_J2 = 2*np.arange(1, len(_ALPHA)+1)
+
+
+def utm_zones(lons_deg):
+    """
+    the utm zone of every longitude, same as geodesy.utm.gridZone
+    """
+    lons_deg = np.asarray(lons_deg, dtype=float)
+    if np.any(lons_deg < -180.0) or np.any(lons_deg > 180.0):
+        raise ValueError("invalid longitude in: "+str(lons_deg))
+    return np.floor((lons_deg + 180.0)/6.0).astype(int) + 1
+
+
+def utm_bands(lats_deg):
+    """
+    the latitude band letter of every latitude, same as geodesy.utm.gridZone
+    """
+    lats_deg = np.asarray(lats_deg, dtype=float)
+    if np.any(lats_deg < -80.0) or np.any(lats_deg > 84.0):
+        raise ValueError("latitude out of UTM range in: "+str(lats_deg))
+    # 72-84 is all X, which is the last letter twice
+    i = np.minimum(np.floor((lats_deg + 80.0)/8.0).astype(int), len(_BAND_LETTERS)-1)
+    return np.array(list(_BAND_LETTERS))[i]
+
+
+def zone_central_meridian(zone):
+    """
+    degrees
+    """
+    return (np.asarray(zone)-1)*6.0 - 180.0 + 3.0
+
+
+def latlon_to_utm(lats_deg, lons_deg, zones=None):
+    """
+    eastings, northings and zones of all the given points.
+    if zones is given, the points are projected in those instead of their own.
+    """
+    lats_deg = np.asarray(lats_deg, dtype=float)
+    lons_deg = np.asarray(lons_deg, dtype=float)
+    if zones is None:
+        zones = utm_zones(lons_deg)
+    zones = np.broadcast_to(zones, lats_deg.shape)
+
+    phi = np.radians(lats_deg)
+    lam = np.radians(lons_deg - zone_central_meridian(zones))
+
+    # conformal latitude
+    sin_phi = np.sin(phi)
+    t = np.sinh(np.arctanh(sin_phi) - _E*np.arctanh(_E*sin_phi))
+    xi_ = np.arctan2(t, np.cos(lam))
+    eta_ = np.arctanh(np.sin(lam)/np.sqrt(1 + t*t))
+
+    # all 6 terms of the series at once, points along the first axis
+    xi2 = np.multiply.outer(xi_, _J2)
+    eta2 = np.multiply.outer(eta_, _J2)
+    xi = xi_ + np.sum(_ALPHA*np.sin(xi2)*np.cosh(eta2), axis=-1)
+    eta = eta_ + np.sum(_ALPHA*np.cos(xi2)*np.sinh(eta2), axis=-1)
+
+    eastings = FALSE_EASTING + K0*_A_RECT*eta
+    northings = K0*_A_RECT*xi
+    return eastings, northings, zones
+
+
+class LocalLatLonProjector(object):
+    """
+    UTM to lat/lon with a first order model around an anchor point.
+    The anchor, its lat/lon and the jacobian are found with geodesy, and the
+    anchor moves when a point is further than radius from it or in another zone/band.
+
+    What a first order model leaves out is, to second order, 0.5 * d^T H d for the
+    hessians H of lat and lon over easting and northing, at a displacement d from the anchor.
+    Every time it re-anchors, H is found with geodesy too. Within radius, that is at most
+        0.5 * radius^2 * |J^-1| * hypot(|H_lat|, |H_lon|)
+    meters, with the spectral norms of the matrices and J^-1 taking the error back from degrees.
+    The terms after that are ~radius/6400km of it, THIRD_ORDER_MARGIN covers them.
+    error_bound is that, in meters. radius is as large as it can be
+    with error_bound <= max_error, but never more than refresh_distance.
+
+        projector = LocalLatLonProjector(refresh_distance=500, max_error=0.05)
+        lat, lon = projector.to_latlon(easting, northing, zone, band)
+    """
+    # on top of the second order bound, for the higher order terms.
+    # those are ~radius/6400km of it, so this is plenty up to tens of kilometers
+    THIRD_ORDER_MARGIN = 1.01
+    # meters, step of the finite differences. large enough that the rounding
+    # of the degrees does not matter, small enough that the series does not
+    FD_STEP = 100.
+
+    def __init__(self, refresh_distance=500., max_error=0.05):
+        self.refresh_distance = float(refresh_distance)
+        self.max_error = float(max_error)
+
+        # meters, what the current anchor is good for
+        self.radius = None
+        self.error_bound = None
+
+        self.num_calls = 0
+        self.num_anchors = 0
+
+        self._zone = None
+        self._band = None
+        self._e0 = None
+        self._n0 = None
+        self._latlon0 = None
+        # d(lat, lon)/d(easting, northing), degrees per meter
+        self._jacobian = None
+        self._lat0 = None
+        self._lon0 = None
+        self._coefs = None
+
+    @staticmethod
+    def _exact(easting, northing, zone, band):
+        # here so that utm_projection itself does not need geodesy
+        from geodesy.utm import UTMPoint
+        msg = UTMPoint(easting=easting, northing=northing, altitude=0, zone=zone, band=band).toMsg()
+        return np.array([msg.latitude, msg.longitude])
+
+    def anchor(self, easting, northing, zone, band):
+        self._zone = zone
+        self._band = band
+        self._e0 = easting
+        self._n0 = northing
+        h = self.FD_STEP
+        def exact(i, j):
+            return self._exact(easting + i*h, northing + j*h, zone, band)
+
+        # central differences on a 3x3 grid around the anchor
+        f = {}
+        for i in [-1, 0, 1]:
+            for j in [-1, 0, 1]:
+                f[i, j] = exact(i, j)
+        self._latlon0 = f[0, 0]
+        d_de = (f[1, 0] - f[-1, 0])/(2*h)
+        d_dn = (f[0, 1] - f[0, -1])/(2*h)
+        self._jacobian = np.column_stack((d_de, d_dn))
+        self._lat0, self._lon0 = self._latlon0.tolist()
+        self._coefs = self._jacobian.tolist()
+
+        d_dede = (f[1, 0] - 2*f[0, 0] + f[-1, 0])/(h*h)
+        d_dndn = (f[0, 1] - 2*f[0, 0] + f[0, -1])/(h*h)
+        d_dedn = (f[1, 1] - f[1, -1] - f[-1, 1] + f[-1, -1])/(4*h*h)
+        # max of |d^T H d| over |d| = 1, the largest eigenvalue of the symmetric H
+        hessian_norms = [np.max(np.abs(np.linalg.eigvalsh([[d_dede[k], d_dedn[k]], [d_dedn[k], d_dndn[k]]])))
+                         for k in range(2)]
+        # error <= coef * distance^2, in meters
+        coef = self.THIRD_ORDER_MARGIN * 0.5 * np.linalg.norm(np.linalg.inv(self._jacobian), 2) * math.hypot(*hessian_norms)
+
+        self.radius = self.refresh_distance
+        self.error_bound = coef*self.radius*self.radius
+        if self.error_bound > self.max_error:
+            self.radius = math.sqrt(self.max_error/coef)
+            self.error_bound = self.max_error
+
+        self.num_anchors += 1
+
+    def to_latlon(self, easting, northing, zone, band):
+        """
+        degrees, same as geodesy.utm.UTMPoint(...).toMsg() to within error_bound meters
+        """
+        self.num_calls += 1
+        if self._jacobian is None or \
+           zone != self._zone or \
+           band != self._band or \
+           math.hypot(easting - self._e0, northing - self._n0) > self.radius:
+            self.anchor(easting, northing, zone, band)
+
+        # plain floats, numpy is slower than this for 2x2
+        de = easting - self._e0
+        dn = northing - self._n0
+        (lat_e, lat_n), (lon_e, lon_n) = self._coefs
+        return self._lat0 + lat_e*de + lat_n*dn, self._lon0 + lon_e*de + lon_n*dn
+
+
+def grid_zone(lat_deg, lon_deg):
+    """
+    (zone, band) of a single point, same as geodesy.utm.gridZone.
+    (None, None) if the point is not in any, where geodesy would raise
+    or give the ' ' band. a bad gps fix should not kill the tree.
+    """
+    # written so that NaNs are out of range too
+    if not (-180.0 <= lon_deg <= 180.0 and -80.0 <= lat_deg <= 84.0):
+        return None, None
+    zone = int((lon_deg + 180.0)//6.0) + 1
+    band = _BAND_LETTERS[min(int((lat_deg + 80.0)//8.0), len(_BAND_LETTERS)-1)]
+    return zone, band
+
+
+def grid_zone_cell(zone, band):
+    """
+    (lat_min, lat_max, lon_min, lon_max) of a zone and band, degrees
+    """
+    i = _BAND_LETTERS.index(band)
+    lat_min = -80.0 + 8.0*i
+    # X is 12 degrees tall
+    lat_max = 84.0 if band == 'X' else lat_min + 8.0
+    lon_min = (zone - 1)*6.0 - 180.0
+    return lat_min, lat_max, lon_min, lon_min + 6.0
+
+
+class UTMZoneResolver(object):
+    """
+    The zone and band of a moving point, without working them out every time.
+
+    Remembers the cell of the current zone and band, and keeps giving them as long
+    as the point is in the cell or less than hysteresis meters out of it. Only then
+    is the zone and band found again, so a point moving along a zone edge does not
+    switch zones back and forth.
+    A point that is in no zone and band gives (None, None) and the cell is kept.
+
+        resolver = UTMZoneResolver(hysteresis=50)
+        zone, band = resolver.resolve(lat, lon)
+    """
+    def __init__(self, hysteresis=50.):
+        # meters
+        self.hysteresis = float(hysteresis)
+        self.zone = None
+        self.band = None
+
+        self.num_calls = 0
+        self.num_resolved = 0
+
+        # the cell grown by the hysteresis, degrees
+        self._lat_min = None
+        self._lat_max = None
+        self._lon_min = None
+        self._lon_max = None
+
+    def _set_cell(self, zone, band):
+        lat_min, lat_max, lon_min, lon_max = grid_zone_cell(zone, band)
+        # a degree of longitude is smallest at the pole side of the cell
+        m_per_deg_lat = 111320.
+        m_per_deg_lon = 111320. * max(math.cos(math.radians(max(abs(lat_min), abs(lat_max)))), 1e-6)
+        d_lat = self.hysteresis / m_per_deg_lat
+        d_lon = self.hysteresis / m_per_deg_lon
+        self._lat_min = lat_min - d_lat
+        self._lat_max = lat_max + d_lat
+        self._lon_min = lon_min - d_lon
+        self._lon_max = lon_max + d_lon
+
+    def resolve(self, lat_deg, lon_deg):
+        self.num_calls += 1
+        if self.zone is not None and \
+           self._lat_min <= lat_deg < self._lat_max and \
+           self._lon_min <= lon_deg < self._lon_max:
+            return self.zone, self.band
+
+        zone, band = grid_zone(lat_deg, lon_deg)
+        self.num_resolved += 1
+        if zone is None:
+            # keep the cell we had, the next good fix is probably in it
+            return None, None
+        if zone != self.zone or band != self.band:
+            self.zone = zone
+            self.band = band
+            self._set_cell(zone, band)
+        return self.zone, self.band
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+# Ozer Ozkahraman (ozero@kth.se)
+
+"""
+The most used blackboard variables as plain attributes of one object.
+
+    import vehicle_state
+    vs = vehicle_state.VEHICLE_STATE
+    if vs.depth > 10: ...
+
+Every field has a version that goes up when a different object is written to it,
+check it with vs.versions[VehicleState.DEPTH] or vs.changed_since(...).
+
+The blackboard keys of these fields keep working, bb.set(bb_enums.DEPTH, x)
+writes vs.depth and vs.depth = x is also seen by bb.get(bb_enums.DEPTH).
+Call install_blackboard_shim() once before the tree is built to set that up.
+"""
+
+import py_trees as pt
+
+import bb_enums
+from bt_common import bump_bb_version, redirect_blackboard_keys
+
+
+# (field name, blackboard key)
+FIELDS = [('depth', bb_enums.DEPTH),
+          ('altitude', bb_enums.ALTITUDE),
+          ('leak', bb_enums.LEAK),
+          ('abort', bb_enums.ABORT),
+          ('world_trans', bb_enums.WORLD_TRANS),
+          ('world_rot', bb_enums.WORLD_ROT),
+          ('lat', bb_enums.CURRENT_LATITUDE),
+          ('lon', bb_enums.CURRENT_LONGITUDE),
+          ('utm_zone', bb_enums.UTM_ZONE),
+          ('utm_band', bb_enums.UTM_BAND),
+          ('mission_plan', bb_enums.MISSION_PLAN_OBJ),
+          ('plan_is_go', bb_enums.PLAN_IS_GO)]
+
+# blackboard key -> field index
+FIELD_OF_KEY = dict((key, i) for i, (name, key) in enumerate(FIELDS))
+
+# the dict every Blackboard instance uses as its __dict__
+_BB_STATE = pt.blackboard.Blackboard().__dict__
+
+
+def _field(i, name, key):
+    slot = '_'+name
+    def get(self):
+        return getattr(self, slot)
+    def set(self, value):
+        if getattr(self, slot) is not value:
+            self.versions[i] += 1
+            bump_bb_version(key)
+        object.__setattr__(self, slot, value)
+        # so that bb.get still sees it
+        _BB_STATE[key] = value
+    return property(get, set)
+
+
+class VehicleState(object):
+    __slots__ = ['_'+name for name, key in FIELDS] + ['versions']
+
+    def __init__(self):
+        self.versions = [0]*len(FIELDS)
+        for name, key in FIELDS:
+            object.__setattr__(self, '_'+name, None)
+
+    def changed_since(self, field_index, version):
+        return self.versions[field_index] != version
+
+    def reset(self):
+        """
+        all fields back to None, versions keep counting
+        """
+        for name, key in FIELDS:
+            setattr(self, name, None)
+
+for _i, (_name, _key) in enumerate(FIELDS):
+    setattr(VehicleState, _name, _field(_i, _name, _key))
+    # VehicleState.DEPTH etc. for the versions list
+    setattr(VehicleState, _name.upper(), _i)
+
+
+VEHICLE_STATE = VehicleState()
+
+
+
+_shim_installed = False
+
+def install_blackboard_shim():
+    """
+    blackboard writes to the keys above go through VEHICLE_STATE instead.
+    only does something the first time it is called.
+    """
+    global _shim_installed
+    if _shim_installed:
+        return
+    def redirect(name):
+        def write(value):
+            setattr(VEHICLE_STATE, name, value)
+        return write
+    redirect_blackboard_keys(dict((key, redirect(name)) for name, key in FIELDS))
+    _shim_installed = True
+
+    # anything written before this
+    for name, key in FIELDS:
+        if key in _BB_STATE:
+            setattr(VEHICLE_STATE, name, _BB_STATE[key])
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+The blackboard versions of bt_common and the vehicle_state shim, together.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import bt_bench
+import bb_enums
+import bt_common
+import vehicle_state
+import py_trees as pt
+
+
+class TestBlackboardHooks(unittest.TestCase):
+    def setUp(self):
+        bt_bench.forget_previous_run()
+        # either order, any number of times
+        vehicle_state.install_blackboard_shim()
+        bt_common.install_blackboard_versions()
+        vehicle_state.install_blackboard_shim()
+        bt_common.install_blackboard_versions()
+
+    def test_installed_once(self):
+        self.assertIs(pt.blackboard.Blackboard.__dict__['__setattr__'], bt_common._bb_setattr)
+
+    def test_vehicle_state_key(self):
+        bb = pt.blackboard.Blackboard()
+        vs = vehicle_state.VEHICLE_STATE
+        version = bt_common.bb_version(bb_enums.DEPTH)
+        field_version = vs.versions[vehicle_state.VehicleState.DEPTH]
+        depth = 3.5
+        bb.set(bb_enums.DEPTH, depth)
+        self.assertIs(vs.depth, depth)
+        self.assertIs(bb.get(bb_enums.DEPTH), depth)
+        self.assertEqual(bt_common.bb_version(bb_enums.DEPTH), version+1)
+        self.assertEqual(vs.versions[vehicle_state.VehicleState.DEPTH], field_version+1)
+        # the same object again is not a change
+        bb.set(bb_enums.DEPTH, depth)
+        self.assertEqual(bt_common.bb_version(bb_enums.DEPTH), version+1)
+
+        vs.depth = 4.
+        self.assertEqual(bb.get(bb_enums.DEPTH), 4.)
+        self.assertEqual(bt_common.bb_version(bb_enums.DEPTH), version+2)
+
+    def test_other_key(self):
+        bb = pt.blackboard.Blackboard()
+        version = bt_common.bb_version('test_other_key')
+        bb.set('test_other_key', 1)
+        self.assertEqual(bb.get('test_other_key'), 1)
+        self.assertEqual(bt_common.bb_version('test_other_key'), version+1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+MissionPlan pose arrays, progress and refined waypoints, through the checks of bt_bench.
+"""
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import bt_bench
+from mission_plan import refined_to_coarse_indices
+
+
+def dense_lawnmower(num_legs, leg_length, spacing, step):
+    """
+    coarse waypoints every step meters along a lawnmower with legs spacing meters apart.
+    returns the waypoints and the index of the first one of every leg
+    """
+    waypoints = []
+    leg_starts = []
+    for leg in range(num_legs):
+        y = leg*spacing
+        xs = np.arange(0., leg_length+step/2., step)
+        if leg % 2 == 1:
+            xs = xs[::-1]
+        leg_starts.append(len(waypoints))
+        waypoints.extend((x, y, 2.) for x in xs)
+    return np.array(waypoints), leg_starts
+
+
+class TestMissionPlan(unittest.TestCase):
+    def test_plan(self):
+        problems, _, _, _ = bt_bench.check_plan(500, num_calls=100)
+        self.assertEqual(problems, [])
+
+    def test_refined_to_coarse(self):
+        problems, _, _ = bt_bench.check_progress(500)
+        self.assertEqual(problems, [])
+
+    def test_refined_to_coarse_sharp_turns(self):
+        # legs 2m apart with a waypoint every meter, the refined path is sparser than that
+        # and swings 2.5m wide at every turn, close to the leg after the next one
+        waypoints, leg_starts = dense_lawnmower(20, 40., 2., 1.)
+        refined = []
+        on_leg = []
+        for leg in range(20):
+            y = leg*2.
+            xs = np.arange(1.5, 39., 2.5)
+            if leg % 2 == 1:
+                xs = xs[::-1]
+            for x in xs:
+                refined.append((x, y+0.3, 2.))
+                on_leg.append(leg)
+            if leg < 19:
+                end_x = 40. if leg % 2 == 0 else 0.
+                out = 1. if leg % 2 == 0 else -1.
+                refined.append((end_x + out*1.5, y+3.9, 2.))
+                on_leg.append(None)
+        refined = np.array(refined)
+
+        indices = refined_to_coarse_indices(refined, waypoints)
+        self.assertTrue(np.all(np.diff(indices) >= 0))
+        leg_ends = leg_starts[1:] + [len(waypoints)]
+        for i, leg in enumerate(on_leg):
+            if leg is None:
+                continue
+            # the segments of a leg end at its waypoints, the first one comes from the turn
+            self.assertTrue(leg_starts[leg] <= indices[i] < leg_ends[leg],
+                            "refined {} on leg {} went to waypoint {}, the leg is {}..{}".format(
+                                i, leg, indices[i], leg_starts[leg], leg_ends[leg]-1))
+
+    def test_refined_to_coarse_dense_coarse(self):
+        # more than a chunk of refined points worth of coarse waypoints between two refined points
+        waypoints = np.array([(x, 0., 2.) for x in np.arange(0., 1000.5, 0.5)])
+        refined = np.array([(x, 0.2, 2.) for x in np.arange(0., 1001., 25.)])
+        indices = refined_to_coarse_indices(refined, waypoints)
+        expected = [int(math.ceil(x/0.5)) for x in refined[:,0]]
+        self.assertEqual(indices.tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
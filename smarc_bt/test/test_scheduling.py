@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+bt_scheduling.TickRateScheduler on the sam tree, against the stand-ins of bt_bench.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import bt_bench
+import bt_common
+import common_globals
+import bb_enums
+import vehicle_state
+import py_trees as pt
+from std_msgs.msg import Float64
+from bt_bench import WORLD
+from bt_scheduling import TickRateScheduler
+
+
+class TestTickRateScheduler(unittest.TestCase):
+    def make(self, **kwargs):
+        config, mission = bt_bench.fresh_mission(**kwargs)
+        tree = bt_bench.build_tree(config)
+        scheduler = TickRateScheduler(tree,
+                                      common_globals.TICK_RATES,
+                                      common_globals.TICK_RATE_ACTIVE_ACTIONS,
+                                      common_globals.TICK_RATE_IDLE_CONDITIONS,
+                                      0.,
+                                      safety_subtrees = common_globals.SAFETY_SUBTREES,
+                                      safety_rate = common_globals.SAFETY_MIN_TICK_RATE)
+        return tree, mission, scheduler
+
+    def tick(self, tree, mission, scheduler, i):
+        """
+        one pass of the tick loop of sam_bt, returns True if it was a full tick
+        """
+        mission.feed(i)
+        full = not scheduler.tick_safety()
+        if full:
+            tree.tick()
+            scheduler.update()
+        WORLD.step()
+        return full
+
+    def test_active_while_moving(self):
+        tree, mission, scheduler = self.make(num_waypoints=5)
+        modes = set()
+        for i in range(20):
+            self.tick(tree, mission, scheduler, i)
+            modes.add(scheduler.mode)
+        self.assertIn('active', modes)
+
+    def test_safety_ticks_when_idle(self):
+        # never started, so the tree is idle
+        tree, mission, scheduler = self.make(start_tick=1000)
+        fulls = [self.tick(tree, mission, scheduler, i) for i in range(30)]
+        self.assertEqual(scheduler.mode, 'idle')
+        self.assertEqual(scheduler.loop_rate, common_globals.SAFETY_MIN_TICK_RATE)
+        per_full = int(round(float(common_globals.SAFETY_MIN_TICK_RATE)/common_globals.TICK_RATES['idle']))
+        self.assertEqual(fulls[-per_full:].count(True), 1)
+        self.assertGreater(scheduler.num_safety_ticks, 0)
+
+    def test_leak_in_a_safety_tick(self):
+        tree, mission, scheduler = self.make(start_tick=1000)
+        i = self.idle_until_safety_tick(tree, mission, scheduler)
+        # the leak is seen by the safety tick, which starts surfacing without waiting for a full tick
+        mission.leak_tick = i
+        self.assertFalse(self.tick(tree, mission, scheduler, i))
+        self.assertEqual(scheduler.mode, 'active')
+        self.assertTrue(self.tick(tree, mission, scheduler, i+1))
+
+    def idle_until_safety_tick(self, tree, mission, scheduler):
+        i = 0
+        while scheduler.mode != 'idle' or scheduler._safety_ticks_left == 0:
+            self.tick(tree, mission, scheduler, i)
+            i += 1
+        return i
+
+    def test_safety_tick_sees_the_vehicle_move(self):
+        tree, mission, scheduler = self.make(start_tick=1000)
+        i = self.idle_until_safety_tick(tree, mission, scheduler)
+        bb = pt.blackboard.Blackboard()
+        before = bb.get(bb_enums.WORLD_TRANS)
+        # far from where the scripted mission would be on the next feed
+        mission.feed(i)
+        trans = (mission.origin_e + 123., mission.origin_n + 45., -2.)
+        WORLD.set_transform(mission.config.UTM_LINK, mission.config.BASE_LINK, trans)
+        self.assertTrue(scheduler.tick_safety())
+        after = bb.get(bb_enums.WORLD_TRANS)
+        self.assertNotEqual(tuple(before), tuple(after))
+        self.assertEqual(tuple(after), trans)
+        self.assertEqual(tuple(vehicle_state.VEHICLE_STATE.world_trans), trans)
+
+    def test_safety_tick_cbf_list(self):
+        tree, mission, scheduler = self.make(start_tick=1000)
+        i = self.idle_until_safety_tick(tree, mission, scheduler)
+        accumulator = bt_common.CBF_ACCUMULATOR
+        after_full = list(accumulator.cbf_list.cbf_items)
+        mission.feed(i)
+        self.assertTrue(scheduler.tick_safety())
+        items = accumulator.cbf_list.cbf_items
+        self.assertEqual(len(items), len(set(id(item) for item in items)))
+        self.assertEqual(items, after_full)
+
+        # a condition that fails in a safety tick is off the published list right away
+        num_published = accumulator.num_published
+        mission.feed(i+1)
+        WORLD.inject(mission.config.DEPTH_TOPIC, Float64(mission.config.MAX_DEPTH*2.))
+        scheduler._safety_ticks_left = max(scheduler._safety_ticks_left, 1)
+        self.assertTrue(scheduler.tick_safety())
+        self.assertLess(len(accumulator.cbf_list.cbf_items), len(after_full))
+        self.assertEqual(accumulator.num_published, num_published+1)
+
+
+if __name__ == '__main__':
+    unittest.main()
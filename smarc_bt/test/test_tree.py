@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+The sam tree against the stand-ins of bt_bench, no ros master needed.
+
+    python -m unittest discover -s smarc_bt/test
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# installs the stand-ins, has to come before anything that imports rospy
+import bt_bench
+import bt_common
+import common_globals
+from bt_journal import read_journal, read_journal_nodes
+
+
+class TestTree(unittest.TestCase):
+    def test_mission_runs(self):
+        r = bt_bench.run(50, num_waypoints=5, warmup=2)
+        self.assertEqual(r['ticks'], 50)
+        self.assertIsNotNone(r['tip'])
+
+    def test_compiled_ticks_like_py_trees(self):
+        for leak_tick in [None, 10]:
+            diffs = bt_bench.check_compiled(200, 5, leak_tick)
+            self.assertEqual(diffs, [], "leak at {}: {}".format(leak_tick, diffs[:5]))
+
+    def test_compiled_ticks_like_py_trees_skip_unchanged(self):
+        bt_common.install_blackboard_versions()
+        diffs = bt_bench.check_compiled(200, 5, 10)
+        self.assertEqual(diffs, [], str(diffs[:5]))
+
+    def test_watchdog_surfaces(self):
+        for by_force in [False, True]:
+            latencies, problems = bt_bench.check_watchdog(4, by_force=by_force)
+            self.assertEqual(problems, [])
+            self.assertEqual(len(latencies), 4)
+            for l in latencies:
+                self.assertLessEqual(l, common_globals.EMERGENCY_DISPATCH_BOUND)
+
+    def test_watchdog_stops_the_tree_before_it_hears(self):
+        latencies, problems = bt_bench.check_watchdog(4, delay_tree_delivery=True)
+        self.assertEqual(problems, [])
+        self.assertEqual(len(latencies), 4)
+
+    def test_journal_reads_back(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'journal')
+            r = bt_bench.run(30, num_waypoints=5, warmup=0, journal_path=path)
+            records = read_journal(path)
+            names = read_journal_nodes(path)
+            self.assertEqual(len(records), 30)
+            self.assertEqual(names[records['tip_id'][-1]], r['tip'])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_journal_keeps_previous_runs(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'journal')
+            for num_ticks in [10, 20, 30, 40, 50]:
+                bt_bench.run(num_ticks, num_waypoints=5, warmup=0, journal_path=path)
+            self.assertEqual(len(read_journal(path)), 50)
+            for i in range(1, common_globals.JOURNAL_KEEP_PREVIOUS+1):
+                previous = '{}.{}'.format(path, i)
+                self.assertEqual(len(read_journal(previous)), 50 - 10*i)
+                self.assertTrue(len(read_journal_nodes(previous)) > 0)
+            self.assertFalse(os.path.exists('{}.{}'.format(path, common_globals.JOURNAL_KEEP_PREVIOUS+1)))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
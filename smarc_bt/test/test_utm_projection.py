@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+
+"""
+utm_projection against geodesy, through the checks of bt_bench.
+"""
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import bt_bench
+import common_globals
+from geodesy.utm import fromLatLong
+from utm_projection import LocalLatLonProjector, UTMZoneResolver, grid_zone, latlon_to_utm
+
+
+class TestUTMProjection(unittest.TestCase):
+    def test_latlon_to_utm(self):
+        max_error, max_diff, _, _ = bt_bench.check_utm(2000, 200, repeats=1)
+        self.assertLess(max_error, 1e-3)
+        self.assertLess(max_diff, 1e-3)
+
+    def test_local_projector(self):
+        results, _, _ = bt_bench.check_latlon(500, num_calls=100)
+        for lat0, max_error, max_bound, num_anchors in results:
+            self.assertLessEqual(max_error, max_bound, "at lat {}".format(lat0))
+            self.assertLessEqual(max_bound, common_globals.LATLON_MAX_ERROR, "at lat {}".format(lat0))
+
+    def test_error_bound_holds_on_the_circle(self):
+        # the model is worst at the edge of its radius, also far bigger radii than we use
+        for lat in [0., 30., 58., 70., 83.]:
+            for lon in [3.1, 17.9]:
+                utm = fromLatLong(lat, lon)
+                for refresh_distance, max_error in [(500, 0.05), (20000, 1000.)]:
+                    projector = LocalLatLonProjector(refresh_distance, max_error)
+                    projector.anchor(utm.easting, utm.northing, utm.zone, utm.band)
+                    self.assertLessEqual(projector.error_bound, max_error)
+                    angles = np.linspace(0., 2*np.pi, 32, endpoint=False)
+                    es = utm.easting + projector.radius*np.cos(angles)
+                    ns = utm.northing + projector.radius*np.sin(angles)
+                    latlons = np.array([projector.to_latlon(e, n, utm.zone, utm.band) for e, n in zip(es, ns)])
+                    model_es, model_ns, _ = latlon_to_utm(latlons[:,0], latlons[:,1], zones=utm.zone)
+                    worst = np.max(np.hypot(model_es - es, model_ns - ns))
+                    self.assertLessEqual(worst, projector.error_bound,
+                                         "at {},{} radius {}".format(lat, lon, projector.radius))
+
+    def test_zone_resolver(self):
+        disagreements, switches, _, _, _ = bt_bench.check_zones(2000, num_calls=100)
+        self.assertEqual(disagreements, [])
+        self.assertEqual(switches, 1)
+
+    def test_fix_outside_utm(self):
+        for lat, lon in [(85., 10.), (-81., 10.), (58., 181.), (float('nan'), 10.), (58., float('nan'))]:
+            self.assertEqual(grid_zone(lat, lon), (None, None))
+        resolver = UTMZoneResolver()
+        self.assertEqual(resolver.resolve(58., 10.), (32, 'V'))
+        self.assertEqual(resolver.resolve(85., 10.), (None, None))
+        self.assertEqual(resolver.resolve(58., 10.001), (32, 'V'))
+        self.assertEqual(resolver.num_resolved, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()